@@ -5,17 +5,20 @@ import sys, traceback
 from werkzeug import ClosingIterator, Request, SharedDataMiddleware, DebuggedApplication
 from werkzeug.exceptions import HTTPException, NotFound, InternalServerError, Forbidden
 from werkzeug.routing import Map, Rule
-from werkzeug.contrib.sessions import FilesystemSessionStore
 # local imports
 from controllers import controller_lookup
-from controllers.baseController import BaseController
-from utils.utils import ROOT_DIR, local_manager, local, session, config
+from controllers.baseController import BaseController, lookup
+from utils.utils import ROOT_DIR, local_manager, local, session, config, UploadStream
+from utils.profiling import ProfilingMiddleware, profiling_enabled
+from utils.sessions import make_session_store
+from utils.templates import preload_templates, compile_templates
 
 sys.path.append('foreman')
 
 staticLocations = {
     '/css': path.join(ROOT_DIR, 'static', 'css'),
-    '/files': path.join(ROOT_DIR, 'files'),
+    # only the folders that anyone may see. Uploads are sent by the download pages, once the permissions are checked
+    '/user_profile_photos': path.join(ROOT_DIR, 'files', 'user_profile_photos'),
     '/images': path.join(ROOT_DIR, 'static', 'images'),
     '/javascript': path.join(ROOT_DIR, 'static', 'javascript'),
     '/evidence_qr_code': path.join(ROOT_DIR, 'files', 'evidence_QR_codes'),
@@ -25,6 +28,8 @@ staticLocations = {
 
 def make_app(session_store=None):
     application = Application(session_store=session_store)
+    if profiling_enabled():
+        application = ProfilingMiddleware(application)
     application = SharedDataMiddleware(application, staticLocations)
     application = local_manager.make_middleware(application)
 
@@ -33,16 +38,24 @@ def make_app(session_store=None):
     return application
 
 
+class ForemanRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        # uploads are hashed as they arrive, and written where they can be renamed into place
+        return UploadStream()
+
+
 class Application(object):
     def __init__(self, session_store=None):
         if session_store is None:
-            session_store = FilesystemSessionStore()
+            session_store = make_session_store()
         self.session_store = session_store
         self.url_map = self.make_url_map()
+        if preload_templates():
+            compile_templates(lookup)
 
     def __call__(self, environ, start_response):
         local.application = self
-        request = Request(environ)
+        request = ForemanRequest(environ)
         self.load_session(request)
         response = None
         try:
@@ -50,9 +63,11 @@ class Application(object):
             endpoint, vars = adapter.match()
             if 'userid' not in request.session and endpoint != "general.register":
                 endpoint = 'general.login'
+                environ['foreman.endpoint'] = endpoint
                 response = self.dispatch(request, adapter, endpoint, {})
                 response.status_code = 401
             else:
+                environ['foreman.endpoint'] = endpoint
                 response = self.dispatch(request, adapter, endpoint, vars)
         except NotFound:
             b = BaseController(request, adapter)
@@ -69,6 +84,8 @@ class Application(object):
             response = e
         finally:
             session.close()
+            # removes any uploads that were not stored
+            request.close()
             if response:
                 self.save_session(request, response)
         return ClosingIterator(response(environ, start_response),[local_manager.cleanup])
@@ -81,6 +98,7 @@ class Application(object):
             request.session = self.session_store.get(sid)
 
     def save_session(self, request, response):
+        # a session that has not changed is not written again, see utils.sessions for when its expiry is pushed back
         if request.session.should_save:
             self.session_store.save(request.session)
             response.set_cookie('foreman', request.session.sid)
@@ -111,6 +129,9 @@ class Application(object):
         map.add(Rule('/register/', endpoint='general.register'))
 
         map.add(Rule('/admin/', endpoint='general.admin'))
+        map.add(Rule('/admin/profiling/', endpoint='general.profiling'))
+        map.add(Rule('/admin/integrity/', endpoint='general.integrity'))
+        map.add(Rule('/search/', endpoint='general.search'))
 
         map.add(Rule('/cases/', endpoint='case.view_all'))
         map.add(Rule('/cases/<case_id>/', endpoint='case.view'))
@@ -120,6 +141,7 @@ class Application(object):
         map.add(Rule('/cases/close/<case_id>/', endpoint='case.close'))
         map.add(Rule('/cases/change_status/<case_id>/', endpoint='case.change_status'))
         map.add(Rule('/cases/<case_id>/uploads/<upload_id>/', endpoint='case.view_upload'))
+        map.add(Rule('/cases/<case_id>/uploads/<upload_id>/download/', endpoint='case.download_upload'))
         map.add(Rule('/cases/<case_id>/uploads/<upload_id>/delete/', endpoint='case.delete_upload'))
 
         map.add(Rule('/tasks/', endpoint='task.view_all'))
@@ -149,10 +171,15 @@ class Application(object):
         map.add(Rule('/evidence/<evidence_id>/custody/check-in/', endpoint='evidence.custody_in'))
 
         map.add(Rule('/evidence/<evidence_id>/uploads/<upload_id>/', endpoint='evidence.view_photo'))
+        map.add(Rule('/evidence/<evidence_id>/uploads/<upload_id>/download/', endpoint='evidence.download_photo'))
         map.add(Rule('/evidence/<evidence_id>/uploads/<upload_id>/delete/', endpoint='evidence.delete_photo'))
         map.add(Rule('/evidence/<evidence_id>/uploads/add/', endpoint='evidence.add_photo'))
 
         map.add(Rule('/cases/<case_id>/<task_id>/notes/', endpoint='forensics.work'))
+        map.add(Rule('/cases/<case_id>/<task_id>/chunked_uploads/', endpoint='forensics.start_upload'))
+        map.add(Rule('/cases/<case_id>/<task_id>/chunked_uploads/<upload_id>/', endpoint='forensics.upload_chunk'))
+        map.add(Rule('/cases/<case_id>/<task_id>/chunked_uploads/<upload_id>/complete/',
+                     endpoint='forensics.complete_upload'))
         map.add(Rule('/cases/<case_id>/<task_id>/qa/', endpoint='forensics.qa'))
 
         map.add(Rule('/users/', endpoint='user.view_all'))
@@ -188,6 +215,7 @@ class Application(object):
         map.add(Rule('/export/<case_id>/<task_id>.csv', endpoint='export.notes_csv'))
 
         map.add(Rule('/cases/<case_id>/<task_id>/uploads/<upload_id>/', endpoint='task.view_upload'))
+        map.add(Rule('/cases/<case_id>/<task_id>/uploads/<upload_id>/download/', endpoint='task.download_upload'))
         map.add(Rule('/cases/<case_id>/<task_id>/uploads/<upload_id>/delete/', endpoint='task.delete_upload'))
 
         # Static rules -- these never match, they're only used for building.
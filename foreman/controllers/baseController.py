@@ -4,17 +4,20 @@ import simplejson as json
 # library imports
 from werkzeug import Response
 from werkzeug.exceptions import Forbidden
-from mako.lookup import TemplateLookup
 from formencode import Invalid
 from formencode.variabledecode import variable_decode
 # local imports
 from ..utils.utils import session, ROOT_DIR, multidict_to_dict, config
+from ..utils.cache import sidebar_cache
+from ..utils.profiling import template_timer
+from ..utils.templates import make_template_lookup
+from ..utils.file_serving import send_file
 from ..utils.mail import email
 from ..model import User, CaseStatus, Case, Task, TaskStatus, Evidence, has_permissions, ForemanOptions, UserCaseRoles
 from ..model import TaskUpload, EvidencePhotoUpload, Team, Department, CaseHistory, UserTaskRoles, TaskHistory
-from ..model import EvidenceHistory, EvidenceStatus, SpecialText, CaseUpload, UserRoles
+from ..model import EvidenceHistory, EvidenceStatus, SpecialText, CaseUpload, UserRoles, IntegrityCheck
 
-lookup = TemplateLookup(directories=[path.join(ROOT_DIR, 'templates')], output_encoding='utf-8', input_encoding='utf-8')
+lookup = make_template_lookup()
 
 
 def jsonify(func):
@@ -38,6 +41,8 @@ class BaseController:
         self.form_error = {}
         self.form_result = {}
         self.user_posted = {}
+        self._user_cache = {}
+        self._base_vars = None
         self._create_breadcrumbs()
 
     def _create_breadcrumbs(self):
@@ -63,9 +68,17 @@ class BaseController:
         """ Return the rendered template with variables """
         variables.update(**self._get_base_variables())
         template = lookup.get_template(path.join(*location))
-        html = template.render(urls=self.urls, breadcrumbs=self.breadcrumbs, **variables)
+        with template_timer():
+            html = template.render(urls=self.urls, breadcrumbs=self.breadcrumbs, **variables)
         return Response(html, mimetype='text/html', status=variables.get('_status', 200))
 
+    def send_upload(self, upload, as_attachment=True):
+        """ Send the file of an upload the user has been checked to have permission for. The file's hash is its ETag,
+        and the download is named after the upload's title """
+        unused_file_name, file_ext = path.splitext(upload.file_name)
+        return send_file(self.request, path.join(ROOT_DIR, upload.upload_location, upload.file_name),
+                         etag=upload.file_hash, download_name=upload.file_title + file_ext, as_attachment=as_attachment)
+
     def validate_form(self, schema):
         """ Validates a form post against schema. If no form was posted, return False.
         If form was posted and it is invalid, return False and set self.form_error.
@@ -83,51 +96,90 @@ class BaseController:
             self.form_error = e.unpack_errors(encode_variables=True)
             return False
 
+    def _page_arguments(self, name=""):
+        """ The cursor of the KeysetPage called name, from the query string """
+        return dict(after=self.request.args.get(name + 'after'), before=self.request.args.get(name + 'before'),
+                    name=name)
+
     def _get_current_user(self):
-        """ Load the current user from the database. If no user is logged in, return None."""
+        """ Load the current user from the database. If no user is logged in, return None.
+        The user is only loaded once per request. """
         if 'userid' in self.request.session:
-            return User.get(self.request.session['userid'])
+            user_id = self.request.session['userid']
+            if user_id not in self._user_cache:
+                self._user_cache[user_id] = User.get(user_id)
+            return self._user_cache[user_id]
         else:
             return None
 
     current_user = property(_get_current_user)
 
+    @staticmethod
+    def _get_special_text(model):
+        special_text = SpecialText.get_text(model)
+        return special_text.text if special_text is not None else ""
+
+    def _get_sidebar_counts(self, user, is_case_manager, is_admin):
+        """ Counts shown on the sidebar and admin banners for user. These are shared between requests for a short
+        time, see utils.cache.sidebar_cache """
+        counts = dict()
+        counts['open_cases'] = len(
+            Case.get_cases(CaseStatus.OPEN, user, case_perm_checker=self.check_permissions))
+        counts['created_cases'] = len(
+            Case.get_cases(CaseStatus.CREATED, user, case_perm_checker=self.check_permissions))
+        counts['created_cases_no_manager'] = len(
+            Case.get_cases(CaseStatus.CREATED, user, case_perm_checker=self.check_permissions, case_man=True))
+        if is_case_manager:
+            counts['my_cases'] = len(Case.get_current_cases(user, self.check_permissions, user))
+        else:
+            counts['my_cases'] = 0
+        counts['unassigned_tasks'] = len(Task.get_queued_tasks())
+        if is_admin:
+            counts['run_out_of_names'] = ForemanOptions.run_out_of_names()
+            counts['num_users'] = User.get_amount()
+            counts['default_password'] = user.id == 1 and User.check_password(user.username, "changeme")
+            counts['num_invalid'] = User.get_number_unvalidated()
+            counts['failed_integrity_checks'] = IntegrityCheck.get_number_failed()
+        return counts
+
     def _get_base_variables(self):
         """ Variables needed on every template page. Automatically added """
+        if self._base_vars is not None:
+            return dict(self._base_vars)
+
+        current_user = self.current_user
         base_vars = dict()
-        base_vars['current_user'] = self.current_user
+        base_vars['current_user'] = current_user
         base_vars['check_perms'] = self.check_view_permissions
         base_vars['check_perms_user'] = self.check_permissions
         base_vars['error_message_website_wide'] = []
         base_vars['help_message_website_wide'] = []
         base_vars['admin_help_message_website_wide'] = []
         base_vars['form_result'] = self.user_posted
-        base_vars['case_special_text'] = SpecialText.get_text('case').text if SpecialText.get_text(
-            'case') is not None else ""
-        base_vars['task_special_text'] = SpecialText.get_text('task').text if SpecialText.get_text(
-            'task') is not None else ""
-        base_vars['evidence_special_text'] = SpecialText.get_text('evidence').text if SpecialText.get_text(
-            'evidence') is not None else ""
-
-        if self.current_user:
-            base_vars['user_qa_cases'] = Case.get_cases(CaseStatus.OPEN, self.current_user, worker=True, QA=True)
-            base_vars['user_cases'] = Case.get_cases(CaseStatus.OPEN, self.current_user, worker=True)
-            base_vars['open_cases'] = len(
-                Case.get_cases(CaseStatus.OPEN, self.current_user, case_perm_checker=self.check_permissions))
-            base_vars['created_cases'] = len(
-                Case.get_cases(CaseStatus.CREATED, self.current_user, case_perm_checker=self.check_permissions))
-            base_vars['created_cases_no_manager'] = len(
-                Case.get_cases(CaseStatus.CREATED, self.current_user, case_perm_checker=self.check_permissions,
-                               case_man=True))
-            if self.current_user.is_case_manager:
-                base_vars['my_cases'] = len(Case.get_current_cases(self.current_user, self.check_permissions,
-                                                                   self.current_user))
-            else:
-                base_vars['my_cases'] = 0
-
-
-            if self.current_user.is_admin():
-                overload = ForemanOptions.run_out_of_names()
+        base_vars['request_args'] = multidict_to_dict(self.request.args)
+        base_vars['case_special_text'] = self._get_special_text('case')
+        base_vars['task_special_text'] = self._get_special_text('task')
+        base_vars['evidence_special_text'] = self._get_special_text('evidence')
+
+        is_admin = is_case_manager = is_requester = is_authoriser = False
+        if current_user:
+            is_admin = current_user.is_admin()
+            is_case_manager = current_user.is_case_manager()
+            is_requester = current_user.is_requester()
+            is_authoriser = current_user.is_authoriser()
+
+            counts = sidebar_cache.get((current_user.id, is_admin, is_case_manager),
+                                       lambda: self._get_sidebar_counts(current_user, is_case_manager, is_admin))
+            base_vars['user_qa_cases'] = Case.get_cases(CaseStatus.OPEN, current_user, worker=True, QA=True)
+            base_vars['user_cases'] = Case.get_cases(CaseStatus.OPEN, current_user, worker=True)
+            base_vars['open_cases'] = counts['open_cases']
+            base_vars['created_cases'] = counts['created_cases']
+            base_vars['created_cases_no_manager'] = counts['created_cases_no_manager']
+            base_vars['my_cases'] = counts['my_cases']
+            base_vars['unassigned_tasks'] = counts['unassigned_tasks']
+
+            if is_admin:
+                overload = counts['run_out_of_names']
                 if overload[0]:
                     base_vars['error_message_website_wide'].append(
                         {'title': "Task name issue",
@@ -145,7 +197,7 @@ class BaseController:
                          }
                     )
 
-                if User.get_amount() == 1:
+                if counts['num_users'] == 1:
                     base_vars['admin_help_message_website_wide'].append(
                         {'title': "Add more users",
                          'text': "You are currently the only user of Foreman.<a href='" +
@@ -153,7 +205,7 @@ class BaseController:
                          }
                     )
 
-                if self.current_user.id == 1 and User.check_password(self.current_user.username, "changeme"):
+                if counts['default_password']:
                     base_vars['error_message_website_wide'].append(
                         {'title': "Change your default password",
                          'text': """You are currently using the default admin password which is published publicly.
@@ -161,7 +213,7 @@ class BaseController:
                          }
                     )
 
-                num_invalid = User.get_number_unvalidated()
+                num_invalid = counts['num_invalid']
                 if num_invalid >= 1:
                     plural = "s" if num_invalid > 1 else ""
                     base_vars['help_message_website_wide'].append(
@@ -173,8 +225,21 @@ class BaseController:
                          }
                     )
 
-        if self.current_user and self.current_user.is_requester():
-            auths = len(UserRoles.get_authorisers(self.current_user.department))
+                num_failed = counts['failed_integrity_checks']
+                if num_failed >= 1:
+                    plural = "s" if num_failed > 1 else ""
+                    base_vars['error_message_website_wide'].append(
+                        {'title': "Integrity check failed",
+                         'text': "{} upload{} or task note{} no longer match the hash taken when they were added. "
+                                 "<a href='{}'>See which here</a>".format(num_failed, plural, plural,
+                                                                          self.urls.build("general.integrity"))
+                         }
+                    )
+        else:
+            base_vars['unassigned_tasks'] = len(Task.get_queued_tasks())
+
+        if is_requester:
+            auths = len(UserRoles.get_authorisers(current_user.department))
             if auths == 0:
                 base_vars['help_message_website_wide'].append(
                     {'title': "You have no authorisers",
@@ -184,7 +249,6 @@ class BaseController:
         base_vars['invRoles'] = TaskStatus.invRoles
         base_vars['qaRoles'] = TaskStatus.qaRoles
 
-        base_vars['unassigned_tasks'] = len(Task.get_queued_tasks())
         base_vars['task_statuses'] = {'created': TaskStatus.CREATED, 'start': TaskStatus.ALLOCATED,
                                       'progress': TaskStatus.PROGRESS, 'deliver': TaskStatus.DELIVERY,
                                       'queued': TaskStatus.QUEUED, 'complete': TaskStatus.COMPLETE, 'qa': TaskStatus.QA,
@@ -192,38 +256,39 @@ class BaseController:
         base_vars['case_statuses'] = {'created': CaseStatus.CREATED, 'archived': CaseStatus.ARCHIVED,
                                       'closed': CaseStatus.CLOSED, 'open': CaseStatus.OPEN,
                                       'rejected': CaseStatus.REJECTED, 'pending': CaseStatus.PENDING}
-        if self.current_user and self.current_user.is_requester():
-            base_vars['requester_created_cases'] = Case.get_cases_requested(self.current_user, self.check_permissions,
-                                                                            self.current_user, [CaseStatus.CREATED])
-            base_vars['requester_opened_cases'] = Case.get_cases_requested(self.current_user, self.check_permissions,
-                                                                           self.current_user, [CaseStatus.OPEN])
-            base_vars['requester_closed_cases'] = Case.get_cases_requested(self.current_user, self.check_permissions,
-                                                                           self.current_user, [CaseStatus.CLOSED])
-            base_vars['requester_archived_cases'] = Case.get_cases_requested(self.current_user, self.check_permissions,
-                                                                             self.current_user, [CaseStatus.ARCHIVED])
-            base_vars['requester_rejected_cases'] = Case.get_cases_requested(self.current_user, self.check_permissions,
-                                                                             self.current_user, [CaseStatus.REJECTED])
-            base_vars['requester_pending_cases'] = Case.get_cases_requested(self.current_user, self.check_permissions,
-                                                                            self.current_user, [CaseStatus.PENDING])
-        if self.current_user and self.current_user.is_case_manager():
-            base_vars['caseman_rejected_cases'] = Case.get_cases_requested_case_manager(self.current_user,
+        if is_requester:
+            base_vars['requester_created_cases'] = Case.get_cases_requested(current_user, self.check_permissions,
+                                                                            current_user, [CaseStatus.CREATED])
+            base_vars['requester_opened_cases'] = Case.get_cases_requested(current_user, self.check_permissions,
+                                                                           current_user, [CaseStatus.OPEN])
+            base_vars['requester_closed_cases'] = Case.get_cases_requested(current_user, self.check_permissions,
+                                                                           current_user, [CaseStatus.CLOSED])
+            base_vars['requester_archived_cases'] = Case.get_cases_requested(current_user, self.check_permissions,
+                                                                             current_user, [CaseStatus.ARCHIVED])
+            base_vars['requester_rejected_cases'] = Case.get_cases_requested(current_user, self.check_permissions,
+                                                                             current_user, [CaseStatus.REJECTED])
+            base_vars['requester_pending_cases'] = Case.get_cases_requested(current_user, self.check_permissions,
+                                                                            current_user, [CaseStatus.PENDING])
+        if is_case_manager:
+            base_vars['caseman_rejected_cases'] = Case.get_cases_requested_case_manager(current_user,
                                                                                         self.check_permissions,
-                                                                                        self.current_user,
+                                                                                        current_user,
                                                                                         [CaseStatus.REJECTED])
-            base_vars['caseman_pending_cases'] = Case.get_cases_requested_case_manager(self.current_user,
+            base_vars['caseman_pending_cases'] = Case.get_cases_requested_case_manager(current_user,
                                                                                        self.check_permissions,
-                                                                                       self.current_user,
+                                                                                       current_user,
                                                                                        [CaseStatus.PENDING])
-        if self.current_user and self.current_user.is_authoriser():
-            base_vars['authoriser_to_authorise'] = Case.get_cases_authorised(self.current_user, self.check_permissions,
-                                                                             self.current_user, [CaseStatus.PENDING])
-            base_vars['authoriser_rejected'] = Case.get_cases_authorised(self.current_user, self.check_permissions,
-                                                                         self.current_user, [CaseStatus.REJECTED])
-            base_vars['authoriser_authorised'] = Case.get_cases_authorised(self.current_user, self.check_permissions,
-                                                                           self.current_user,
+        if is_authoriser:
+            base_vars['authoriser_to_authorise'] = Case.get_cases_authorised(current_user, self.check_permissions,
+                                                                             current_user, [CaseStatus.PENDING])
+            base_vars['authoriser_rejected'] = Case.get_cases_authorised(current_user, self.check_permissions,
+                                                                         current_user, [CaseStatus.REJECTED])
+            base_vars['authoriser_authorised'] = Case.get_cases_authorised(current_user, self.check_permissions,
+                                                                           current_user,
                                                                            CaseStatus.approved_statuses)
 
-        return base_vars
+        self._base_vars = base_vars
+        return dict(base_vars)
 
     @staticmethod
     def send_email_alert(to_users, title, message):
@@ -239,7 +304,7 @@ Foreman
 {}""".format(message, config.get('admin', 'website_domain')), config.get('email', 'from_address'))
 
     @staticmethod
-    def _validate_task(case_id, task_id):
+    def _validate_task(case_id, task_id, profile=None):
         try:
             int(case_id)
         except ValueError:
@@ -250,7 +315,7 @@ Foreman
                 int(task_id)
             except ValueError:
                 return None
-            task = Task.get(task_id)
+            task = Task.get(task_id) if profile is None else Task.get_with_profile(task_id, profile)
             if task.case.id == case.id:
                 return task
             else:
@@ -307,11 +372,13 @@ Foreman
             return None
 
     @staticmethod
-    def _validate_case(case_id):
+    def _validate_case(case_id, profile=None):
         try:
             int(case_id)
         except ValueError:
             return None
+        if profile is not None:
+            return Case.get_with_profile(case_id, profile)
         case = Case.get(case_id)
         return case
 
@@ -325,21 +392,24 @@ Foreman
         return user
 
     @staticmethod
-    def _validate_evidence(evidence_id, case_id=None):
+    def _validate_evidence(evidence_id, case_id=None, profile=None):
         try:
             int(evidence_id)
         except ValueError:
             return None
 
+        q = Evidence.get_filter_by(id=evidence_id)
+        if profile is not None:
+            q = q.options(*Evidence.loading_profiles[profile])
         if case_id:
             case = Case.get(case_id)
             if case is not None:
-                evidence = Evidence.get_filter_by(case_id=case.id, id=evidence_id).first()
+                evidence = q.filter_by(case_id=case.id).first()
                 return evidence
             else:
                 return None
         else:
-            evidence = Evidence.get_filter_by(id=evidence_id).first()
+            evidence = q.first()
             return evidence
 
     @staticmethod
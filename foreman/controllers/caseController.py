@@ -7,7 +7,7 @@ from taskController import TaskController
 from ..model import Case, CaseStatus, UserCaseRoles, Task, UserTaskRoles, LinkedCase, UserRoles
 from ..model import TaskStatus, ForemanOptions, CaseClassification, CaseType, TaskType
 from ..model import CasePriority, EvidenceStatus, CaseUpload
-from ..utils.utils import multidict_to_dict, session, config, upload_file
+from ..utils.utils import multidict_to_dict, session, config
 from ..utils.mail import email
 from ..forms.forms import AddCaseForm, EditCaseForm, AddCaseLinkForm, RemoveCaseLinkForm, RequesterAddTaskForm
 from ..forms.forms import EditCaseManagersForm, ReAssignTasksForm, RequesterAddCaseForm, AddTaskForm, AuthoriseCaseForm
@@ -30,6 +30,14 @@ class CaseController(BaseController):
         else:
             return self.return_404()
 
+    def download_upload(self, case_id, upload_id):
+        upload = self._validate_case_upload(case_id, upload_id)
+        if upload is not None:
+            self.check_permissions(self.current_user, upload.case, 'view')
+            return self.send_upload(upload)
+        else:
+            return self.return_404()
+
     def delete_upload(self, case_id, upload_id):
         upload = self._validate_case_upload(case_id, upload_id)
         if upload is not None:
@@ -54,42 +62,47 @@ class CaseController(BaseController):
         self.check_permissions(self.current_user, 'Case', 'view-all')
 
         view = multidict_to_dict(self.request.args)
+        page = self._page_arguments()
 
         if 'view' in view:
             if self.request.args['view'].title() in CaseStatus.all_statuses:
                 all_cases = Case.get_cases(view['view'].title(), self.current_user,
-                                           case_perm_checker=self.check_permissions)
+                                           case_perm_checker=self.check_permissions, page=page)
             elif self.request.args['view'].title() == "Pending":
                 all_cases = Case.get_cases(CaseStatus.PENDING, self.current_user,
-                                           case_perm_checker=self.check_permissions)
+                                           case_perm_checker=self.check_permissions, page=page)
             elif self.request.args['view'].title() == "All":
-                all_cases = Case.get_cases("All", self.current_user, case_perm_checker=self.check_permissions)
+                all_cases = Case.get_cases("All", self.current_user, case_perm_checker=self.check_permissions,
+                                           page=page)
             elif self.request.args['view'].title() == "Authorised":
                 all_cases = Case.get_cases_authorised(self.current_user, self.check_permissions, self.current_user,
-                                                      CaseStatus.approved_statuses)
+                                                      CaseStatus.approved_statuses, page)
             elif self.request.args['view'].title() == "Unassigned":
                 all_cases = Case.get_cases("Created", self.current_user, case_perm_checker=self.check_permissions,
-                                           case_man=True)
+                                           case_man=True, page=page)
             elif self.request.args['view'].title() == "My":
                 if self.current_user.is_case_manager:
-                    all_cases = Case.get_current_cases(self.current_user, self.check_permissions, self.current_user)
+                    all_cases = Case.get_current_cases(self.current_user, self.check_permissions, self.current_user,
+                                                       page)
                 else:
                     all_cases = []
             else:
-                all_cases = Case.get_cases('Open', self.current_user, case_perm_checker=self.check_permissions)
+                all_cases = Case.get_cases('Open', self.current_user, case_perm_checker=self.check_permissions,
+                                           page=page)
         else:
             if self.current_user.is_authoriser():
                 all_cases = Case.get_cases(CaseStatus.PENDING, self.current_user,
-                                           case_perm_checker=self.check_permissions)
+                                           case_perm_checker=self.check_permissions, page=page)
                 view['view'] = "Pending"
             else:
-                all_cases = Case.get_cases('Open', self.current_user, case_perm_checker=self.check_permissions)
+                all_cases = Case.get_cases('Open', self.current_user, case_perm_checker=self.check_permissions,
+                                           page=page)
                 view['view'] = "Open"
         return self.return_response('pages', 'view_cases.html', cases=all_cases, case_status=view['view'].title(),
                                     current_user=TaskController.current_user)
 
     def view(self, case_id):
-        case = self._validate_case(case_id)
+        case = self._validate_case(case_id, profile='view')
         if case is not None:
             self.check_permissions(self.current_user, case, 'view')
             if case.tasks:
@@ -460,11 +473,11 @@ Link to new task: {}{}""".format(self.current_user.fullname, case.case_name, sel
             elif 'form' in form_type and form_type['form'] == "upload_file":
                 if self.validate_form(UploadCaseFile()):
                     f = self.form_result['file']
-                    new_directory = path.join(CaseUpload.ROOT, CaseUpload.DEFAULT_FOLDER, str(case.id))
-                    file_name = upload_file(f, new_directory)
+                    upload_location, file_name, file_hash = CaseUpload.save_file(
+                        f, path.join(CaseUpload.DEFAULT_FOLDER, str(case.id)))
 
                     upload = CaseUpload(self.current_user.id, case.id, file_name, self.form_result['comments'],
-                                        self.form_result['file_title'])
+                                        self.form_result['file_title'], upload_location, file_hash)
                     session.add(upload)
                     session.commit()
                     return self._return_edit_response(case, -1, success_upload=True, upload_id=upload.id)
@@ -6,7 +6,6 @@ from ..utils.utils import ROOT_DIR, multidict_to_dict, session
 from ..model import Evidence, Case, EvidencePhotoUpload, EvidenceType, EvidenceStatus
 from ..forms.forms import ChainOfCustodyForm, EditEvidenceForm, EditEvidenceQRCodesForm, EvidenceAssociateForm, \
     AddEvidenceForm, AddEvidencePhotoForm
-from ..utils.utils import upload_file
 
 
 class EvidenceController(BaseController):
@@ -182,7 +181,7 @@ class EvidenceController(BaseController):
             return self.return_404()
 
     def view(self, case_id, evidence_id):
-        evidence = self._validate_evidence(evidence_id, case_id)
+        evidence = self._validate_evidence(evidence_id, case_id, profile='view')
         if evidence is not None:
             self.check_permissions(self.current_user, evidence, 'view')
             self._create_task_specific_breadcrumbs(evidence, evidence.case)
@@ -199,22 +198,13 @@ class EvidenceController(BaseController):
         self.breadcrumbs.append({'title': 'Evidence', 'path': self.urls.build('evidence.view_all')})
 
         sort_by = multidict_to_dict(self.request.args).get('sort_by', 'date')
-        if sort_by == "date":
-            evidence = Evidence.get_all_evidence(self.current_user, self.check_permissions)
-            evidence = sorted(evidence, key=lambda evidence: evidence.date_added, reverse=True)
-        if sort_by == "date_old":
-            evidence = Evidence.get_all_evidence(self.current_user, self.check_permissions)
-            evidence = sorted(evidence, key=lambda evidence: evidence.date_added)
-        elif sort_by == "case":
-            evidence = Evidence.get_all_evidence(self.current_user, self.check_permissions, True)
-            caseless = Evidence.get_caseless()
-            evidence = sorted(evidence, key=lambda evidence: evidence.case_id, reverse=True)
-            evidence += caseless
-        elif sort_by == "user":
-            evidence = Evidence.get_all_evidence(self.current_user, self.check_permissions)
-            evidence = sorted(evidence, key=lambda evidence: evidence.user_id)
-
-        return self.return_response('pages', 'view_evidences.html', evidence=evidence, sort_by=sort_by)
+        if sort_by not in ["date", "date_old", "case", "user"]:
+            sort_by = "date"
+        evidence = Evidence.get_evidence_page(self.current_user, sort_by, self._page_arguments())
+        caseless = Evidence.get_caseless(self.current_user)
+
+        return self.return_response('pages', 'view_evidences.html', evidence=evidence, caseless=caseless,
+                                    sort_by=sort_by)
 
     def associate(self, evidence_id):
         evidence = self._validate_evidence(evidence_id)
@@ -288,6 +278,14 @@ class EvidenceController(BaseController):
         else:
             return self.return_404()
 
+    def download_photo(self, evidence_id, upload_id):
+        upload = self._validate_evidence_photo(evidence_id, upload_id)
+        if upload is not None:
+            self.check_permissions(self.current_user, upload.evidence, 'view')
+            return self.send_upload(upload, as_attachment=False)
+        else:
+            return self.return_404()
+
     def delete_photo(self, evidence_id, upload_id):
         upload = self._validate_evidence_photo(evidence_id, upload_id)
         if upload is not None:
@@ -323,11 +321,11 @@ class EvidenceController(BaseController):
         upload = None
         if self.validate_form(AddEvidencePhotoForm()):
             f = self.form_result['file']
-            new_directory = path.join(EvidencePhotoUpload.ROOT, EvidencePhotoUpload.DEFAULT_FOLDER, str(evidence.id))
-            file_name = upload_file(f, new_directory)
+            upload_location, file_name, file_hash = EvidencePhotoUpload.save_file(
+                f, path.join(EvidencePhotoUpload.DEFAULT_FOLDER, str(evidence.id)))
 
             upload = EvidencePhotoUpload(self.current_user.id, evidence.id, file_name, self.form_result['comments'],
-                                         self.form_result['file_title'])
+                                         self.form_result['file_title'], upload_location, file_hash)
             session.add(upload)
             session.commit()
             success_upload = True
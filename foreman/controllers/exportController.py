@@ -1,6 +1,15 @@
+# python imports
+from os import path
+from tempfile import TemporaryFile
+# library imports
+from werkzeug import Response
+from werkzeug.wsgi import wrap_file
 # local imports
-from baseController import BaseController
-from foreman.model import CaseAuthorisation, TaskNotes, TaskUpload, ChainOfCustody, EvidencePhotoUpload
+from baseController import BaseController, lookup
+from foreman.model import CaseAuthorisation, TaskNotes, TaskUpload, ChainOfCustody, EvidencePhotoUpload, Case
+from foreman.model import TaskHistory, TaskStatus, UserTaskRoles, UserTaskRolesHistory
+from ..model.models import get_rows_for_objects
+from ..utils.utils import session
 from ..utils.case_note_renders import render_rtf, render_csv, render_pdf
 from ..utils.report_renders import render_rtf_report
 
@@ -40,55 +49,108 @@ class ExportController(BaseController):
         else:
             return self.return_404()
 
+    # number of tasks whose history is loaded together for the case report
+    report_chunk_size = 50
+
     def report(self, case_id):
         case = self._validate_case(case_id)
         if case is not None:
             self.check_permissions(self.current_user, case, 'report')
-
-            case_history, task_histories, evidence_histories = self._get_data_for_case_report(case)
-            return self.return_response('pages', 'case_report.html', case=case, case_history=case_history,
-                                        task_histories=task_histories, evidence_histories=evidence_histories)
+            return Response(self._stream_case_report(case.id), mimetype='text/html', status=200)
         else:
             return self.return_404()
 
+    def _stream_case_report(self, case_id):
+        """ Sends the case report a section at a time, so large cases start arriving straight away. The request's
+        database session is closed before the response is sent, so the case and user are loaded again here. """
+        try:
+            self._user_cache.clear()
+            self._base_vars = None
+            case = Case.get(case_id)
+            variables = self._get_base_variables()
+            variables.update(urls=self.urls, breadcrumbs=self.breadcrumbs, case=case)
+            base = lookup.get_template(path.join('base', 'base_report.html'))
+            report = lookup.get_template(path.join('pages', 'case_report.html'))
+
+            def render(template, name, *args):
+                return template.get_def(name).render(*args, **variables)
+
+            yield render(base, 'report_start')
+            yield render(report, 'report_header')
+            for task in case.tasks:
+                yield render(report, 'task_section', task)
+            for evidence in case.evidence:
+                yield render(report, 'evidence_section', evidence)
+
+            yield render(report, 'case_audit', self._get_case_report_history(case))
+            yield render(report, 'audit_log_heading', "Task Audit Log", not case.tasks)
+            for task_history in self._get_task_report_histories(case.tasks):
+                yield render(report, 'task_audit', task_history)
+            yield render(report, 'audit_log_heading', "Evidence Audit Log", not case.evidence)
+            for evidence_history in self._get_evidence_report_histories(case.evidence):
+                yield render(report, 'evidence_audit', evidence_history)
+            yield render(report, 'report_footer')
+            yield render(base, 'report_end')
+        finally:
+            session.close()
+
     def case_report_rtf(self, case_id):
         case = self._validate_case(case_id)
         if case is not None:
             self.check_permissions(self.current_user, case, 'report')
-            histories = self._get_data_for_case_report(case)
-            stringio = render_rtf_report(case, histories)
-            if stringio is None:
+            render_file = render_rtf_report(case, self._get_data_for_case_report(case), TemporaryFile())
+            if render_file is None:
                 return Response(self.error_msg, mimetype='text/html', status=200)
-            return Response(stringio.getvalue(), direct_passthrough=True, mimetype='application/rtf', status=200)
+            render_file.seek(0)
+            return Response(wrap_file(self.request.environ, render_file), direct_passthrough=True,
+                            mimetype='application/rtf', status=200)
         else:
             return self.return_404()
 
     def _get_data_for_case_report(self, case):
+        return (self._get_case_report_history(case), self._get_task_report_histories(case.tasks),
+                self._get_evidence_report_histories(case.evidence))
+
+    def _get_case_report_history(self, case):
         c_hist = self._get_case_history_changes(case)
         m_hist = self._get_all_user_history_changes(case)
         a_hist = CaseAuthorisation.get_changes(case)
         case_history = c_hist + m_hist + a_hist
         case_history.sort(key=lambda d: d['date_time'])
+        return case_history
+
+    def _get_task_report_histories(self, tasks):
+        """ Yields the history of each task in turn. The history is loaded for report_chunk_size tasks at a time
+        rather than with a set of queries for every task. """
+        for i in xrange(0, len(tasks), self.report_chunk_size):
+            chunk = tasks[i:i + self.report_chunk_size]
+            task_ids = [task.id for task in chunk]
+            histories = get_rows_for_objects(TaskHistory, 'task_id', task_ids, TaskHistory.date_time)
+            statuses = get_rows_for_objects(TaskStatus, 'task_id', task_ids, TaskStatus.date_time)
+            notes = get_rows_for_objects(TaskNotes, 'task_id', task_ids)
+            uploads = get_rows_for_objects(TaskUpload, 'task_id', task_ids)
+            roles = get_rows_for_objects(UserTaskRolesHistory, 'task_id', task_ids)
+
+            for task in chunk:
+                t_hist = TaskHistory.get_changes(task, histories[task.id]) + TaskStatus.get_changes(task,
+                                                                                                    statuses[task.id])
+                t_hist.sort(key=lambda d: d['date_time'])
+                n_hist = TaskNotes.get_changes(task, notes[task.id])
+                tu_hist = TaskUpload.get_changes(task, uploads[task.id])
+                u_hist = []
+                for role in UserTaskRoles.all_roles:
+                    u_hist += UserTaskRolesHistory.get_changes(task, role, [entry for entry in roles[task.id]
+                                                                            if entry.role == role])
+                u_hist.sort(key=lambda d: d['date_time'])
+                task_hist = t_hist + n_hist + u_hist + tu_hist
+                task_hist.sort(key=lambda d: d['date_time'])
+                yield task_hist
 
-        task_histories = []
-        for task in case.tasks:
-            t_hist = self._get_task_history_changes(task)
-            n_hist = TaskNotes.get_changes(task)
-            tu_hist = TaskUpload.get_changes(task)
-            u_hist = self._get_all_task_user_history_changes(task)
-            task_hist = t_hist + n_hist + u_hist + tu_hist
-            task_hist.sort(key=lambda d: d['date_time'])
-            task_histories.append(task_hist)
-
-        evidence_histories = []
-        for evidence in case.evidence:
+    def _get_evidence_report_histories(self, evidence_list):
+        for evidence in evidence_list:
             s_hist = self._get_evidence_history_changes(evidence)
             c_hist = ChainOfCustody.get_changes(evidence)
             p_hist = EvidencePhotoUpload.get_changes(evidence)
             evidence_hist = s_hist + c_hist + p_hist
             evidence_hist.sort(key=lambda d: d['date_time'])
-            evidence_histories.append(evidence_hist)
-
-        return case_history, task_histories, evidence_histories
-
-
+            yield evidence_hist
@@ -1,12 +1,14 @@
 from collections import OrderedDict
 from os import path
-
+import simplejson as json
+# library imports
+from werkzeug import Response
 # local imports
-from baseController import BaseController
-from ..model import UserRoles, UserMessage, TaskUpload, ForemanOptions
+from baseController import BaseController, jsonify
+from ..model import UserRoles, UserMessage, TaskUpload, ForemanOptions, PartialTaskUpload
 from ..forms.forms import QACheckerForm, AddTaskNotesForm, AssignQADuringForensicsForm, AssignQAFormSingle, AskForQAForm
-from ..forms.forms import UploadTaskFile
-from ..utils.utils import session, multidict_to_dict, config, upload_file
+from ..forms.forms import UploadTaskFile, StartChunkedUploadForm, CompleteChunkedUploadForm
+from ..utils.utils import session, multidict_to_dict, config, chunked_upload_threshold
 from ..utils.mail import email
 
 
@@ -76,12 +78,12 @@ class ForensicsController(BaseController):
             elif 'upload_file' in form_type and form_type['upload_file'] == "true":
                 if self.validate_form(UploadTaskFile()):
                     f = self.form_result['file']
-                    new_directory = path.join(TaskUpload.ROOT, TaskUpload.DEFAULT_FOLDER,
-                                              str(task.case.id) + "_" + str(task.id))
-                    file_name = upload_file(f, new_directory)
+                    upload_location, file_name, file_hash = TaskUpload.save_file(
+                        f, path.join(TaskUpload.DEFAULT_FOLDER, str(task.case.id) + "_" + str(task.id)))
 
                     upload = TaskUpload(self.current_user.id, task.id, task.case.id, file_name,
-                                        self.form_result['comments'], self.form_result['file_title'])
+                                        self.form_result['comments'], self.form_result['file_title'], upload_location,
+                                        file_hash)
                     session.add(upload)
                     session.commit()
                     success_upload = True
@@ -110,10 +112,80 @@ The task can be viewed here: {}""".format(task.task_name, task.case.case_name, u
             return self.return_response('pages', 'update_forensics.html', task=task, success=success, start=start,
                                        qa_partner_list=qa_partner_list, success_qa=success_qa, qa_partners=qa_partners,
                                        case_note_dates=case_note_dates, success_upload=success_upload,
-                                       active_tab=active_tab, errors=self.form_error, email_alert_flag=email_alert_flag)
+                                       active_tab=active_tab, errors=self.form_error, email_alert_flag=email_alert_flag,
+                                       chunked_upload_threshold=chunked_upload_threshold())
         else:
             return self.return_404()
 
+    @staticmethod
+    def _json_response(status, **values):
+        return Response(json.dumps(values), mimetype='application/json', status=status)
+
+    def _validate_partial_upload(self, task, upload_id):
+        """ Only the user who started a chunked upload can add to it """
+        try:
+            upload = PartialTaskUpload.get(int(upload_id))
+        except ValueError:
+            return None
+        if upload is None or upload.task_id != task.id or upload.uploader_id != self.current_user.id:
+            return None
+        return upload
+
+    @jsonify
+    def start_upload(self, case_id, task_id):
+        task = self._validate_task(case_id, task_id)
+        if task is None:
+            return self.return_404()
+        self.check_permissions(self.current_user, task, 'add_file')
+        if not self.validate_form(StartChunkedUploadForm()):
+            return self._json_response(400, errors=self.form_error)
+        upload = PartialTaskUpload(self.current_user.id, task.id, self.form_result['file_name'],
+                                   self.form_result['file_size'])
+        session.add(upload)
+        session.flush()
+        return {'upload_id': upload.id, 'received': 0, 'chunk_size': PartialTaskUpload.CHUNK_SIZE,
+                'url': self.urls.build('forensics.upload_chunk', dict(case_id=task.case.id, task_id=task.id,
+                                                                      upload_id=upload.id))}
+
+    @jsonify
+    def upload_chunk(self, case_id, task_id, upload_id):
+        """ GET returns how much of the file has been received, so an interrupted upload knows where to carry on from.
+        POST adds the request body to the file. The offset argument is where in the file the body starts """
+        task = self._validate_task(case_id, task_id)
+        if task is None:
+            return self.return_404()
+        self.check_permissions(self.current_user, task, 'add_file')
+        upload = self._validate_partial_upload(task, upload_id)
+        if upload is None:
+            return self.return_404()
+        if self.request.method == 'POST':
+            try:
+                offset = int(self.request.args.get('offset', 0))
+            except ValueError:
+                offset = -1
+            # the body is read straight from the request, so the chunk is never held in memory or parsed as a form
+            if not upload.add_chunk(self.request.stream, offset):
+                return self._json_response(409, received=upload.received, file_size=upload.file_size)
+        return {'received': upload.received, 'file_size': upload.file_size}
+
+    @jsonify
+    def complete_upload(self, case_id, task_id, upload_id):
+        task = self._validate_task(case_id, task_id)
+        if task is None:
+            return self.return_404()
+        self.check_permissions(self.current_user, task, 'add_file')
+        upload = self._validate_partial_upload(task, upload_id)
+        if upload is None:
+            return self.return_404()
+        if not upload.finished:
+            return self._json_response(409, received=upload.received, file_size=upload.file_size)
+        if not self.validate_form(CompleteChunkedUploadForm()):
+            return self._json_response(400, errors=self.form_error)
+        task_upload = upload.complete(self.form_result['comments'], self.form_result['file_title'])
+        session.flush()
+        return {'upload_id': task_upload.id,
+                'url': self.urls.build('task.view', dict(case_id=task.case.id, task_id=task.id))}
+
     def qa(self, case_id, task_id):
         task = self._validate_task(case_id, task_id)
         if task is not None:
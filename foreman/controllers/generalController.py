@@ -5,10 +5,11 @@ from monthdelta import MonthDelta
 
 # local imports
 from baseController import BaseController, jsonify
-from ..model.caseModel import Task, User, ForemanOptions, Case, Evidence, CaseStatus, EvidenceStatus
+from ..model.caseModel import Task, User, ForemanOptions, Case, Evidence, CaseStatus, EvidenceStatus, IntegrityCheck
 from ..model.generalModel import TaskType, TaskCategory, EvidenceType, CaseClassification, CaseType, CasePriority, \
     SpecialText
 from ..model.userModel import UserRoles, Department, Team, User
+from ..model.searchModel import SearchIndex
 from ..forms.forms import LoginForm, OptionsForm, AddEvidenceTypeForm, RegisterForm, AddClassificationForm, \
     TaskEmailAlerts, CaseEmailAlerts
 from ..forms.forms import AddCaseTypeForm, RemoveCaseTypeForm, RemoveClassificationForm, RemoveEvidenceTypeForm
@@ -20,6 +21,7 @@ from ..forms.forms import EvidenceSpecialText
 from ..utils.utils import multidict_to_dict, session, ROOT_DIR, config
 from ..utils.mail import email
 from ..utils.scheduled_tasks import retention_notifier
+from ..utils.profiling import profile_stats, profiling_enabled
 
 
 class GeneralController(BaseController):
@@ -416,6 +418,33 @@ Foreman
                                     manager_inherit_options=manager_inherit_options,
                                     evi_retention_options=evi_retention_options)
 
+    def profiling(self):
+        self.check_permissions(self.current_user, "Case", 'admin')
+        self.breadcrumbs.append({'title': 'Administration', 'path': self.urls.build('general.admin')})
+        self.breadcrumbs.append({'title': 'Profiling', 'path': self.urls.build('general.profiling')})
+        if self.request.args.get('reset') == "true":
+            profile_stats.reset()
+        return self.return_response('pages', 'profiling.html', enabled=profiling_enabled(),
+                                    endpoints=profile_stats.get_endpoints(), since=profile_stats.since)
+
+    def integrity(self):
+        self.check_permissions(self.current_user, "Case", 'admin')
+        self.breadcrumbs.append({'title': 'Administration', 'path': self.urls.build('general.admin')})
+        self.breadcrumbs.append({'title': 'Integrity checks', 'path': self.urls.build('general.integrity')})
+        failed = [(check, check.checked_object) for check in IntegrityCheck.get_failed()]
+        return self.return_response('pages', 'integrity.html', failed=failed)
+
+    def search(self):
+        self.check_permissions(self.current_user, "Case", 'view-all')
+        self.breadcrumbs.append({'title': 'Search', 'path': self.urls.build('general.search')})
+        query = self.request.args.get('q', "").strip()
+        try:
+            offset = max(int(self.request.args.get('offset', 0)), 0)
+        except ValueError:
+            offset = 0
+        results = SearchIndex.search(self.current_user, query, offset) if query else None
+        return self.return_response('pages', 'search.html', query=query, results=results)
+
     def report(self):
         start_date = ForemanOptions.get_date_created()
         today_date = datetime.now()
@@ -6,6 +6,9 @@ from ..model.caseModel import Task, ForemanOptions, Case, CaseStatus
 from ..model.generalModel import TaskCategory, CaseType
 from ..model.userModel import UserRoles
 
+# (year, month) -> case status counts for months that have finished. See ReportController._get_monthly_case_counts
+finished_month_counts = {}
+
 
 class ReportController(BaseController):
 
@@ -18,129 +21,151 @@ class ReportController(BaseController):
 
         start_date = ForemanOptions.get_date_created()
         today_date = datetime.now()
-        months = [start_date.strftime("%B %Y")]
+        report_months = [start_date]
+        max_months = 11
+        while start_date.month != today_date.month and max_months != 0:
+            start_date = start_date + MonthDelta(1)
+            report_months.append(start_date)
+            max_months -= 1
+
+        monthly_counts = self._get_monthly_case_counts(report_months)
+        months = [month.strftime("%B %Y") for month in report_months]
         categories = CaseType.get_case_types()
         cases_opened = []
         cases_closed = []
         cases_archived = []
         total_cases = []
         active_tab = 0
-        for status in CaseStatus.all_statuses:
-            total_cases.append([start_date.strftime("%B %Y"), status,
-                                Case.get_num_cases_opened_on_date(start_date, status, case_type=None)])
-        for category in categories:
-            cases_opened.append([start_date.strftime("%B %Y"), category,
-                                 Case.get_num_cases_opened_on_date(start_date, CaseStatus.OPEN, case_type=category)])
-            cases_closed.append([start_date.strftime("%B %Y"), category,
-                                 Case.get_num_cases_opened_on_date(start_date, CaseStatus.CLOSED, case_type=category)])
-            cases_archived.append([start_date.strftime("%B %Y"), category,
-                                   Case.get_num_cases_opened_on_date(start_date, CaseStatus.ARCHIVED,
-                                                                     case_type=category)])
-        max_months = 11
-        while start_date.month != today_date.month and max_months != 0:
-            start_date = start_date + MonthDelta(1)
-            months.append(start_date.strftime("%B %Y"))
+        for month, month_name in zip(report_months, months):
+            counts = monthly_counts.get((month.year, month.month), {})
             for status in CaseStatus.all_statuses:
-                total_cases.append([start_date.strftime("%B %Y"), status,
-                                    Case.get_num_cases_opened_on_date(start_date, status, case_type=None)])
+                total_cases.append([month_name, status, sum(number for (count_status, case_type), number
+                                                            in counts.iteritems() if count_status == status)])
             for category in categories:
-                cases_opened.append([start_date.strftime("%B %Y"), category,
-                                     Case.get_num_cases_opened_on_date(start_date, CaseStatus.OPEN,
-                                                                       case_type=category)])
-                cases_closed.append([start_date.strftime("%B %Y"), category,
-                                     Case.get_num_cases_opened_on_date(start_date, CaseStatus.CLOSED,
-                                                                       case_type=category)])
-                cases_archived.append([start_date.strftime("%B %Y"), category,
-                                       Case.get_num_cases_opened_on_date(start_date, CaseStatus.ARCHIVED,
-                                                                         case_type=category)])
-            max_months -= 1
+                cases_opened.append([month_name, category, counts.get((CaseStatus.OPEN, category), 0)])
+                cases_closed.append([month_name, category, counts.get((CaseStatus.CLOSED, category), 0)])
+                cases_archived.append([month_name, category, counts.get((CaseStatus.ARCHIVED, category), 0)])
 
         return self.return_response('pages', 'report.html', cases_opened=cases_opened, cases_closed=cases_closed,
                                     months=months, cases_archived=cases_archived, total_cases=total_cases,
                                     active_tab=active_tab)
 
+    @staticmethod
+    def _get_monthly_case_counts(months):
+        """ Case status counts for each of the months, see Case.get_num_cases_by_month. Months that have finished
+        cannot change any more so are only counted once and then kept. """
+        today = datetime.now()
+        this_month = (today.year, today.month)
+        results = {}
+        missing = []
+        for month in months:
+            key = (month.year, month.month)
+            if key in finished_month_counts:
+                results[key] = finished_month_counts[key]
+            else:
+                missing.append(month)
+
+        if missing:
+            counts = Case.get_num_cases_by_month(missing[0], missing[-1])
+            for month in missing:
+                key = (month.year, month.month)
+                results[key] = counts.get(key, {})
+                if key < this_month:
+                    finished_month_counts[key] = results[key]
+        return results
+
+    def _get_date_range(self, default_period):
+        """ Reads the start_date and end_date arguments, given either as a month ("October 2014") or as a day
+        ("20141020"). The range covers all of end_date, or default_period from the start when there is no end_date.
+        Returns (None, None) when start_date is missing or invalid. """
+        start = self._parse_report_date(self.request.args.get('start_date', ""))
+        if start is None:
+            return None, None
+        end = self._parse_report_date(self.request.args.get('end_date', ""))
+        if end is None:
+            return start[0], start[0] + (start[1] if isinstance(start[1], MonthDelta) else default_period)
+        return start[0], end[0] + end[1]
+
+    @staticmethod
+    def _parse_report_date(date_str):
+        for date_format, period in [("%Y%m%d", timedelta(days=1)), ("%B %Y", MonthDelta(1))]:
+            try:
+                return datetime.strptime(date_str, date_format), period
+            except ValueError:
+                pass
+        return None
+
+    def _report_json(self, users, categories, counts, user_key, count_key, category_key=None):
+        """ Counts come back as a list of rows for the charts, or in columns when format=columns is asked for:
+        {"users": [...], "categories": [...], "counts": [[...], ...]}, with one row of counts per user. A report that
+        is not split into categories passes categories None and counts keyed by user id alone, and has the one
+        category count_key. """
+        if categories is None:
+            categories = [count_key]
+            counts = dict(((user_id, count_key), amount) for user_id, amount in counts.iteritems())
+        if self.request.args.get('format') == "columns":
+            return {"users": [user.fullname for user in users],
+                    "categories": categories,
+                    "counts": [[counts.get((user.id, category), 0) for category in categories] for user in users]}
+        rows = []
+        for category in categories:
+            for user in users:
+                row = {user_key: user.fullname, count_key: counts.get((user.id, category), 0)}
+                if category_key is not None:
+                    row[category_key] = category
+                rows.append(row)
+        return rows
+
     @jsonify
     def jason_tasks_assigned_to_inv(self):
         self.check_permissions(self.current_user, 'Report', 'view')
 
-        try:
-            start_date_str = self.request.args.get('start_date', "")
-            start_date = datetime.strptime(start_date_str, "%B %Y")
-        except ValueError:
-            start_date = datetime.now()
-        tasks_assigned_inv = []
-        for category in TaskCategory.get_categories():
-            for investigator in UserRoles.get_investigators():
-                tasks_assigned_inv.append({
-                    "Investigator": investigator.fullname,
-                    "Number of Tasks": int(Task.get_num_created_tasks_for_given_month_user_is_investigator_for(investigator, category, start_date)),
-                    "Task Type": category})
-        return tasks_assigned_inv
+        start_date, end_date = self._get_date_range(MonthDelta(1))
+        if start_date is None:
+            today = datetime.now()
+            start_date = datetime(today.year, today.month, 1)
+            end_date = start_date + MonthDelta(1)
+        investigators = UserRoles.get_investigators()
+        return self._report_json(investigators, TaskCategory.get_categories(),
+                                 Task.get_num_created_tasks_by_investigators(investigators, start_date, end_date),
+                                 "Investigator", "Number of Tasks", "Task Type")
 
     @jsonify
     def jason_tasks_qaed(self):
         self.check_permissions(self.current_user, 'Report', 'view')
 
-        try:
-            start_date_str = self.request.args.get('start_date', "")
-            start_date = datetime.strptime(start_date_str, "%B %Y")
-        except ValueError:
-            start_date = datetime.now()
-        tasks_assigned_inv = []
-        for investigator in UserRoles.get_investigators():
-            tasks_assigned_inv.append({
-                "QA Partner": investigator.fullname,
-                "Number of QAs": Task.get_num_completed_qas_for_given_month(investigator, start_date)})
-        return tasks_assigned_inv
-
+        start_date, end_date = self._get_date_range(MonthDelta(1))
+        if start_date is None:
+            today = datetime.now()
+            start_date = datetime(today.year, today.month, 1)
+            end_date = start_date + MonthDelta(1)
+        investigators = UserRoles.get_investigators()
+        return self._report_json(investigators, None,
+                                 Task.get_num_completed_qas_by_users(investigators, start_date, end_date),
+                                 "QA Partner", "Number of QAs")
 
     @jsonify
     def jason_direct_report_tasks(self):
         self.check_permissions(self.current_user, "User", 'view_directs_timesheets')
-        today = datetime.now()
-        try:
-            start_date_str = self.request.args.get('start_date', "")
-            start_date = datetime.strptime(start_date_str, "%Y%m%d")
-            end_date = start_date + timedelta(days=7)
-            if end_date > today:
-                end_date = today
-        except ValueError:
-            start_date = today
-            end_date = today
+        start_date, end_date = self._get_date_range(timedelta(days=7))
+        if start_date is None:
+            start_date = end_date = datetime.now()
         task_status = self.request.args.get('task_type', "")
-        tasks_assigned_inv = []
-        for category in TaskCategory.get_categories():
-            for investigator in self.current_user.direct_reports:
-                if investigator.is_examiner():
-                    tasks_assigned_inv.append({
-                        "Investigator": investigator.fullname,
-                        "Number of Tasks": Task.get_num_tasks_by_user_for_date_range(investigator, category, start_date,
-                                                                                     end_date, task_status),
-                        "Task Type": category})
-        return tasks_assigned_inv
+        investigators = [user for user in self.current_user.all_reports() if user.is_examiner()]
+        amounts = Task.get_num_tasks_by_users_for_date_range(investigators, start_date, end_date, [task_status])
+        counts = dict(((user_id, category), amount) for (user_id, status, category), amount in amounts.iteritems())
+        return self._report_json(investigators, TaskCategory.get_categories(), counts,
+                                 "Investigator", "Number of Tasks", "Task Type")
 
     @jsonify
     def jason_direct_report_cases(self):
         self.check_permissions(self.current_user, "User", 'view_directs_timesheets')
-        today = datetime.now()
-        try:
-            start_date_str = self.request.args.get('start_date', "")
-            start_date = datetime.strptime(start_date_str, "%Y%m%d")
-            end_date = start_date + timedelta(days=7)
-            if end_date > today:
-                end_date = today
-        except ValueError:
-            start_date = today
-            end_date = today
+        start_date, end_date = self._get_date_range(timedelta(days=7))
+        if start_date is None:
             return []
         case_status = self.request.args.get('case_type', "")
-        cases_assigned_manager = []
-        for category in CaseType.get_case_types():
-            for case_manager in self.current_user.direct_reports:
-                if case_manager.is_case_manager():
-                    cases_assigned_manager.append({
-                        "Case Manager": case_manager.fullname,
-                        "Number of Cases": int(Case.get_num_completed_case_by_user(case_manager, category, start_date,
-                                                                                   end_date, case_status)),
-                        "Case Type": category})
-        return cases_assigned_manager
+        case_managers = [user for user in self.current_user.all_reports() if user.is_case_manager()]
+        amounts = Case.get_num_completed_cases_by_users(case_managers, start_date, end_date, [case_status])
+        counts = dict(((user_id, category), amount) for (user_id, status, category), amount in amounts.iteritems())
+        return self._report_json(case_managers, CaseType.get_case_types(), counts,
+                                 "Case Manager", "Number of Cases", "Case Type")
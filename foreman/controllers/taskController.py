@@ -19,7 +19,8 @@ class TaskController(BaseController):
     def view_all(self):
         self.check_permissions(self.current_user, 'Task', 'view-all')
         self.breadcrumbs.append({'title': 'Tasks', 'path': self.urls.build('task.view_all')})
-        all_tasks = Task.get_active_tasks(user=self.current_user, case_perm_checker=self.check_permissions)
+        all_tasks = Task.get_active_tasks(user=self.current_user, case_perm_checker=self.check_permissions,
+                                          page=self._page_arguments())
         user_primary_inv, user_secondary_inv = Task.get_tasks_assigned_to_user(user=self.current_user)
         return self.return_response('pages', 'view_tasks.html', all_tasks=all_tasks, user_primary_inv=user_primary_inv,
                                     user_secondary_inv=user_secondary_inv)
@@ -40,7 +41,7 @@ class TaskController(BaseController):
                                     user_secondary_qa=user_secondary_qa, completed=completed)
 
     def view(self, case_id, task_id):
-        task = self._validate_task(case_id, task_id)
+        task = self._validate_task(case_id, task_id, profile='view')
         if task is not None:
             self.check_permissions(self.current_user, task, 'view')
             self._create_task_specific_breadcrumbs(task, task.case)
@@ -61,6 +62,14 @@ class TaskController(BaseController):
         else:
             return self.return_404()
 
+    def download_upload(self, case_id, task_id, upload_id):
+        upload = self._validate_task_upload(case_id, task_id, upload_id)
+        if upload is not None:
+            self.check_permissions(self.current_user, upload.task, 'add_file')
+            return self.send_upload(upload)
+        else:
+            return self.return_404()
+
     def delete_upload(self, case_id, task_id, upload_id):
         upload = self._validate_task_upload(case_id, task_id, upload_id)
         if upload is not None:
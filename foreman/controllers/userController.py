@@ -22,7 +22,7 @@ class UserController(BaseController):
 
     def view_all(self):
         self.check_permissions(self.current_user, "User", 'view-all')
-        all_users = User.get_all().all()
+        all_users = User.get_user_page(self._page_arguments())
         return self.return_response('pages', 'view_users.html', users=all_users)
 
     def timesheet_overview_default(self):
@@ -50,11 +50,17 @@ class UserController(BaseController):
         worker_task_statuses = [TaskStatus.ALLOCATED, TaskStatus.PROGRESS, "Waiting for QA", "Performing QA",
                                 TaskStatus.DELIVERY, TaskStatus.COMPLETE]
         worker_case_statuses = CaseStatus.approved_statuses
-        get_worker_task_amounts = Task.get_num_tasks_by_user_for_date_range
-        get_worker_case_amounts = Case.get_num_completed_case_by_user
-        return self.return_response('pages', 'timesheets.html', start_day=start_day,
-                                    get_worker_task_amounts=get_worker_task_amounts,
-                                    get_worker_case_amounts=get_worker_case_amounts,
+        end_day = start_day + timedelta(days=7)
+        reports = self.current_user.all_reports()
+        hours_worked = User.get_hours_worked_by_users(reports, start_day.date(), end_day.date())
+        worker_task_amounts = Task.get_num_tasks_by_users_for_date_range(
+            [user for user in reports if user.is_examiner()], start_day, end_day, worker_task_statuses)
+        worker_case_amounts = Case.get_num_completed_cases_by_users(
+            [user for user in reports if user.is_case_manager()], start_day, end_day, worker_case_statuses)
+        return self.return_response('pages', 'timesheets.html', start_day=start_day, hours_worked=hours_worked,
+                                    reports=reports,
+                                    worker_task_amounts=worker_task_amounts,
+                                    worker_case_amounts=worker_case_amounts,
                                     worker_task_statuses=worker_task_statuses,
                                     worker_case_statuses=worker_case_statuses)
 
@@ -89,31 +95,13 @@ class UserController(BaseController):
                                      'path': self.urls.build('user.timesheet', dict(user_id=user.id, week=week))})
 
             if self.request.args.get('form') == "case" and self.validate_form(CaseTimeSheetForm):
-                for timesheets in self.form_result['cases']:
-                    for entries in timesheets['timesheet']:
-                        timesheet = CaseTimeSheets.get_filter_by(case=timesheets['case'],
-                                                                 date=entries['datetime'],
-                                                                 user=user).first()
-                        if timesheet is None and entries['value'] is not None:
-                            user_timesheet = CaseTimeSheets(user, timesheets['case'], entries['datetime'],
-                                                            entries['value'])
-                            session.add(user_timesheet)
-                            session.commit()
-                        elif timesheet is not None:
-                            timesheet.hours = entries['value']
+                CaseTimeSheets.save_week(user, [(timesheets['case'].id, entries['datetime'], entries['value'])
+                                                for timesheets in self.form_result['cases']
+                                                for entries in timesheets['timesheet']])
             elif self.request.args.get('form') == "task" and self.validate_form(TaskTimeSheetForm):
-                for timesheets in self.form_result['tasks']:
-                    for entries in timesheets['timesheet']:
-                        timesheet = TaskTimeSheets.get_filter_by(task=timesheets['task'],
-                                                                 date=entries['datetime'],
-                                                                 user=user).first()
-                        if timesheet is None and entries['value'] is not None:
-                            user_timesheet = TaskTimeSheets(user, timesheets['task'], entries['datetime'],
-                                                            entries['value'])
-                            session.add(user_timesheet)
-                            session.commit()
-                        elif timesheet is not None:
-                            timesheet.hours = entries['value']
+                TaskTimeSheets.save_week(user, [(timesheets['task'].id, entries['datetime'], entries['value'])
+                                                for timesheets in self.form_result['tasks']
+                                                for entries in timesheets['timesheet']])
 
             task_timesheets = {}
             if user.is_examiner():
@@ -124,8 +112,7 @@ class UserController(BaseController):
                 timesheet_user_tasks = prim + second + prim_qa + second_qa
                 timesheet_user_tasks.sort(key=lambda d: d.creation_date, reverse=True)
 
-                for ts in TaskTimeSheets.get_filter_by(user=user).all():
-                    task_timesheets.setdefault(ts.date.strftime("%d%m%Y"), {})[ts.task.id] = ts.hours
+                task_timesheets = TaskTimeSheets.get_week(user, start_day.date())
             else:
                 timesheet_user_tasks = []
 
@@ -136,8 +123,7 @@ class UserController(BaseController):
 
                 timesheet_user_cases = old_cases_managed + current_cases_managed
 
-                for ts in CaseTimeSheets.get_filter_by(user=user).all():
-                    case_timesheets.setdefault(ts.date.strftime("%d%m%Y"), {})[ts.case.id] = ts.hours
+                case_timesheets = CaseTimeSheets.get_week(user, start_day.date())
             else:
                 timesheet_user_cases = []
             return self.return_response('pages', 'view_timesheet.html', user=user, start_day=start_day,
@@ -407,12 +393,16 @@ Foreman
                                      'path': self.urls.build('user.case_history', dict(user_id=user.id))})
 
             if user.is_investigator() or user.is_QA():
-                current_tasks_qaed = Task.get_current_qas(user, self.check_permissions, self.current_user)
-                old_tasks_qaed = Task.get_completed_qas(user, self.check_permissions, self.current_user)
+                current_tasks_qaed = Task.get_current_qas(user, self.check_permissions, self.current_user,
+                                                          self._page_arguments('current_qaed_'))
+                old_tasks_qaed = Task.get_completed_qas(user, self.check_permissions, self.current_user,
+                                                        self._page_arguments('old_qaed_'))
                 current_tasks_investigated = Task.get_current_investigations(user, self.check_permissions,
-                                                                             self.current_user)
+                                                                             self.current_user,
+                                                                             self._page_arguments('current_inv_'))
                 old_tasks_investigated = Task.get_completed_investigations(user, self.check_permissions,
-                                                                           self.current_user)
+                                                                           self.current_user,
+                                                                           self._page_arguments('old_inv_'))
             else:
                 current_tasks_investigated = None
                 old_tasks_investigated = None
@@ -420,8 +410,10 @@ Foreman
                 old_tasks_qaed = None
 
             if user.is_case_manager():
-                old_cases_managed = Case.get_completed_cases(user, self.check_permissions, self.current_user)
-                current_cases_managed = Case.get_current_cases(user, self.check_permissions, self.current_user)
+                old_cases_managed = Case.get_completed_cases(user, self.check_permissions, self.current_user,
+                                                             self._page_arguments('old_managed_'))
+                current_cases_managed = Case.get_current_cases(user, self.check_permissions, self.current_user,
+                                                               self._page_arguments('current_managed_'))
             else:
                 old_cases_managed = None
                 current_cases_managed = None
@@ -429,10 +421,12 @@ Foreman
             if user.is_requester():
                 old_cases_requested = Case.get_cases_requested(user, self.check_permissions,
                                                                self.current_user, [CaseStatus.CLOSED,
-                                                                                   CaseStatus.ARCHIVED])
+                                                                                   CaseStatus.ARCHIVED],
+                                                               self._page_arguments('old_requested_'))
                 current_cases_requested = Case.get_cases_requested(user, self.check_permissions, self.current_user,
                                                                    [CaseStatus.CREATED, CaseStatus.OPEN,
-                                                                    CaseStatus.PENDING])
+                                                                    CaseStatus.PENDING],
+                                                                   self._page_arguments('current_requested_'))
             else:
                 old_cases_requested = None
                 current_cases_requested = None
@@ -466,7 +460,7 @@ Foreman
             titles.append(day_tracker.strftime("%Y-%m-%d"))
             day_tracker += timedelta(days=1)
 
-        stringio = create_csv(create_timesheets(self.current_user.direct_reports, start_day,
+        stringio = create_csv(create_timesheets(self.current_user.all_reports(), start_day,
                                                 start_day + timedelta(days=7)), titles)
         return Response(stringio.getvalue(), direct_passthrough=True, mimetype='text/csv', status=200)
 
@@ -489,12 +483,12 @@ Foreman
         categories = TaskCategory.get_categories()
 
         examiners = []
-        for user in self.current_user.direct_reports:
+        for user in self.current_user.all_reports():
             if user.is_examiner():
                 examiners.append(user)
                 titles.append(user.fullname)
         stringio = create_csv(create_metrics(examiners, statuses, categories, start_day, start_day + timedelta(days=7),
-                                             Task.get_num_tasks_by_user_for_date_range), titles)
+                                             Task.get_num_tasks_by_users_for_date_range), titles)
         return Response(stringio.getvalue(), direct_passthrough=True, mimetype='text/csv', status=200)
 
     def case_metrics_download_csv(self, week):
@@ -515,35 +509,41 @@ Foreman
         categories = CaseType.get_case_types()
 
         case_managers = []
-        for user in self.current_user.direct_reports:
+        for user in self.current_user.all_reports():
             if user.is_case_manager():
                 case_managers.append(user)
                 titles.append(user.fullname)
         stringio = create_csv(create_metrics(case_managers, statuses, categories, start_day,
-                                             start_day + timedelta(days=7), Case.get_num_completed_case_by_user),
+                                             start_day + timedelta(days=7), Case.get_num_completed_cases_by_users),
                               titles)
         return Response(stringio.getvalue(), direct_passthrough=True, mimetype='text/csv', status=200)
 
 
 def create_timesheets(user_list, start, end):
+    start = date(start.year, start.month, start.day)
+    end = date(end.year, end.month, end.day)
+    hours_worked = User.get_hours_worked_by_users(user_list, start, end)
     entries = []
     for user in user_list:
         user_entry = [user.fullname]
         current = start
         while current < end:
-            user_entry.append(user.get_hours_worked(date(current.year, current.month, current.day)))
+            user_entry.append(hours_worked.get((user.id, current), 0))
             current += timedelta(days=1)
         entries.append(user_entry)
     return entries
 
 
 def create_metrics(user_list, statuses, categories, start, end, case_or_task):
+    """ case_or_task is one of the grouped counts, Task.get_num_tasks_by_users_for_date_range or
+    Case.get_num_completed_cases_by_users, so the whole table is filled from one set of queries """
+    amounts = case_or_task(user_list, start, end, statuses)
     entries = []
     for status in statuses:
         for category in categories:
             user_entry = [status, category]
             for user in user_list:
-                user_entry.append(case_or_task(user, category, start, end, status))
+                user_entry.append(amounts.get((user.id, status, category), 0))
             entries.append(user_entry)
     return entries
 
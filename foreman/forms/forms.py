@@ -371,6 +371,16 @@ class UploadTaskFile(Schema):
     file = UploadTaskFiles(not_empty=True)
 
 
+class StartChunkedUploadForm(Schema):
+    file_name = v.UnicodeString(not_empty=True)
+    file_size = v.Int(not_empty=True, min=1)
+
+
+class CompleteChunkedUploadForm(Schema):
+    file_title = v.UnicodeString(not_empty=True)
+    comments = v.UnicodeString(not_empty=True)
+
+
 class UploadCaseFile(Schema):
     file_title = v.UnicodeString(not_empty=True)
     comments = v.UnicodeString()
@@ -1,8 +1,10 @@
 from models import Base
 from caseModel import Case, CaseStatus, TaskStatus, Task, TaskNotes, Evidence, ChainOfCustody, LinkedCase, CaseHistory,\
-    TaskHistory, EvidenceHistory, TaskUpload, EvidencePhotoUpload, CaseAuthorisation, EvidenceStatus, CaseUpload
+    TaskHistory, EvidenceHistory, TaskUpload, EvidencePhotoUpload, CaseAuthorisation, EvidenceStatus, CaseUpload, \
+    PartialTaskUpload, IntegrityCheck, StoredFile
 from userModel import User, UserTaskRoles, UserCaseRoles, UserRoles, UserCaseRolesHistory, UserTaskRolesHistory, \
-    UserHistory, UserRolesHistory, UserMessage, Department, Team, TaskTimeSheets, CaseTimeSheets
+    UserHistory, UserRolesHistory, UserMessage, Department, Team, TaskTimeSheets, CaseTimeSheets, UserHierarchy
 from generalModel import ForemanOptions, TaskType, TaskCategory, EvidenceType, CaseClassification, CaseType, \
-    CasePriority, SpecialText
-from permissions import has_permissions
\ No newline at end of file
+    CasePriority, SpecialText, QueuedEmail, OptionsVersion, WebSession, NamePool
+from permissions import has_permissions
+from searchModel import SearchIndex
\ No newline at end of file
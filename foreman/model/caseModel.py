@@ -1,20 +1,25 @@
 # python imports
 from datetime import datetime, date
 import hashlib
-from os import path, remove
+from os import path, remove, makedirs, fstat
+from fcntl import flock, LOCK_EX, LOCK_UN
 import calendar
 # library imports
-from sqlalchemy import Column, Integer, Boolean, Unicode, ForeignKey, DateTime, asc, desc, and_, or_, func, distinct
+from sqlalchemy import Column, Integer, BigInteger, Boolean, Unicode, ForeignKey, DateTime, Index, asc, desc, and_, \
+    or_, not_, func, distinct, exists, extract, event, text, bindparam
 from sqlalchemy.ext.declarative import declared_attr
-from sqlalchemy.orm import backref, relation
+from sqlalchemy.orm import backref, relation, aliased, Query, joinedload, subqueryload, foreign
+from sqlalchemy.orm.util import identity_key
 from qrcode import *
 from werkzeug.exceptions import Forbidden, InternalServerError
 from monthdelta import MonthDelta
 # local imports
-from models import Base, Model, HistoryModel
+from models import Base, Model, HistoryModel, KeysetPage, loaded_relationship
 from generalModel import ForemanOptions, TaskCategory, TaskType, CasePriority
 from userModel import UserTaskRoles, User, UserCaseRoles, UserRoles
-from ..utils.utils import session, ROOT_DIR, config, upload_file
+from ..utils.utils import session, ROOT_DIR, config, upload_file, hash_file, move_file, random_file_name, \
+    upload_buffer_size, upload_temp_dir, upload_file_with_hash, deduplicate_uploads
+from ..utils.cache import sidebar_cache
 
 hash_algorithm = config.get('forensics', 'hash_type').lower()
 if hash_algorithm not in hashlib.algorithms:
@@ -23,6 +28,29 @@ if hash_algorithm not in hashlib.algorithms:
 hash_library = getattr(hashlib, hash_algorithm)
 
 
+def _newest_first(rows):
+    # rows that have not been flushed yet have no id, and are the newest
+    return sorted(rows, key=lambda row: (row.id is None, row.id), reverse=True)
+
+
+def _role_holders(user_roles, roles):
+    """ The users with any of roles in a loaded case_roles or task_roles collection, in the order they were added """
+    return [user_role.user for user_role in reversed(_newest_first(user_roles)) if user_role.role in roles]
+
+
+def _role_holder(user_roles, role):
+    """ Same as User.get_user_with_role, using a loaded case_roles or task_roles collection """
+    for user_role in _newest_first(user_roles):
+        if user_role.role == role:
+            return user_role.user
+    return None
+
+
+def _latest_status(statuses):
+    # same as get_status, using a loaded statuses collection
+    return _newest_first(statuses)[0] if statuses else None
+
+
 class CaseAuthorisation(Base, Model):
     __tablename__ = 'case_auth'
 
@@ -94,6 +122,7 @@ class LinkedCase(Base, HistoryModel):
     comparable_fields = {}
     object_name = "Case"
     history_name = ("Case", "case_name", "case_linker_id")
+    previous_partition = ('case_linker_id',)
 
     def __init__(self, linker, linkee, reason, user, removed=False):
         self.case_linker_id = linker.id
@@ -148,16 +177,8 @@ class LinkedCase(Base, HistoryModel):
     def date(self):
         return ForemanOptions.get_date(self.date_time)
 
-    @property
-    def previous(self):
-        q = session.query(LinkedCase)
-        q = q.filter_by(case_linker_id=self.case_linker_id).filter(LinkedCase.id < self.id)
-        q = q.order_by(desc(LinkedCase.id))
-        q1 = q.count()
-        if q1 == 0:
-            return self
-        else:
-            return q.first()
+    def no_previous(self):
+        return self
 
     def difference(self, link_history):
         differences = HistoryModel.difference(self, link_history)
@@ -174,6 +195,7 @@ class LinkedCase(Base, HistoryModel):
 
 class CaseStatus(Base, HistoryModel):
     __tablename__ = 'case_statuses'
+    __table_args__ = (Index('ix_case_statuses_case_id', 'case_id', 'id'),)
 
     CREATED = 'Created'
     PENDING = 'Awaiting authorisation'
@@ -203,6 +225,7 @@ class CaseStatus(Base, HistoryModel):
     comparable_fields = {'Status': 'status', 'Reason': 'reason'}
     object_name = "Case"
     history_name = ("Case", "case_name", "case_id")
+    previous_partition = ('case_id',)
 
     def __init__(self, case_id, status, user):
         self.status = status
@@ -210,16 +233,8 @@ class CaseStatus(Base, HistoryModel):
         self.case_id = case_id
         self.user = user
 
-    @property
-    def previous(self):
-        q = session.query(CaseStatus)
-        q = q.filter_by(case_id=self.case_id).filter(CaseStatus.id < self.id)
-        q = q.order_by(desc(CaseStatus.id))
-        q1 = q.count()
-        if q1 == 0:
-            return False
-        else:
-            return q.first()
+    def no_previous(self):
+        return False
 
     @property
     def date(self):
@@ -232,6 +247,7 @@ class CaseStatus(Base, HistoryModel):
 
 class CaseHistory(HistoryModel, Base):
     __tablename__ = 'case_history'
+    __table_args__ = (Index('ix_case_history_case_id', 'case_id', 'id'),)
 
     id = Column(Integer, primary_key=True)
     case_id = Column(Integer, ForeignKey('cases.id'))
@@ -256,6 +272,7 @@ class CaseHistory(HistoryModel, Base):
                          "Case Files Location": 'location', 'Classification': 'classification', 'Deadline': 'deadline',
                          'Case Type:': 'case_type', 'Justification': 'justification', "Case Priority": 'case_priority'}
     history_name = ("Case", "case_name", "case_id")
+    previous_partition = ('case_id',)
 
     def __init__(self, case, user):
         self.case_id = case.id
@@ -273,12 +290,6 @@ class CaseHistory(HistoryModel, Base):
         self.case_priority_colour = case.case_priority_colour
         self.deadline = case.deadline
 
-    @property
-    def previous(self):
-        q = session.query(CaseHistory)
-        q = q.filter_by(case_id=self.case_id).filter(CaseHistory.id < self.id).order_by(desc(CaseHistory.id))
-        return q.first()
-
     @property
     def object_id(self):
         return self.case_id
@@ -296,6 +307,8 @@ class CaseHistory(HistoryModel, Base):
 
 class Case(Base, Model):
     __tablename__ = 'cases'
+    __table_args__ = (Index('ix_cases_currentStatus', 'currentStatus'),
+                      Index('ix_cases_creation_date', 'creation_date', 'id'))
 
     id = Column(Integer, primary_key=True)
     case_name = Column(Unicode)
@@ -312,6 +325,21 @@ class Case(Base, Model):
     case_priority_colour = Column(Unicode)
     deadline = Column(DateTime)
 
+    loading_profiles = {
+        'view': [subqueryload('case_roles').joinedload('user'),
+                 subqueryload('statuses'),
+                 subqueryload('authorisations'),
+                 subqueryload('case_uploads').joinedload('integrity_check'),
+                 subqueryload('evidence').subqueryload('statuses'),
+                 subqueryload('tasks').joinedload('task_type'),
+                 subqueryload('tasks').subqueryload('statuses'),
+                 subqueryload('tasks').subqueryload('task_roles').joinedload('user')],
+        'list': [subqueryload('case_roles').joinedload('user'),
+                 subqueryload('tasks').joinedload('task_type'),
+                 subqueryload('tasks').subqueryload('statuses'),
+                 subqueryload('tasks').subqueryload('task_roles').joinedload('user')],
+    }
+
     def __init__(self, case_name, user, background=None, reference=None, private=False, location=None,
                  classification=None, case_type=None, justification=None, priority=None, deadline=None, created=None,
                  authorisor=None):
@@ -378,8 +406,12 @@ class Case(Base, Model):
             self.currentStatus = status
             self.statuses.append(CaseStatus(self.id, status, user))
             session.flush()
+            sidebar_cache.invalidate()
 
     def get_status(self):
+        statuses = loaded_relationship(self, 'statuses')
+        if statuses is not None:
+            return _latest_status(statuses)
         return session.query(CaseStatus).filter_by(case_id=self.id).order_by(desc(CaseStatus.id)).first()
 
     def add_change(self, user):
@@ -439,6 +471,23 @@ class Case(Base, Model):
             q = q.filter(Case.case_type == case_type)
         return q.scalar()
 
+    @staticmethod
+    def get_num_cases_by_month(first_month, last_month):
+        """ Count the case status changes for each month from first_month to last_month inclusive, grouped by
+        status and case type. Returns a dictionary of (year, month) -> {(status, case_type): number} """
+        start = datetime(first_month.year, first_month.month, 1)
+        end = datetime(last_month.year, last_month.month, 1) + MonthDelta(1)
+        year = extract('year', CaseStatus.date_time)
+        month = extract('month', CaseStatus.date_time)
+        q = session.query(year, month, CaseStatus.status, Case.case_type, func.count(Case.id)).select_from(Case)
+        q = q.join(CaseStatus).filter(and_(CaseStatus.date_time >= start, CaseStatus.date_time < end))
+        q = q.group_by(year, month, CaseStatus.status, Case.case_type)
+
+        results = {}
+        for row_year, row_month, status, case_type, number in q:
+            results.setdefault((int(row_year), int(row_month)), {})[(status, case_type)] = number
+        return results
+
     @staticmethod
     def cases_with_user_involved(user_id, active=False):
         q_case_roles = session.query(Case).join('case_roles').filter_by(user_id=user_id)
@@ -453,7 +502,16 @@ class Case(Base, Model):
         return session.query(UserCaseRoles).filter_by(case_id=self.id, user_id=user_id).all()
 
     @staticmethod
-    def _check_perms(case_manager, cases, case_perm_checker):
+    def _check_perms(case_manager, cases, case_perm_checker, page=None):
+        """ Cases that case_manager can view. Queries are filtered by the database using the view permissions,
+        anything else is checked one at a time with case_perm_checker. If page is given (the cursor arguments of a
+        KeysetPage), a query returns that page of the cases, newest first """
+        if isinstance(cases, Query):
+            from permissions import permissions_filter
+            cases = cases.filter(permissions_filter(case_manager, Case, "view"))
+            if page is not None:
+                return KeysetPage(cases, [Case.creation_date, Case.id], options=Case.loading_profiles['list'], **page)
+            return cases.all()
         output = []
         for case in cases:
             try:
@@ -464,54 +522,51 @@ class Case(Base, Model):
         return output
 
     @staticmethod
-    def get_completed_cases(case_manager, case_perm_checker, current_user):
+    def get_completed_cases(case_manager, case_perm_checker, current_user, page=None):
         q = session.query(Case)
         q = q.join(UserCaseRoles).filter(UserCaseRoles.user_id == case_manager.id).filter(or_(
             UserCaseRoles.role == UserCaseRoles.PRINCIPLE_CASE_MANAGER,
             UserCaseRoles.role == UserCaseRoles.SECONDARY_CASE_MANAGER))
         q = q.filter(or_(Case.currentStatus == CaseStatus.CLOSED, Case.currentStatus == CaseStatus.ARCHIVED))
-        return Case._check_perms(current_user, q, case_perm_checker)
+        return Case._check_perms(current_user, q, case_perm_checker, page)
 
     @staticmethod
-    def get_current_cases(case_manager, case_perm_checker, current_user):
+    def get_current_cases(case_manager, case_perm_checker, current_user, page=None):
         q = session.query(Case)
         q = q.join(UserCaseRoles).filter(UserCaseRoles.user_id == case_manager.id).filter(or_(
             UserCaseRoles.role == UserCaseRoles.PRINCIPLE_CASE_MANAGER,
             UserCaseRoles.role == UserCaseRoles.SECONDARY_CASE_MANAGER))
         q = q.filter(or_(Case.currentStatus == CaseStatus.OPEN, Case.currentStatus == CaseStatus.CREATED))
-        return Case._check_perms(current_user, q, case_perm_checker)
+        return Case._check_perms(current_user, q, case_perm_checker, page)
 
     @staticmethod
-    def get_cases_requested(requester, case_perm_checker, current_user, statuses):
+    def get_cases_requested(requester, case_perm_checker, current_user, statuses, page=None):
         q = session.query(Case)
         q = q.join(UserCaseRoles).filter(UserCaseRoles.user_id == requester.id). \
             filter(UserCaseRoles.role == UserCaseRoles.REQUESTER)
         q = q.filter(Case.currentStatus.in_(statuses))
-        return Case._check_perms(current_user, q, case_perm_checker)
+        return Case._check_perms(current_user, q, case_perm_checker, page)
 
     @staticmethod
     def get_cases_requested_case_manager(case_manager, case_perm_checker, current_user, statuses):
-        # get cases that don't have a case requester
-        q_noreq = session.query(Case).outerjoin(UserCaseRoles, and_(Case.id == UserCaseRoles.case_id,
-                                                                    UserCaseRoles.role == UserCaseRoles.REQUESTER))
-        q_noreq = q_noreq.filter(UserCaseRoles.case_id == None)
-
         # get cases that have a principle case manager same as the parameter passed in & status in statuses
-        q_caseman = session.query(Case).join(UserCaseRoles).filter_by(user_id=case_manager.id)
-        q_caseman = q_caseman.filter_by(role=UserCaseRoles.PRINCIPLE_CASE_MANAGER)
-        q_caseman = q_caseman.filter(Case.currentStatus.in_(statuses))
-
-        # final list is cases that have both of the above
-        q_cases = q_noreq.intersect(q_caseman)
+        q_cases = session.query(Case).join(UserCaseRoles).filter_by(user_id=case_manager.id)
+        q_cases = q_cases.filter_by(role=UserCaseRoles.PRINCIPLE_CASE_MANAGER)
+        q_cases = q_cases.filter(Case.currentStatus.in_(statuses))
+
+        # and that don't have a case requester
+        requester = aliased(UserCaseRoles)
+        q_cases = q_cases.filter(not_(exists().where(and_(requester.case_id == Case.id,
+                                                          requester.role == UserCaseRoles.REQUESTER))))
         return Case._check_perms(current_user, q_cases, case_perm_checker)
 
     @staticmethod
-    def get_cases_authorised(authoriser, case_perm_checker, current_user, statuses):
+    def get_cases_authorised(authoriser, case_perm_checker, current_user, statuses, page=None):
         q = session.query(Case)
         q = q.join(UserCaseRoles).filter(UserCaseRoles.user_id == authoriser.id). \
             filter(UserCaseRoles.role == UserCaseRoles.AUTHORISER)
         q = q.filter(Case.currentStatus.in_(statuses))
-        return Case._check_perms(current_user, q, case_perm_checker)
+        return Case._check_perms(current_user, q, case_perm_checker, page)
 
     @staticmethod
     def get_num_completed_case_by_user(user, category, start, end, case_status):
@@ -528,7 +583,33 @@ class Case(Base, Model):
         return q.scalar()
 
     @staticmethod
-    def get_cases(status, current_user, worker=False, QA=False, case_perm_checker=None, case_man=False):
+    def get_num_completed_cases_by_users(users, start, end, case_statuses):
+        """ The grouped form of get_num_completed_case_by_user: counts for every user, status and case type at once.
+        Returns {(user_id, status, case_type): count}, where case_type None holds the total over all case types. """
+        user_ids = [user.id for user in users]
+        if not user_ids or not case_statuses:
+            return {}
+        user_roles = [UserCaseRoles.PRINCIPLE_CASE_MANAGER, UserCaseRoles.SECONDARY_CASE_MANAGER]
+
+        def count_query(*group_by):
+            q = session.query(UserCaseRoles.user_id, CaseStatus.status, *(group_by + (func.count(distinct(Case.id)),)))
+            q = q.select_from(Case).join(CaseStatus).filter(and_(CaseStatus.date_time >= start,
+                                                                 CaseStatus.date_time <= end,
+                                                                 CaseStatus.status.in_(case_statuses)))
+            q = q.join(UserCaseRoles).filter(UserCaseRoles.user_id.in_(user_ids)).filter(
+                UserCaseRoles.role.in_(user_roles))
+            return q.group_by(UserCaseRoles.user_id, CaseStatus.status, *group_by)
+
+        results = {}
+        for user_id, status, case_type, amount in count_query(Case.case_type):
+            results[(user_id, status, case_type)] = amount
+        # the totals go in last, so that they replace any cases without a case type
+        for user_id, status, amount in count_query():
+            results[(user_id, status, None)] = amount
+        return results
+
+    @staticmethod
+    def get_cases(status, current_user, worker=False, QA=False, case_perm_checker=None, case_man=False, page=None):
         q = session.query(Case)
         if status != 'All' and status != "Queued" and status != "Workable":
             q = q.filter_by(currentStatus=status)
@@ -546,17 +627,13 @@ class Case(Base, Model):
                     and_(UserTaskRoles.user_id == current_user.id, UserTaskRoles.role.in_(UserTaskRoles.inv_roles)))
             return q.order_by(desc(Case.creation_date)).all()
         else:
-            cases = q.order_by(desc(Case.creation_date)).all()
-            output = []
-            for case in cases:
-                if (case_man is True and case.principle_case_manager is None and case.secondary_case_manager is None) \
-                        or case_man is False:
-                    try:
-                        case_perm_checker(current_user, case, "view")
-                        output.append(case)
-                    except Forbidden:
-                        pass
-            return output
+            if case_man is True:
+                case_manager = aliased(UserCaseRoles)
+                q = q.filter(not_(exists().where(and_(
+                    case_manager.case_id == Case.id,
+                    case_manager.role.in_([UserCaseRoles.PRINCIPLE_CASE_MANAGER,
+                                           UserCaseRoles.SECONDARY_CASE_MANAGER])))))
+            return Case._check_perms(current_user, q.order_by(desc(Case.creation_date)), case_perm_checker, page)
 
     def _active_before_start(self, day_tracker):
         if date(day_tracker.year, day_tracker.month, day_tracker.day) < date(self.creation_date.year,
@@ -583,13 +660,19 @@ class Case(Base, Model):
     def __str__(self):
         return "{}".format(self.case_name)
 
+    def _get_user_with_role(self, role):
+        case_roles = loaded_relationship(self, 'case_roles')
+        if case_roles is not None:
+            return _role_holder(case_roles, role)
+        return User.get_user_with_role(role, case_id=self.id)
+
     @property
     def principle_case_manager(self):
-        return User.get_user_with_role(UserCaseRoles.PRINCIPLE_CASE_MANAGER, case_id=self.id)
+        return self._get_user_with_role(UserCaseRoles.PRINCIPLE_CASE_MANAGER)
 
     @property
     def secondary_case_manager(self):
-        return User.get_user_with_role(UserCaseRoles.SECONDARY_CASE_MANAGER, case_id=self.id)
+        return self._get_user_with_role(UserCaseRoles.SECONDARY_CASE_MANAGER)
 
     @property
     def case_managers(self):
@@ -597,15 +680,16 @@ class Case(Base, Model):
 
     @property
     def requester(self):
-        return User.get_user_with_role(UserCaseRoles.REQUESTER, case_id=self.id)
+        return self._get_user_with_role(UserCaseRoles.REQUESTER)
 
     @property
     def authoriser(self):
-        return User.get_user_with_role(UserCaseRoles.AUTHORISER, case_id=self.id)
+        return self._get_user_with_role(UserCaseRoles.AUTHORISER)
 
 
 class ChainOfCustody(Base, Model):
     __tablename__ = 'chain_custody'
+    __table_args__ = (Index('ix_chain_custody_evidence_id', 'evidence_id'),)
 
     id = Column(Integer, primary_key=True)
     evidence_id = Column(Integer, ForeignKey('evidence.id'))
@@ -700,6 +784,7 @@ class ChainOfCustody(Base, Model):
 
 class EvidenceStatus(Base, HistoryModel):
     __tablename__ = 'evidence_statuses'
+    __table_args__ = (Index('ix_evidence_statuses_evidence_id', 'evidence_id', 'id'),)
 
     INACTIVE = 'Inactive'
     ACTIVE = 'Active'
@@ -721,6 +806,7 @@ class EvidenceStatus(Base, HistoryModel):
     history_backref = "statuses"
     comparable_fields = {'Status': 'status'}
     history_name = ("Evidence", "evidence_name", "evidence_id", "case_id")
+    previous_partition = ('evidence_id',)
 
     def __init__(self, evidence_id, status, user, note=None):
         self.status = status
@@ -729,16 +815,8 @@ class EvidenceStatus(Base, HistoryModel):
         self.user = user
         self.note = note
 
-    @property
-    def previous(self):
-        q = session.query(EvidenceStatus)
-        q = q.filter_by(evidence_id=self.evidence_id).filter(EvidenceStatus.id < self.id).order_by(
-            desc(EvidenceStatus.id))
-        q1 = q.count()
-        if q1 == 0:
-            return False
-        else:
-            return q.first()
+    def no_previous(self):
+        return False
 
     @property
     def date(self):
@@ -758,6 +836,7 @@ class EvidenceStatus(Base, HistoryModel):
 
 class EvidenceHistory(HistoryModel, Base):
     __tablename__ = 'evidence_history'
+    __table_args__ = (Index('ix_evidence_history_evidence_id', 'evidence_id', 'id'),)
 
     id = Column(Integer, primary_key=True)
     evidence_id = Column(Integer, ForeignKey('evidence.id'))
@@ -784,6 +863,7 @@ class EvidenceHistory(HistoryModel, Base):
                          'Originator': 'originator',
                          'Associated Case': 'case_id'}
     history_name = ("Evidence", "reference", "evidence_id", "case_id")
+    previous_partition = ('evidence_id',)
 
     def __init__(self, evidence, user):
         self.evidence = evidence
@@ -802,13 +882,6 @@ class EvidenceHistory(HistoryModel, Base):
         self.date_time = datetime.now()
         self.user = user
 
-    @property
-    def previous(self):
-        q = session.query(EvidenceHistory)
-        q = q.filter_by(evidence_id=self.evidence_id).filter(EvidenceHistory.id < self.id).order_by(
-            desc(EvidenceHistory.id))
-        return q.first()
-
     @property
     def object_id(self):
         return self.evidence_id
@@ -836,6 +909,9 @@ class EvidenceHistory(HistoryModel, Base):
 
 class Evidence(Base, Model):
     __tablename__ = 'evidence'
+    __table_args__ = (Index('ix_evidence_case_id', 'case_id'),
+                      Index('ix_evidence_current_status', 'current_status'),
+                      Index('ix_evidence_date_added', 'date_added', 'id'))
 
     id = Column(Integer, primary_key=True)
     reference = Column(Unicode)
@@ -857,6 +933,14 @@ class Evidence(Base, Model):
     case = relation('Case', backref=backref('evidence', order_by=asc(reference)))
     user = relation('User', backref=backref('evidence_added', order_by=asc(reference)))
 
+    loading_profiles = {
+        'view': [joinedload('case').subqueryload('case_roles').joinedload('user'),
+                 subqueryload('statuses'),
+                 subqueryload('evidence_photos')],
+        'list': [joinedload('case'),
+                 joinedload('user')],
+    }
+
     def __init__(self, case, reference, evidence_type, comment, originator, location, user_added,
                  evidence_bag_number=None, qr=True, status=EvidenceStatus.INACTIVE):
         self.case = case
@@ -902,7 +986,7 @@ class Evidence(Base, Model):
         session.flush()
 
     def set_retention_date(self):
-        options = ForemanOptions.get_options()
+        options = ForemanOptions.get_cached_options()
         if options.evidence_retention:
             self.retention_date = self.retention_start_date + MonthDelta(options.evidence_retention_period)
         else:
@@ -954,6 +1038,9 @@ class Evidence(Base, Model):
 
     @property
     def status(self):
+        statuses = loaded_relationship(self, 'statuses')
+        if statuses is not None:
+            return _latest_status(statuses).status
         return session.query(EvidenceStatus).filter_by(evidence_id=self.id).order_by(
             desc(EvidenceStatus.id)).first().status
 
@@ -976,26 +1063,41 @@ class Evidence(Base, Model):
 
     @staticmethod
     def get_all_evidence(user, case_perm_checker, caseless=False):
-        q = session.query(Evidence)
-        output = []
-        for evi in q:
-            try:
-                case_perm_checker(user, evi, "view")
-                if caseless and evi.case is None:
-                    pass
-                else:
-                    output.append(evi)
-            except Forbidden:
-                pass
-        return output
+        from permissions import permissions_filter
+        q = session.query(Evidence).filter(permissions_filter(user, Evidence, "view"))
+        if caseless:
+            q = q.filter(Evidence.case_id != None)
+        return q.all()
+
+    @staticmethod
+    def get_caseless(user=None):
+        q = session.query(Evidence).filter_by(case_id=None)
+        if user is not None:
+            from permissions import permissions_filter
+            q = q.filter(permissions_filter(user, Evidence, "view"))
+        return q.all()
 
     @staticmethod
-    def get_caseless():
-        return session.query(Evidence).filter_by(case_id=None).all()
+    def get_evidence_page(user, sort_by, page):
+        """ A page of the evidence that user can view, sorted by date added (newest or oldest first), case or the user
+        that added it. When sorted by case, the evidence that is not associated with a case comes last """
+        from permissions import permissions_filter
+        q = session.query(Evidence)
+        if sort_by == "case":
+            q = q.filter(or_(permissions_filter(user, Evidence, "view"), Evidence.case_id == None))
+            columns, descending = [func.coalesce(Evidence.case_id, 0), Evidence.id], True
+        elif sort_by == "user":
+            q = q.filter(permissions_filter(user, Evidence, "view"))
+            columns, descending = [func.coalesce(Evidence.user_id, 0), Evidence.id], False
+        else:
+            q = q.filter(permissions_filter(user, Evidence, "view"))
+            columns, descending = [Evidence.date_added, Evidence.id], sort_by != "date_old"
+        return KeysetPage(q, columns, descending=descending, options=Evidence.loading_profiles['list'], **page)
 
 
 class TaskStatus(Base, HistoryModel):
     __tablename__ = 'task_statuses'
+    __table_args__ = (Index('ix_task_statuses_task_id', 'task_id', 'id'),)
 
     CREATED = 'Created'
     QUEUED = 'Queued'
@@ -1032,6 +1134,7 @@ class TaskStatus(Base, HistoryModel):
     comparable_fields = {'Status': 'status'}
     object_name = "Task"
     history_name = ("Task", "task_name", "task_id", "case_id")
+    previous_partition = ('task_id',)
 
     def __init__(self, task_id, status, user, case=None):
         self.status = status
@@ -1043,15 +1146,8 @@ class TaskStatus(Base, HistoryModel):
             self.case_id = Task.get(task_id).case.id
         self.user = user
 
-    @property
-    def previous(self):
-        q = session.query(TaskStatus)
-        q = q.filter_by(task_id=self.task_id).filter(TaskStatus.id < self.id).order_by(desc(TaskStatus.id))
-        q1 = q.count()
-        if q1 == 0:
-            return False
-        else:
-            return q.first()
+    def no_previous(self):
+        return False
 
     @property
     def date(self):
@@ -1062,6 +1158,171 @@ class TaskStatus(Base, HistoryModel):
         return self.task.task_name
 
 
+class IntegrityCheck(Base, Model):
+    """ The result of the last time the verify_integrity command re-hashed an upload or task note, so pages can show it
+    without reading the file again """
+    __tablename__ = 'integrity_checks'
+    __table_args__ = (Index('ix_integrity_checks_object', 'object_type', 'object_id', unique=True),
+                      Index('ix_integrity_checks_passed', 'passed'))
+
+    id = Column(Integer, primary_key=True)
+    object_type = Column(Unicode)
+    object_id = Column(Integer)
+    date_checked = Column(DateTime)
+    passed = Column(Boolean)
+    current_hash = Column(Unicode)
+    error = Column(Unicode)
+
+    def __init__(self, object_type, object_id):
+        self.object_type = object_type
+        self.object_id = object_id
+
+    def record(self, current_hash, passed, error=None, checked=None):
+        self.current_hash = current_hash
+        self.passed = passed
+        self.error = error
+        self.date_checked = checked or datetime.now()
+
+    @property
+    def date(self):
+        return ForemanOptions.get_date(self.date_checked)
+
+    @property
+    def checked_object(self):
+        """ The upload or task note that was checked """
+        models = {'TaskUpload': TaskUpload, 'CaseUpload': CaseUpload, 'EvidencePhotoUpload': EvidencePhotoUpload,
+                  'TaskNotes': TaskNotes}
+        return session.query(models[self.object_type]).get(self.object_id)
+
+    @staticmethod
+    def get_number_failed():
+        return session.query(IntegrityCheck).filter_by(passed=False).count()
+
+    @staticmethod
+    def get_failed():
+        return session.query(IntegrityCheck).filter_by(passed=False).order_by(IntegrityCheck.object_type,
+                                                                               IntegrityCheck.object_id).all()
+
+
+def _integrity_check_relation(cls):
+    return relation(IntegrityCheck, primaryjoin=lambda: and_(foreign(IntegrityCheck.object_id) == cls.id,
+                                                             IntegrityCheck.object_type == cls.__name__),
+                    uselist=False, viewonly=True)
+
+
+class StoredFile(Base, Model):
+    """ A file in the content addressed store. Uploads with the same contents share one copy, named after its hash, and
+    the file is only removed when the last upload using it is deleted. The extension is part of the name so the file
+    is still served with the right content type. """
+    __tablename__ = 'stored_files'
+    FOLDER = path.join('files', 'store')
+
+    id = Column(Integer, primary_key=True)
+    file_name = Column(Unicode, unique=True)
+    file_hash = Column(Unicode)
+    references = Column(Integer)
+    date_added = Column(DateTime)
+
+    def __init__(self, file_name, file_hash):
+        self.file_name = file_name
+        self.file_hash = file_hash
+        self.references = 1
+        self.date_added = datetime.now()
+
+    @staticmethod
+    def location(file_hash):
+        # split over folders by the start of the hash, so no one folder holds every file
+        return path.join(StoredFile.FOLDER, file_hash[:2])
+
+    @staticmethod
+    def is_stored(upload_location):
+        return path.dirname(upload_location) == StoredFile.FOLDER
+
+    @staticmethod
+    def add(source, file_hash, original_name):
+        """ Add the file at source, whose contents hash to file_hash, to the store. If the store already has a copy,
+        source is deleted and the copy is used. Returns the upload location and file name the upload should use """
+        unused_file_name, file_ext = path.splitext(original_name.split(path.sep)[-1])
+        file_name = file_hash + file_ext.lower()
+        upload_location = StoredFile.location(file_hash)
+        new_directory = path.join(ROOT_DIR, upload_location)
+        destination = path.join(new_directory, file_name)
+        if not path.exists(new_directory):
+            makedirs(new_directory)
+
+        StoredFile._add_reference(file_name, file_hash)
+        # the row is locked by the new reference until the request commits, so the file cannot be removed by a
+        # release of its last upload in the meantime
+        if path.exists(destination):
+            remove(source)
+        else:
+            move_file(source, destination)
+        return upload_location, file_name
+
+    @staticmethod
+    def _add_reference(file_name, file_hash):
+        """ Add one to the references to file_name, adding its row if it is the first. The row is added with a
+        statement that does nothing if another request has just added it, so the same file uploaded twice at once
+        does not break the unique file name """
+        if session.get_bind().dialect.name == "postgresql":
+            insert = ("INSERT INTO stored_files (file_name, file_hash, \"references\", date_added) "
+                      "VALUES (:file_name, :file_hash, 0, :date_added) ON CONFLICT (file_name) DO NOTHING")
+        else:
+            insert = ("INSERT OR IGNORE INTO stored_files (file_name, file_hash, \"references\", date_added) "
+                      "VALUES (:file_name, :file_hash, 0, :date_added)")
+        session.execute(text(insert).bindparams(bindparam('date_added', type_=DateTime)),
+                        dict(file_name=file_name, file_hash=file_hash, date_added=datetime.now()))
+        table = StoredFile.__table__
+        session.execute(table.update().where(table.c.file_name == file_name).values(
+            references=table.c.references + 1))
+
+    @staticmethod
+    def release(upload_location, file_name):
+        """ Drop one reference to a stored file. Once the request has committed, the file is deleted if nothing else
+        uses it, see _remove_released_files """
+        table = StoredFile.__table__
+        session.execute(table.update().where(table.c.file_name == file_name).values(
+            references=table.c.references - 1))
+        session.info.setdefault('released_files', set()).add((upload_location, file_name))
+
+    @staticmethod
+    def remove_unused(bind, upload_location, file_name):
+        """ Delete the stored file if no upload uses it. The row is only deleted while it has no references, and the
+        file is removed before that is committed, so an upload of the same file waits for both and then stores it
+        again """
+        table = StoredFile.__table__
+        with bind.begin() as connection:
+            removed = connection.execute(table.delete().where(and_(table.c.file_name == file_name,
+                                                                   table.c.references <= 0))).rowcount
+            file_path = path.join(ROOT_DIR, upload_location, file_name)
+            if removed and path.exists(file_path):
+                remove(file_path)
+
+    @staticmethod
+    def get_hash(file_name):
+        stored = session.query(StoredFile).filter_by(file_name=file_name).first()
+        return stored.file_hash if stored is not None else None
+
+    @staticmethod
+    def add_existing_uploads():
+        """ Move the uploads saved before the store was turned on into it. Files that no longer match their recorded
+        hash are left where they are. Returns the number of uploads moved and the number left """
+        num_moved = num_left = 0
+        for model in (TaskUpload, CaseUpload, EvidencePhotoUpload):
+            uploads = session.query(model).filter(model.deleted.isnot(True)).order_by(model.id).all()
+            for upload in uploads:
+                if StoredFile.is_stored(upload.upload_location):
+                    continue
+                source = path.join(ROOT_DIR, upload.upload_location, upload.file_name)
+                if not path.exists(source) or hash_file(source) != upload.file_hash:
+                    num_left += 1
+                    continue
+                upload.upload_location, upload.file_name = StoredFile.add(source, upload.file_hash, upload.file_name)
+                num_moved += 1
+            session.commit()
+        return num_moved, num_left
+
+
 class UploadModel(Model):
     id = Column(Integer, primary_key=True)
 
@@ -1083,17 +1344,37 @@ class UploadModel(Model):
     def deleter_id(cls):
         return Column(Integer, ForeignKey('users.id'))
 
+    @declared_attr
+    def integrity_check(cls):
+        return _integrity_check_relation(cls)
+
     ROOT = path.join(ROOT_DIR)
 
-    def __init__(self, uploader_id, file_name, file_note, title):
+    def __init__(self, uploader_id, file_name, file_note, title, file_hash=None):
         self.uploader_id = uploader_id
         self.date_time = datetime.now()
         self.file_name = file_name
         self.file_note = file_note
         self.file_title = title
-        self.file_hash = self.compute_hash()
+        # the hash is normally worked out while the file is uploaded, or known from the store, so the file does not
+        # need reading again
+        if file_hash is None and StoredFile.is_stored(self.upload_location):
+            file_hash = StoredFile.get_hash(file_name)
+        self.file_hash = file_hash if file_hash is not None else self.compute_hash()
         self.deleted = False
 
+    @staticmethod
+    def save_file(f, upload_location):
+        """ Save the uploaded file f, in upload_location or in the store if uploads are deduplicated. Returns the
+        upload location and file name to give the upload, and the hash of the file """
+        if deduplicate_uploads():
+            temp_name, file_hash = upload_file_with_hash(f, upload_temp_dir())
+            upload_location, file_name = StoredFile.add(path.join(upload_temp_dir(), temp_name), file_hash,
+                                                        f.filename)
+        else:
+            file_name, file_hash = upload_file_with_hash(f, path.join(UploadModel.ROOT, upload_location))
+        return upload_location, file_name, file_hash
+
     @property
     def date(self):
         return ForemanOptions.get_date(self.date_time)
@@ -1110,17 +1391,12 @@ class UploadModel(Model):
         return self.file_hash == self.compute_hash()
 
     def compute_hash(self):
-        blocksize = 65536
-        hasher = hash_library()
-        with open(path.join(self.ROOT, self.upload_location, self.file_name), "rb") as f:
-            buf = f.read(blocksize)
-            while len(buf) > 0:
-                hasher.update(buf)
-                buf = f.read(blocksize)
-        return hasher.hexdigest()
+        return hash_file(path.join(self.ROOT, self.upload_location, self.file_name))
 
     def delete(self, user):
-        if path.exists(path.join(self.ROOT, self.upload_location, self.file_name)):
+        if StoredFile.is_stored(self.upload_location):
+            StoredFile.release(self.upload_location, self.file_name)
+        elif path.exists(path.join(self.ROOT, self.upload_location, self.file_name)):
             remove(path.join(self.ROOT, self.upload_location, self.file_name))
         self.deleted = True
         self.deleter = user
@@ -1138,13 +1414,13 @@ class EvidencePhotoUpload(UploadModel, Base):
                        foreign_keys='EvidencePhotoUpload.deleter_id')
     DEFAULT_FOLDER = path.join('files', 'evidence_photos')
 
-    def __init__(self, uploader_id, evidence_id, file_name, file_note, title, upload_location=None):
+    def __init__(self, uploader_id, evidence_id, file_name, file_note, title, upload_location=None, file_hash=None):
         self.evidence_id = evidence_id
         if upload_location is None:
             self.upload_location = path.join(EvidencePhotoUpload.DEFAULT_FOLDER, str(evidence_id))
         else:
             self.upload_location = upload_location
-        UploadModel.__init__(self, uploader_id, file_name, file_note, title)
+        UploadModel.__init__(self, uploader_id, file_name, file_note, title, file_hash)
 
     @staticmethod
     def get_changes_for_user(user):
@@ -1197,14 +1473,15 @@ class TaskUpload(UploadModel, Base):
     deleter = relation('User', backref=backref('files_deleted_from_tasks'), foreign_keys='TaskUpload.deleter_id')
     DEFAULT_FOLDER = path.join('files', 'task_uploads')
 
-    def __init__(self, uploader_id, task_id, case_id, file_name, file_note, title, upload_location=None):
+    def __init__(self, uploader_id, task_id, case_id, file_name, file_note, title, upload_location=None,
+                 file_hash=None):
         self.task_id = task_id
         if upload_location is None:
             self.upload_location = path.join(TaskUpload.DEFAULT_FOLDER, str(case_id) + "_" + str(task_id))
         else:
             self.upload_location = upload_location
 
-        UploadModel.__init__(self, uploader_id, file_name, file_note, title)
+        UploadModel.__init__(self, uploader_id, file_name, file_note, title, file_hash)
 
     @staticmethod
     def get_changes_for_user(user):
@@ -1226,19 +1503,20 @@ class TaskUpload(UploadModel, Base):
         return change_log
 
     @staticmethod
-    def get_changes(task):
-        q_added = session.query(TaskUpload).filter_by(task_id=task.id)
-        q_removed = session.query(TaskUpload).filter_by(task_id=task.id, deleted=True)
+    def get_changes(task, uploads=None):
+        if uploads is None:
+            uploads = session.query(TaskUpload).filter_by(task_id=task.id).all()
+        removed = [entry for entry in uploads if entry.deleted is True]
 
         change_log = []
-        for entry in q_added.all():
+        for entry in uploads:
             change_log.append({'date': entry.date,
                                'date_time': entry.date_time,
                                'user': entry.uploader,
                                'current': entry,
                                'object': ("Task", entry.task.task_name, entry.task.id, entry.task.case.id),
                                'change_log': "File '{}' was uploaded".format(entry.file_title)})
-        for entry in q_removed.all():
+        for entry in removed:
             change_log.append({'date': entry.deleted_date,
                                'date_time': entry.date_deleted,
                                'user': entry.deleter,
@@ -1248,6 +1526,97 @@ class TaskUpload(UploadModel, Base):
         return change_log
 
 
+class PartialTaskUpload(Base, Model):
+    """ A task upload that is sent in chunks, so that a very large file is not sent in one request and an upload that
+    is interrupted can carry on from where it stopped. The chunks are appended to a part file, which becomes a
+    TaskUpload once all of it has arrived. """
+    __tablename__ = 'partial_task_uploads'
+    # the size of the chunks the browser sends
+    CHUNK_SIZE = 8 * 1024 * 1024
+
+    id = Column(Integer, primary_key=True)
+    task_id = Column(Integer, ForeignKey('tasks.id'))
+    uploader_id = Column(Integer, ForeignKey('users.id'))
+    file_name = Column(Unicode)
+    file_size = Column(BigInteger)
+    date_started = Column(DateTime)
+
+    task = relation('Task', backref=backref('partial_uploads'))
+    uploader = relation('User', backref=backref('partial_task_uploads'))
+
+    def __init__(self, uploader_id, task_id, file_name, file_size):
+        self.uploader_id = uploader_id
+        self.task_id = task_id
+        self.file_name = file_name
+        self.file_size = file_size
+        self.date_started = datetime.now()
+
+    @property
+    def part_path(self):
+        return path.join(upload_temp_dir(), "task_upload_{}.part".format(self.id))
+
+    @property
+    def received(self):
+        """ The number of bytes received so far """
+        if path.exists(self.part_path):
+            return path.getsize(self.part_path)
+        return 0
+
+    @property
+    def finished(self):
+        return self.received == self.file_size
+
+    def add_chunk(self, stream, offset):
+        """ Append the chunk in stream, which starts offset bytes into the file. Returns False without reading it if
+        the chunk does not start where the last one ended, or it would make the file bigger than file_size """
+        if offset != self.received:
+            return False
+        buffer_size = upload_buffer_size()
+        with open(self.part_path, "ab") as part:
+            # a chunk sent again while the first attempt is still being written waits here, then finds it is no longer
+            # at the end of the file
+            flock(part.fileno(), LOCK_EX)
+            try:
+                if fstat(part.fileno()).st_size != offset:
+                    return False
+                part.seek(offset)
+                for block in iter(lambda: stream.read(buffer_size), ""):
+                    if part.tell() + len(block) > self.file_size:
+                        part.truncate(offset)
+                        return False
+                    part.write(block)
+                part.flush()
+            finally:
+                flock(part.fileno(), LOCK_UN)
+        return True
+
+    def complete(self, file_note, title):
+        """ Turn the finished part file into a TaskUpload. The file is renamed into the task's upload folder, or the
+        store if uploads are deduplicated, and this partial upload is deleted """
+        task = self.task
+        upload_location = path.join(TaskUpload.DEFAULT_FOLDER, str(task.case.id) + "_" + str(task.id))
+        # the chunks can come in over several requests and processes, so the hash is worked out once at the end
+        file_hash = hash_file(self.part_path)
+        if deduplicate_uploads():
+            upload_location, file_name = StoredFile.add(self.part_path, file_hash, self.file_name)
+        else:
+            new_directory = path.join(TaskUpload.ROOT, upload_location)
+            if not path.exists(new_directory):
+                makedirs(new_directory)
+            file_name = random_file_name(self.file_name)
+            move_file(self.part_path, path.join(new_directory, file_name))
+        upload = TaskUpload(self.uploader_id, task.id, task.case.id, file_name, file_note, title, upload_location,
+                            file_hash)
+        session.add(upload)
+        session.delete(self)
+        return upload
+
+    def abandon(self):
+        if path.exists(self.part_path):
+            remove(self.part_path)
+        session.delete(self)
+
+
 class CaseUpload(UploadModel, Base):
     __tablename__ = 'case_uploads'
 
@@ -1257,13 +1626,13 @@ class CaseUpload(UploadModel, Base):
     deleter = relation('User', backref=backref('files_deleted_from_cases'), foreign_keys='CaseUpload.deleter_id')
     DEFAULT_FOLDER = path.join('files', 'case_uploads')
 
-    def __init__(self, uploader_id, case_id, file_name, file_note, title, upload_location=None):
+    def __init__(self, uploader_id, case_id, file_name, file_note, title, upload_location=None, file_hash=None):
         self.case_id = case_id
         if upload_location is None:
             self.upload_location = path.join(CaseUpload.DEFAULT_FOLDER, str(case_id))
         else:
             self.upload_location = upload_location
-        UploadModel.__init__(self, uploader_id, file_name, file_note, title)
+        UploadModel.__init__(self, uploader_id, file_name, file_note, title, file_hash)
 
     @staticmethod
     def get_changes_for_user(user):
@@ -1309,6 +1678,7 @@ class CaseUpload(UploadModel, Base):
 
 class TaskNotes(Base, Model):
     __tablename__ = 'notes'
+    __table_args__ = (Index('ix_notes_task_id', 'task_id'),)
 
     id = Column(Integer, primary_key=True)
     task_id = Column(Integer, ForeignKey('tasks.id'))
@@ -1347,11 +1717,12 @@ class TaskNotes(Base, Model):
         return change_log
 
     @staticmethod
-    def get_changes(task):
-        q_added = session.query(TaskNotes).filter_by(task_id=task.id)
+    def get_changes(task, notes=None):
+        if notes is None:
+            notes = session.query(TaskNotes).filter_by(task_id=task.id).all()
 
         change_log = []
-        for entry in q_added.all():
+        for entry in notes:
             change_log.append({'date': entry.date,
                                'date_time': entry.date_time,
                                'user': entry.author,
@@ -1361,8 +1732,12 @@ class TaskNotes(Base, Model):
         return change_log
 
 
+TaskNotes.integrity_check = _integrity_check_relation(TaskNotes)
+
+
 class TaskHistory(Base, HistoryModel):
     __tablename__ = 'task_history'
+    __table_args__ = (Index('ix_task_history_task_id', 'task_id', 'id'),)
 
     id = Column(Integer, primary_key=True)
     date_time = Column(DateTime)
@@ -1382,6 +1757,7 @@ class TaskHistory(Base, HistoryModel):
     comparable_fields = {'Task Name': 'task_name', 'Background': 'background', "Task Files Location": 'location',
                          "Deadline": "deadline"}
     history_name = ("Task", "task_name", "task_id", "case_id")
+    previous_partition = ('task_id',)
 
     def __init__(self, task, user):
         self.task_id = task.id
@@ -1394,12 +1770,6 @@ class TaskHistory(Base, HistoryModel):
         self.user = user
         self.case_id = task.case.id
 
-    @property
-    def previous(self):
-        q = session.query(TaskHistory)
-        q = q.filter_by(task_id=self.task_id).filter(TaskHistory.id < self.id).order_by(desc(TaskHistory.id))
-        return q.first()
-
     @property
     def date(self):
         return ForemanOptions.get_date(self.date_time)
@@ -1419,6 +1789,9 @@ class TaskHistory(Base, HistoryModel):
 
 class Task(Base, Model):
     __tablename__ = 'tasks'
+    __table_args__ = (Index('ix_tasks_case_id', 'case_id'),
+                      Index('ix_tasks_currentStatus', 'currentStatus'),
+                      Index('ix_tasks_creation_date', 'creation_date', 'id'))
 
     id = Column(Integer, primary_key=True)
     task_name = Column(Unicode)
@@ -1435,6 +1808,19 @@ class Task(Base, Model):
     case = relation('Case', backref=backref('tasks', order_by=desc(id)))
     task_type = relation('TaskType', backref=backref('tasks', order_by=desc(task_type_id)))
 
+    loading_profiles = {
+        'view': [joinedload('case').subqueryload('case_roles').joinedload('user'),
+                 joinedload('case').subqueryload('statuses'),
+                 joinedload('task_type'),
+                 subqueryload('statuses'),
+                 subqueryload('task_roles').joinedload('user'),
+                 subqueryload('task_uploads').joinedload('integrity_check')],
+        'list': [joinedload('case').subqueryload('case_roles').joinedload('user'),
+                 joinedload('task_type'),
+                 subqueryload('statuses'),
+                 subqueryload('task_roles').joinedload('user')],
+    }
+
     def __init__(self, case, task_type, task_name, user, background=None, location=None, date=None, deadline=None):
         self.task_name = task_name
         self.case = case
@@ -1492,10 +1878,25 @@ class Task(Base, Model):
         self.currentStatus = status
         self.statuses.append(TaskStatus(self.id, status, user, self.case))
         session.flush()
+        sidebar_cache.invalidate()
 
     def get_status(self):
+        statuses = loaded_relationship(self, 'statuses')
+        if statuses is not None:
+            return _latest_status(statuses)
         return session.query(TaskStatus).filter_by(task_id=self.id).order_by(desc(TaskStatus.id)).first()
 
+    def _active_before_start(self, day_tracker):
+        return date(day_tracker.year, day_tracker.month, day_tracker.day) >= self.creation_date.date()
+
+    def _active_after_end(self, day_tracker):
+        task_status = self.get_status()
+        return not (task_status.status in TaskStatus.closedStatuses and
+                    date(day_tracker.year, day_tracker.month, day_tracker.day) > task_status.date_time.date())
+
+    def active_user(self, day_tracker):
+        return self._active_before_start(day_tracker) and self._active_after_end(day_tracker)
+
     def get_user_roles(self, user_id):
         return session.query(UserTaskRoles).filter_by(task_id=self.id, user_id=user_id).all()
 
@@ -1652,7 +2053,16 @@ class Task(Base, Model):
         self.set_status(TaskStatus.COMPLETE, user)
 
     @staticmethod
-    def _check_perms(investigator, tasks, case_perm_checker):
+    def _check_perms(investigator, tasks, case_perm_checker, page=None):
+        """ Tasks that investigator can view. Queries are filtered by the database using the view permissions,
+        anything else is checked one at a time with case_perm_checker. If page is given (the cursor arguments of a
+        KeysetPage), a query returns that page of the tasks, newest first """
+        if isinstance(tasks, Query):
+            from permissions import permissions_filter
+            tasks = tasks.filter(permissions_filter(investigator, Task, "view"))
+            if page is not None:
+                return KeysetPage(tasks, [Task.creation_date, Task.id], options=Task.loading_profiles['list'], **page)
+            return tasks.all()
         output = []
         for task in tasks:
             try:
@@ -1663,30 +2073,28 @@ class Task(Base, Model):
         return output
 
     @staticmethod
-    def get_completed_qas(investigator, case_perm_checker, current_user):
+    def get_completed_qas(investigator, case_perm_checker, current_user, page=None):
         q = session.query(Task)
-        q = q.join(UserTaskRoles).filter(UserTaskRoles.user_id == investigator.id).filter(or_(
-            UserTaskRoles.role == UserTaskRoles.PRINCIPLE_QA,
-            UserTaskRoles.role == UserTaskRoles.SECONDARY_QA))
-        q = q.join(TaskStatus).filter(TaskStatus.status.in_(TaskStatus.qaComplete))
-        return Task._check_perms(current_user, q, case_perm_checker)
+        q = q.filter(exists().where(and_(UserTaskRoles.task_id == Task.id, UserTaskRoles.user_id == investigator.id,
+                                         UserTaskRoles.role.in_(UserTaskRoles.qa_roles))))
+        q = q.filter(exists().where(and_(TaskStatus.task_id == Task.id, TaskStatus.status.in_(TaskStatus.qaComplete))))
+        return Task._check_perms(current_user, q, case_perm_checker, page)
 
     @staticmethod
-    def get_current_qas(investigator, case_perm_checker, current_user):
-        return Task.get_active_QAs(investigator, case_perm_checker, True, current_user)
+    def get_current_qas(investigator, case_perm_checker, current_user, page=None):
+        return Task.get_active_QAs(investigator, case_perm_checker, True, current_user, page)
 
     @staticmethod
-    def get_completed_investigations(investigator, case_perm_checker, current_user):
+    def get_completed_investigations(investigator, case_perm_checker, current_user, page=None):
         q = session.query(Task)
-        q = q.join(UserTaskRoles).filter(UserTaskRoles.user_id == investigator.id).filter(or_(
-            UserTaskRoles.role == UserTaskRoles.SECONDARY_INVESTIGATOR,
-            UserTaskRoles.role == UserTaskRoles.PRINCIPLE_INVESTIGATOR))
-        q = q.join(TaskStatus).filter(TaskStatus.status == TaskStatus.COMPLETE)
-        return Task._check_perms(current_user, q, case_perm_checker)
+        q = q.filter(exists().where(and_(UserTaskRoles.task_id == Task.id, UserTaskRoles.user_id == investigator.id,
+                                         UserTaskRoles.role.in_(UserTaskRoles.inv_roles))))
+        q = q.filter(exists().where(and_(TaskStatus.task_id == Task.id, TaskStatus.status == TaskStatus.COMPLETE)))
+        return Task._check_perms(current_user, q, case_perm_checker, page)
 
     @staticmethod
-    def get_current_investigations(investigator, case_perm_checker, current_user):
-        return Task.get_active_tasks(investigator, case_perm_checker, True, current_user)
+    def get_current_investigations(investigator, case_perm_checker, current_user, page=None):
+        return Task.get_active_tasks(investigator, case_perm_checker, True, current_user, page)
 
     @staticmethod
     def get_num_created_tasks_for_given_month_user_is_investigator_for(investigator, category, date_required):
@@ -1725,6 +2133,44 @@ class Task(Base, Model):
             UserTaskRoles.role.in_(user_roles))
         return q.scalar()
 
+    @staticmethod
+    def get_num_tasks_by_users_for_date_range(investigators, start, end, statuses):
+        """ The grouped form of get_num_tasks_by_user_for_date_range: counts for every investigator, status and task
+        category at once. Returns {(user_id, status, category): count}, where category None holds the total over all
+        categories. """
+        user_ids = [user.id for user in investigators]
+        if not user_ids:
+            return {}
+
+        # "Waiting for QA" is the QA status seen by the investigators, "Performing QA" the same status seen by the QAs
+        role_groups = []
+        inv_statuses = [status for status in statuses if status in TaskStatus.all_statuses]
+        if "Waiting for QA" in statuses:
+            inv_statuses.append(TaskStatus.QA)
+        if inv_statuses:
+            role_groups.append((UserTaskRoles.inv_roles, inv_statuses, {TaskStatus.QA: "Waiting for QA"}))
+        if "Performing QA" in statuses:
+            role_groups.append((UserTaskRoles.qa_roles, [TaskStatus.QA], {TaskStatus.QA: "Performing QA"}))
+
+        def count_query(user_roles, task_statuses, *group_by):
+            q = session.query(UserTaskRoles.user_id, TaskStatus.status, *(group_by + (func.count(distinct(Task.id)),)))
+            q = q.select_from(Task).join(TaskStatus).filter(and_(TaskStatus.date_time >= start,
+                                                                 TaskStatus.date_time <= end,
+                                                                 TaskStatus.status.in_(task_statuses)))
+            if group_by:
+                q = q.join(TaskType).join(TaskCategory)
+            q = q.join(UserTaskRoles).filter(UserTaskRoles.user_id.in_(user_ids)).filter(
+                UserTaskRoles.role.in_(user_roles))
+            return q.group_by(UserTaskRoles.user_id, TaskStatus.status, *group_by)
+
+        results = {}
+        for user_roles, task_statuses, labels in role_groups:
+            for user_id, status, category, amount in count_query(user_roles, task_statuses, TaskCategory.category):
+                results[(user_id, labels.get(status, status), category)] = amount
+            for user_id, status, amount in count_query(user_roles, task_statuses):
+                results[(user_id, labels.get(status, status), None)] = amount
+        return results
+
     @staticmethod
     def get_num_completed_qas_for_given_month(investigator, date_required):
         month = date_required.month
@@ -1740,6 +2186,34 @@ class Task(Base, Model):
                                            TaskStatus.date_time <= last_day))
         return q.scalar()
 
+    @staticmethod
+    def get_num_created_tasks_by_investigators(investigators, start, end):
+        """ The number of tasks created from start up to end for each investigator, grouped by task category.
+        Returns {(user_id, category): count} """
+        user_ids = [user.id for user in investigators]
+        if not user_ids:
+            return {}
+        q = session.query(UserTaskRoles.user_id, TaskCategory.category, func.count(Task.id)).select_from(Task)
+        q = q.filter(and_(Task.creation_date >= start, Task.creation_date < end))
+        q = q.join(UserTaskRoles).filter(UserTaskRoles.user_id.in_(user_ids)).filter(
+            UserTaskRoles.role.in_(UserTaskRoles.inv_roles))
+        q = q.join(TaskType).join(TaskCategory).group_by(UserTaskRoles.user_id, TaskCategory.category)
+        return dict(((user_id, category), amount) for user_id, category, amount in q)
+
+    @staticmethod
+    def get_num_completed_qas_by_users(investigators, start, end):
+        """ The number of tasks each user QAed that were delivered from start up to end. Returns {user_id: count} """
+        user_ids = [user.id for user in investigators]
+        if not user_ids:
+            return {}
+        q = session.query(UserTaskRoles.user_id, func.count(Task.id)).select_from(Task)
+        q = q.join(UserTaskRoles).filter(UserTaskRoles.user_id.in_(user_ids)).filter(
+            UserTaskRoles.role.in_(UserTaskRoles.qa_roles))
+        q = q.join(TaskStatus).filter(and_(TaskStatus.status == TaskStatus.DELIVERY,
+                                           TaskStatus.date_time >= start,
+                                           TaskStatus.date_time < end))
+        return dict(q.group_by(UserTaskRoles.user_id).all())
+
     @staticmethod
     def get_queued_tasks():
         q = session.query(Task).join('case').filter(Task.currentStatus == TaskStatus.QUEUED).filter(
@@ -1748,7 +2222,7 @@ class Task(Base, Model):
 
     @staticmethod
     def _get_user_tasks(user=None, user_groups=None, task_statuses=None, case_perm_checker=None, filter_check=None,
-                        current_user=None, case_statuses=None):
+                        current_user=None, case_statuses=None, page=None):
         if case_statuses is None:
             case_statuses = [CaseStatus.OPEN]
         q = session.query(Task)
@@ -1759,29 +2233,29 @@ class Task(Base, Model):
         q = q.join('case').filter(Case.currentStatus.in_(case_statuses))
         if case_perm_checker is not None:
             if current_user is None:
-                return Task._check_perms(user, q, case_perm_checker)  # do not want to show private cases
+                return Task._check_perms(user, q, case_perm_checker, page)  # do not want to show private cases
             else:
-                return Task._check_perms(current_user, q, case_perm_checker)
+                return Task._check_perms(current_user, q, case_perm_checker, page)
         else:
             return q.all()
 
     @staticmethod
-    def get_active_QAs(user=None, case_perm_checker=None, filter_check=None, current_user=None):
+    def get_active_QAs(user=None, case_perm_checker=None, filter_check=None, current_user=None, page=None):
         if case_perm_checker is None:
             query = Task._get_user_tasks(user, UserTaskRoles.qa_roles, [TaskStatus.QA], filter_check=True)
         else:
             query = Task._get_user_tasks(user, UserTaskRoles.qa_roles, [TaskStatus.QA], case_perm_checker,
-                                         filter_check=filter_check, current_user=current_user)
+                                         filter_check=filter_check, current_user=current_user, page=page)
         return query
 
     @staticmethod
-    def get_active_tasks(user=None, case_perm_checker=None, filter_check=None, current_user=None):
+    def get_active_tasks(user=None, case_perm_checker=None, filter_check=None, current_user=None, page=None):
         if case_perm_checker is None:
             query = Task._get_user_tasks(user, UserTaskRoles.inv_roles, TaskStatus.openStatuses, filter_check=True)
         else:
             query = Task._get_user_tasks(user, UserTaskRoles.inv_roles, TaskStatus.openStatuses,
                                          case_perm_checker=case_perm_checker, filter_check=filter_check,
-                                         current_user=current_user)
+                                         current_user=current_user, page=page)
         return query
 
     @staticmethod
@@ -1809,36 +2283,42 @@ class Task(Base, Model):
         q = session.query(Task).join('task_type').filter_by(task_type=task_type.task_type).all()
         return q
 
+    def _get_user_with_role(self, role):
+        task_roles = loaded_relationship(self, 'task_roles')
+        if task_roles is not None:
+            return _role_holder(task_roles, role)
+        return User.get_user_with_role(role, task_id=self.id)
+
+    def _get_users_with_roles(self, roles):
+        task_roles = loaded_relationship(self, 'task_roles')
+        if task_roles is not None:
+            return _role_holders(task_roles, roles)
+        return session.query(User).join('task_roles').filter(and_(UserTaskRoles.task_id == self.id,
+                                                                  UserTaskRoles.role.in_(roles))).all()
+
     @property
     def principle_investigator(self):
-        return User.get_user_with_role(UserTaskRoles.PRINCIPLE_INVESTIGATOR, task_id=self.id)
+        return self._get_user_with_role(UserTaskRoles.PRINCIPLE_INVESTIGATOR)
 
     @property
     def secondary_investigator(self):
-        return User.get_user_with_role(UserTaskRoles.SECONDARY_INVESTIGATOR, task_id=self.id)
+        return self._get_user_with_role(UserTaskRoles.SECONDARY_INVESTIGATOR)
 
     @property
     def principle_QA(self):
-        return User.get_user_with_role(UserTaskRoles.PRINCIPLE_QA, task_id=self.id)
+        return self._get_user_with_role(UserTaskRoles.PRINCIPLE_QA)
 
     @property
     def secondary_QA(self):
-        return User.get_user_with_role(UserTaskRoles.SECONDARY_QA, task_id=self.id)
+        return self._get_user_with_role(UserTaskRoles.SECONDARY_QA)
 
     @property
     def investigators(self):
-        query = session.query(User).join('task_roles').filter(and_(UserTaskRoles.task_id == self.id,
-                                                                   or_(
-                                                                       UserTaskRoles.role == UserTaskRoles.PRINCIPLE_INVESTIGATOR,
-                                                                       UserTaskRoles.role == UserTaskRoles.SECONDARY_INVESTIGATOR)))
-        return query.all()
+        return self._get_users_with_roles([UserTaskRoles.PRINCIPLE_INVESTIGATOR, UserTaskRoles.SECONDARY_INVESTIGATOR])
 
     @property
     def QAs(self):
-        query = session.query(User).join('task_roles').filter(and_(UserTaskRoles.task_id == self.id,
-                                                                   or_(UserTaskRoles.role == UserTaskRoles.PRINCIPLE_QA,
-                                                                       UserTaskRoles.role == UserTaskRoles.SECONDARY_QA)))
-        return query.all()
+        return self._get_users_with_roles([UserTaskRoles.PRINCIPLE_QA, UserTaskRoles.SECONDARY_QA])
 
     @property
     def workers(self):
@@ -1852,3 +2332,49 @@ class Task(Base, Model):
 
     def __str__(self):
         return "{}".format(self.task_name)
+
+
+# rows that are added by id rather than through their parent's collection, or are deleted, would leave a loaded
+# collection out of date, so it is expired and loaded again when it is next used
+_parent_collections = {UserCaseRoles: ('case_id', Case, 'case_roles'),
+                       UserTaskRoles: ('task_id', Task, 'task_roles'),
+                       CaseStatus: ('case_id', Case, 'statuses'),
+                       TaskStatus: ('task_id', Task, 'statuses'),
+                       EvidenceStatus: ('evidence_id', Evidence, 'statuses')}
+
+
+@event.listens_for(session, 'after_flush')
+def _find_stale_collections(db_session, flush_context):
+    stale = db_session.info.setdefault('stale_collections', set())
+    for rows, added in ((db_session.new, True), (db_session.deleted, False)):
+        for row in rows:
+            if type(row) not in _parent_collections:
+                continue
+            foreign_key, parent_class, collection = _parent_collections[type(row)]
+            if getattr(row, foreign_key) is None:
+                continue
+            parent = db_session.identity_map.get(identity_key(parent_class, getattr(row, foreign_key)))
+            if parent is None or parent in db_session.deleted:
+                continue
+            loaded = loaded_relationship(parent, collection)
+            if loaded is not None and (not added or row not in loaded):
+                stale.add((parent, collection))
+
+
+@event.listens_for(session, 'after_flush_postexec')
+def _expire_stale_collections(db_session, flush_context):
+    for parent, collection in db_session.info.pop('stale_collections', ()):
+        db_session.expire(parent, [collection])
+
+
+@event.listens_for(session, 'after_commit')
+def _remove_released_files(db_session):
+    # only once the release is committed, so a rolled back delete does not lose the file
+    released = db_session.info.pop('released_files', ())
+    for upload_location, file_name in released:
+        StoredFile.remove_unused(db_session.get_bind(), upload_location, file_name)
+
+
+@event.listens_for(session, 'after_rollback')
+def _forget_released_files(db_session):
+    db_session.info.pop('released_files', None)
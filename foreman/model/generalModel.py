@@ -1,14 +1,16 @@
 # python imports
-from datetime import datetime
+from datetime import datetime, timedelta
 import shutil
 from os import path
 # library imports
-from sqlalchemy import Table, Column, Integer, DateTime, Boolean, Unicode, ForeignKey, asc, desc
-from sqlalchemy.orm import backref, relation
+from sqlalchemy import Table, Column, Integer, DateTime, Boolean, Unicode, String, ForeignKey, Index, asc, desc, event
+from sqlalchemy.sql.expression import case as sql_case
+from sqlalchemy.orm import backref, relation, object_session
 from werkzeug.exceptions import InternalServerError
 # local imports
 from models import Base, Model
 from ..utils.utils import session, ROOT_DIR
+from ..utils.cache import VersionedCache
 
 
 class ForemanOptions(Base, Model):
@@ -63,11 +65,11 @@ class ForemanOptions(Base, Model):
         self.c_increment = -1
         self.c_leading_zeros = c_leading_zeros
         self.c_leading_date = datetime.now().strftime("%Y%m%d")
-        self.c_list_name = self.import_list(c_list_location)
+        self.c_list_name = self.import_list(c_list_location, NamePool.CASE)
         self.task_names = task_names
         self.t_increment = -1
         self.t_leading_zeros = t_leading_zeros
-        self.t_list_name = self.import_list(t_list_location)
+        self.t_list_name = self.import_list(t_list_location, NamePool.TASK)
         self.company = company
         self.department = department
         self.date_created = datetime.now()
@@ -104,13 +106,15 @@ class ForemanOptions(Base, Model):
         session.commit()
 
     @staticmethod
-    def import_list(list_location):
+    def import_list(list_location, list_type=None):
         if list_location is not None:
             unique = datetime.now().strftime("%H%M%S-%d%m%Y-%f")
             filename, ext = path.splitext(path.basename(list_location))
             full_filename = "{}_{}{}".format(filename, unique, ext)
             destination = path.join(ROOT_DIR, 'files', full_filename)
             shutil.copy(list_location, destination)
+            if list_type is not None:
+                NamePool.import_names(list_type, destination)
             return destination
 
     @staticmethod
@@ -118,7 +122,7 @@ class ForemanOptions(Base, Model):
         options = session.query(ForemanOptions).first()
         count = options.check_list_valid(list_location)
         if count:
-            dest = options.import_list(list_location)
+            dest = options.import_list(list_location, type_list)
             # reset
             if type_list == "case":
                 options.c_increment = -1
@@ -142,105 +146,103 @@ class ForemanOptions(Base, Model):
 
     @staticmethod
     def get_date(date):
-        options = session.query(ForemanOptions).first()
-        date_format = options.date_format
+        date_format = ForemanOptions.get_cached_options().date_format
         return date.strftime(date_format)
 
     @staticmethod
     def get_default_location():
-        options = session.query(ForemanOptions).first()
+        options = ForemanOptions.get_cached_options()
         return options.default_location
 
     @staticmethod
     def get_date_created():
-        options = session.query(ForemanOptions).first()
+        options = ForemanOptions.get_cached_options()
         return options.date_created
 
     @staticmethod
     def get_evidence_retention_period():
-        options = session.query(ForemanOptions).first()
+        options = ForemanOptions.get_cached_options()
         return options.evidence_retention, options.evidence_retention_period
 
     @staticmethod
     def run_out_of_names():
-        options = session.query(ForemanOptions).first()
+        options = ForemanOptions.get_cached_options()
         return [options.over_limit_task and options.task_names == "FromList",
                 options.over_limit_case and options.case_names == "FromList"]
 
+    @staticmethod
+    def _next_case_number(date_numeric=False):
+        """ Add one to the case counter with a single UPDATE, which holds the options row until the request's
+        transaction ends, so two cases created at the same time in different processes never get the same number.
+        Returns the new number and the date it belongs to """
+        table = ForemanOptions.__table__
+        if date_numeric:
+            today = datetime.now().strftime("%Y%m%d")
+            values = dict(c_increment=sql_case([(table.c.c_leading_date == today, table.c.c_increment + 1)], else_=1),
+                          c_leading_date=today)
+        else:
+            values = dict(c_increment=table.c.c_increment + 1)
+        session.execute(table.update().values(**values))
+        return session.query(ForemanOptions.c_increment, ForemanOptions.c_leading_date).first()
+
     @staticmethod
     def get_next_case_name(test=False):
-        options = session.query(ForemanOptions).first()
+        options = ForemanOptions.get_cached_options()
         if options.case_names == 'NumericIncrement':
-            options.c_increment += 1
-            return '{num:0{width}}'.format(num=options.c_increment, width=options.c_leading_zeros)
+            increment, unused_date = ForemanOptions._next_case_number()
+            return '{num:0{width}}'.format(num=increment, width=options.c_leading_zeros)
         elif options.case_names == "DateNumericIncrement":
-            now = datetime.now().strftime("%Y%m%d")
-            if now == options.c_leading_date:
-                options.c_increment += 1
-                return '{now}{num:0{width}}'.format(now=now, num=options.c_increment, width=options.c_leading_zeros)
-            else:
-                options.c_increment = 1
-                options.c_leading_date = now
-                return '{now}{num:0{width}}'.format(now=now, num=options.c_increment, width=options.c_leading_zeros)
+            increment, now = ForemanOptions._next_case_number(date_numeric=True)
+            return '{now}{num:0{width}}'.format(now=now, num=increment, width=options.c_leading_zeros)
         elif options.case_names == "FromList":
-            options.c_increment += 1
-            return ForemanOptions.get_next_case_name_from_list(options.c_list_name, options.c_increment,
-                                                               options, "c", test)
+            if test is True:
+                # only checks there is a name left, without using it
+                increment = session.query(ForemanOptions.c_increment).scalar() + 1
+            else:
+                increment, unused_date = ForemanOptions._next_case_number()
+            return ForemanOptions._name_from_list(NamePool.CASE, increment, options.c_leading_zeros)
 
     @staticmethod
     def get_next_task_name(case, tasktype=None, test=False):
-        options = session.query(ForemanOptions).first()
+        """ Task numbers count the tasks already in the case, so they are worked out without changing the options """
+        options = ForemanOptions.get_cached_options()
         if case is not None:
-            options.t_increment = len(case.tasks)
+            increment = len(case.tasks) + 1
         else:
-            options.t_increment = -1
+            increment = 0
         if options.task_names == 'NumericIncrement':
-            options.t_increment += 1
-            return '{case}_{num1:0{width1}}'.format(case=case.case_name, num1=options.t_increment,
+            return '{case}_{num1:0{width1}}'.format(case=case.case_name, num1=increment,
                                                     width1=options.t_leading_zeros)
         elif options.task_names == "FromList":
-            options.t_increment += 1
-            return ForemanOptions.get_next_case_name_from_list(options.t_list_name, options.t_increment,
-                                                               options, "t", test)
+            return ForemanOptions._name_from_list(NamePool.TASK, increment, options.t_leading_zeros)
         elif options.task_names == "TaskTypeNumericIncrement":
-            options.t_increment += 1
-            return '{task}_{num1:0{width1}}'.format(task=tasktype, num1=options.t_increment,
+            return '{task}_{num1:0{width1}}'.format(task=tasktype, num1=increment,
                                                     width1=options.t_leading_zeros)
 
     @staticmethod
-    def get_next_case_name_from_list(filename, increment, options, content_type, test):
-
-        if filename is None:
-            results = '{num:0{width}}'.format(num=options.c_increment, width=options.c_leading_zeros)
-            if content_type == "t":
-                options.over_limit_task = True
-            elif content_type == "c":
-                options.over_limit_case = True
-            return results
-
-        with open(filename, 'r') as contents:
-            all_content = contents.readlines()
-            try:
-                results = all_content[increment].strip()
-                if test is True:
-                # if it's a test, and there is actually a next one; then reverse the increment otherwise
-                # using one for no reason
-                    if content_type == "t":
-                        options.t_increment -= 1
-                    elif content_type == "c":
-                        options.c_increment -= 1
-            except IndexError:
-                results = '{num:0{width}}'.format(num=options.c_increment, width=options.c_leading_zeros)
-                if content_type == "t":
-                    options.over_limit_task = True
-                elif content_type == "c":
-                    options.over_limit_case = True
-        return results
+    def _name_from_list(list_type, increment, width):
+        """ The name at position increment of the imported list. Once the list has run out the number is used
+        instead, and the admins are warned """
+        name = NamePool.get_name(list_type, increment)
+        if name is not None:
+            return name
+        options = ForemanOptions.get_options()
+        if list_type == NamePool.TASK and not options.over_limit_task:
+            options.over_limit_task = True
+        elif list_type == NamePool.CASE and not options.over_limit_case:
+            options.over_limit_case = True
+        return '{num:0{width}}'.format(num=increment, width=width)
 
     @staticmethod
     def get_options():
         return session.query(ForemanOptions).first()
 
+    @staticmethod
+    def get_cached_options():
+        """ A read only copy of the options, shared between requests until the options change. Use get_options to
+        change them """
+        return options_cache.get(lambda: CachedOptions(ForemanOptions.get_options()))
+
     @staticmethod
     def set_options(company, department, folder, date_display, case_names, task_names):
         opt = ForemanOptions.get_options()
@@ -252,6 +254,51 @@ class ForemanOptions(Base, Model):
         opt.task_names = task_names
 
 
+class CachedOptions(object):
+    def __init__(self, options):
+        for column in ForemanOptions.__table__.columns:
+            setattr(self, column.key, getattr(options, column.key))
+
+
+class OptionsVersion(Base, Model):
+    """ Counts the changes to the options, so each process knows when its cached copy of them is out of date """
+    __tablename__ = 'options_version'
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer)
+
+    @staticmethod
+    def get_version():
+        version = session.query(OptionsVersion.version).scalar()
+        return version if version is not None else 0
+
+
+options_cache = VersionedCache('options', OptionsVersion.get_version)
+
+
+def _option_set(target, value, oldvalue, initiator):
+    options_cache.changed()
+
+for _column in ForemanOptions.__table__.columns:
+    event.listen(getattr(ForemanOptions, _column.key), 'set', _option_set)
+
+
+@event.listens_for(ForemanOptions, 'after_insert')
+@event.listens_for(ForemanOptions, 'after_update')
+def _options_changed(mapper, connection, target):
+    if not object_session(target).is_modified(target, include_collections=False):
+        return
+    table = OptionsVersion.__table__
+    if connection.execute(table.update().values(version=table.c.version + 1)).rowcount == 0:
+        connection.execute(table.insert().values(version=1))
+
+
+@event.listens_for(session, 'after_commit')
+@event.listens_for(session, 'after_rollback')
+def _options_transaction_finished(db_session):
+    options_cache.finished()
+
+
 class TaskType(Base, Model):
     __tablename__ = 'task_types'
 
@@ -524,3 +571,168 @@ class CasePriority(Base, Model):
 
     def __str__(self):
         return self.case_priority
+
+
+class QueuedEmail(Base, Model):
+    """ An email waiting to be sent by the mail worker, see utils.mail.send_queued_emails """
+    __tablename__ = 'email_queue'
+    __table_args__ = (Index('ix_email_queue_date_sent', 'date_sent', 'next_attempt'),)
+
+    id = Column(Integer, primary_key=True)
+    to_addrs = Column(Unicode)
+    cc = Column(Unicode)
+    bcc = Column(Unicode)
+    from_addr = Column(Unicode)
+    subject = Column(Unicode)
+    body = Column(Unicode)
+    date_queued = Column(DateTime)
+    date_sent = Column(DateTime)
+    next_attempt = Column(DateTime)
+    attempts = Column(Integer)
+    last_error = Column(Unicode)
+
+    def __init__(self, to_addrs, subject, body, from_addr, cc=None, bcc=None):
+        self.to_addrs = u", ".join(to_addrs)
+        self.cc = u", ".join(cc) if cc else None
+        self.bcc = u", ".join(bcc) if bcc else None
+        self.from_addr = from_addr
+        self.subject = subject
+        self.body = body
+        self.date_queued = datetime.now()
+        self.next_attempt = self.date_queued
+        self.attempts = 0
+
+    @staticmethod
+    def _split(addrs):
+        return [addr for addr in addrs.split(", ") if addr] if addrs else []
+
+    @property
+    def recipients(self):
+        return self._split(self.to_addrs)
+
+    @property
+    def cc_recipients(self):
+        return self._split(self.cc)
+
+    @property
+    def bcc_recipients(self):
+        return self._split(self.bcc)
+
+    @staticmethod
+    def get_due(limit, max_attempts):
+        q = session.query(QueuedEmail).filter(QueuedEmail.date_sent == None,
+                                              QueuedEmail.next_attempt <= datetime.now(),
+                                              QueuedEmail.attempts < max_attempts)
+        return q.order_by(asc(QueuedEmail.id)).limit(limit).all()
+
+    def sent(self):
+        self.date_sent = datetime.now()
+        self.last_error = None
+
+    def failed(self, error, retry_delay):
+        """ Record a failed attempt. The delay before the next attempt doubles each time. """
+        self.attempts += 1
+        self.last_error = unicode(error)
+        self.next_attempt = datetime.now() + timedelta(seconds=retry_delay * 2 ** (self.attempts - 1))
+
+    @staticmethod
+    def remove_sent(before, batch_size):
+        """ Delete the emails sent before the datetime before, batch_size at a time. Returns the number deleted """
+        num_removed = 0
+        while True:
+            ids = [row.id for row in session.query(QueuedEmail.id).filter(QueuedEmail.date_sent < before)
+                   .limit(batch_size)]
+            if not ids:
+                return num_removed
+            session.query(QueuedEmail).filter(QueuedEmail.id.in_(ids)).delete(synchronize_session=False)
+            session.commit()
+            num_removed += len(ids)
+
+
+class WebSession(Base, Model):
+    """ A browser's session, kept here when [sessions] store is database. See utils.sessions.DatabaseSessionStore """
+    __tablename__ = 'web_sessions'
+    __table_args__ = (Index('ix_web_sessions_expires', 'expires'),)
+
+    sid = Column(String(40), primary_key=True)
+    data = Column(Unicode)
+    expires = Column(DateTime)
+
+    def __init__(self, sid, data, expires):
+        self.sid = sid
+        self.data = data
+        self.expires = expires
+
+    @staticmethod
+    def get_live(sid):
+        return session.query(WebSession).filter(WebSession.sid == sid, WebSession.expires > datetime.now()).first()
+
+    @staticmethod
+    def remove_expired(batch_size):
+        """ Delete the expired sessions batch_size at a time, so the table is never locked for long. Returns the
+        number deleted """
+        num_removed = 0
+        while True:
+            sids = [row.sid for row in session.query(WebSession.sid).filter(WebSession.expires <= datetime.now())
+                    .limit(batch_size)]
+            if not sids:
+                return num_removed
+            session.query(WebSession).filter(WebSession.sid.in_(sids)).delete(synchronize_session=False)
+            session.commit()
+            num_removed += len(sids)
+
+
+class NamePool(Base, Model):
+    """ The case or task names imported from a list, one row per line of the file, so that finding the next name is
+    one indexed lookup rather than reading the file again """
+    __tablename__ = 'name_pool'
+    __table_args__ = (Index('ix_name_pool_list_type_position', 'list_type', 'position', unique=True),)
+
+    CASE = "case"
+    TASK = "task"
+
+    id = Column(Integer, primary_key=True)
+    list_type = Column(Unicode)
+    position = Column(Integer)
+    name = Column(Unicode)
+
+    @staticmethod
+    def import_names(list_type, list_location, batch_size=1000):
+        """ Replace the names of list_type with the lines of the file at list_location. Returns the number imported """
+        table = NamePool.__table__
+        session.execute(table.delete().where(table.c.list_type == list_type))
+        rows = []
+        num_names = 0
+        with open(list_location, "r") as names:
+            for position, line in enumerate(names):
+                rows.append(dict(list_type=list_type, position=position,
+                                 name=line.strip().decode('utf-8', 'replace')))
+                if len(rows) >= batch_size:
+                    session.execute(table.insert(), rows)
+                    num_names += len(rows)
+                    rows = []
+        if rows:
+            session.execute(table.insert(), rows)
+            num_names += len(rows)
+        return num_names
+
+    @staticmethod
+    def import_existing():
+        """ Fill the pool from the lists already imported, e.g. once the table has been added to an existing database.
+        Returns the number of names imported """
+        options = ForemanOptions.get_options()
+        num_names = 0
+        if options is not None:
+            for list_type, list_location in [(NamePool.CASE, options.c_list_name),
+                                             (NamePool.TASK, options.t_list_name)]:
+                if list_location is not None and path.exists(list_location):
+                    num_names += NamePool.import_names(list_type, list_location)
+        session.commit()
+        return num_names
+
+    @staticmethod
+    def get_name(list_type, position):
+        if position < 0:
+            return None
+        return session.query(NamePool.name).filter(NamePool.list_type == list_type,
+                                                   NamePool.position == position).scalar()
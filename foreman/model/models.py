@@ -1,15 +1,27 @@
+# python imports
+from bisect import bisect_left
+from datetime import datetime
 # library imports
-from sqlalchemy import asc, desc
+from sqlalchemy import asc, desc, and_, or_
 from sqlalchemy.ext.declarative import declarative_base
 # local imports
-from ..utils.utils import session
+from ..utils.utils import session, config
 
 
 class Model(object):
+    # named lists of query options that eager load the relationships a page uses, see get_with_profile
+    loading_profiles = {}
+
     @classmethod
     def get(cls, cid):
         return session.query(cls).get(cid)
 
+    @classmethod
+    def get_with_profile(cls, cid, profile):
+        """ Like get, but also loads the relationships in the named loading profile, using a fixed number of queries
+        however large the object is """
+        return session.query(cls).options(*cls.loading_profiles[profile]).filter(cls.id == cid).first()
+
     @classmethod
     def get_filter_by(cls, **variables):
         return session.query(cls).filter_by(**variables)
@@ -26,16 +38,167 @@ class Model(object):
         return session.query(cls).count()
 
 
+def default_page_size():
+    if config.has_option('pagination', 'page_size'):
+        return config.getint('pagination', 'page_size')
+    return 50
+
+
+class KeysetPage(object):
+    """ One page of the rows of query, sorted by columns, the last of which should be the id so that the order is
+    unique. Instead of an offset, the rows after (or before) a cursor are fetched, where a cursor is the sort key of
+    the last (or first) row of a page. This keeps every page as quick as the first however far into the list it is.
+    Iterating over the page gives its rows. total is the number of rows in the whole list. A query that joins to a one
+    to many relationship can match a row more than once, so the rows are picked by id, which counts each of them once
+    and keeps repeats from filling the page. """
+
+    _date_format = "%Y%m%d%H%M%S%f"
+
+    def __init__(self, query, columns, after=None, before=None, descending=True, page_size=None, options=(),
+                 name=""):
+        self.columns = columns
+        self.name = name
+        self.page_size = page_size or default_page_size()
+        model = query.column_descriptions[0]['type']
+        query = session.query(model).filter(model.id.in_(query.with_entities(model.id).order_by(None).subquery()))
+        self.total = query.count()
+
+        after = self._parse(after)
+        before = self._parse(before) if after is None else None
+        backwards = before is not None
+        if after is not None:
+            query = query.filter(self._beyond(after, descending))
+        elif backwards:
+            query = query.filter(self._beyond(before, not descending))
+        direction = desc if descending != backwards else asc
+        query = query.options(*options).add_columns(*columns).order_by(None)
+        rows = query.order_by(*[direction(column) for column in columns]).limit(self.page_size + 1).all()
+
+        more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if backwards:
+            rows.reverse()
+        self.items = [row[0] for row in rows]
+        self.has_next = more if not backwards else True
+        self.has_previous = after is not None if not backwards else more
+        self.next_cursor = self._format(rows[-1][1:]) if self.has_next and rows else None
+        self.previous_cursor = self._format(rows[0][1:]) if self.has_previous and rows else None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, index):
+        return self.items[index]
+
+    def _beyond(self, key, descending):
+        """ Rows that come after key in the sort order """
+        conditions = []
+        for i, column in enumerate(self.columns):
+            equal = [self.columns[j] == key[j] for j in xrange(i)]
+            conditions.append(and_(*(equal + [column < key[i] if descending else column > key[i]])))
+        return or_(*conditions)
+
+    def _format(self, key):
+        return "_".join(value.strftime(self._date_format) if isinstance(value, datetime) else str(value)
+                        for value in key)
+
+    def _parse(self, cursor):
+        """ The sort key in cursor, or None if there isn't one or it is not valid """
+        if not cursor:
+            return None
+        values = cursor.split("_")
+        if len(values) != len(self.columns):
+            return None
+        try:
+            return [datetime.strptime(value, self._date_format) if column.type.python_type is datetime
+                    else column.type.python_type(value) for column, value in zip(self.columns, values)]
+        except (ValueError, NotImplementedError):
+            return None
+
+
+def loaded_relationship(instance, name):
+    """ The value of the relationship if it has already been loaded, e.g. by a loading profile, otherwise None """
+    return instance.__dict__.get(name)
+
+
+def _partition_key(entry):
+    return tuple(getattr(entry, column) for column in entry.previous_partition)
+
+
+def get_previous(entry):
+    """ The entry before this one for the same object, or entry.no_previous() if it is the first """
+    cls = type(entry)
+    q = session.query(cls).filter(and_(*[getattr(cls, column) == value for column, value in
+                                         zip(cls.previous_partition, _partition_key(entry))]))
+    previous = q.filter(cls.id < entry.id).order_by(desc(cls.id)).first()
+    return previous if previous is not None else entry.no_previous()
+
+
+def get_previous_entries(cls, entries, chunk_size=500):
+    """ Batched version of get_previous. Loads the history of every object in entries with one query (per chunk
+    of objects) and pairs each entry with its predecessor in memory. Returns a dictionary of entry id to previous """
+    entries = list(entries)
+    if not entries:
+        return {}
+    first_column = getattr(cls, cls.previous_partition[0])
+    keys = set(_partition_key(entry) for entry in entries)
+    values = list(set(key[0] for key in keys))
+    max_id = max(entry.id for entry in entries)
+
+    history = {}
+    filters = [first_column.in_(values[i:i + chunk_size]) for i in xrange(0, len(values), chunk_size)]
+    if None in values:
+        filters.append(first_column == None)
+    for partition_filter in filters:
+        q = session.query(cls).filter(partition_filter).filter(cls.id < max_id)
+        for row in q.order_by(asc(cls.id)):
+            key = _partition_key(row)
+            if key in keys:
+                history.setdefault(key, []).append(row)
+
+    history_ids = dict((key, [row.id for row in rows]) for key, rows in history.iteritems())
+    previous = {}
+    for entry in entries:
+        key = _partition_key(entry)
+        rows = history.get(key, [])
+        position = bisect_left(history_ids.get(key, []), entry.id)
+        previous[entry.id] = rows[position - 1] if position > 0 else entry.no_previous()
+    return previous
+
+
+def get_rows_for_objects(cls, column, object_ids, *order_by):
+    """ Loads the rows of cls that belong to any of object_ids with a single query, e.g. the notes of a set of tasks.
+    Returns a dictionary of object id to its rows, sorted by order_by and then id """
+    results = dict((object_id, []) for object_id in object_ids)
+    if object_ids:
+        q = session.query(cls).filter(getattr(cls, column).in_(object_ids))
+        for row in q.order_by(*(order_by + (asc(cls.id),))):
+            results[getattr(row, column)].append(row)
+    return results
+
+
 class HistoryModel(Model):
     comparable_fields = {}
     history_backref = 'history'
     object_name = None  # override this to add an entry for "<object_name> created"
     history_name = (None, None, None)  # override this for user history of this object
+    previous_partition = ()  # override with the columns that identify the object, e.g. ('case_id',)
+
+    @property
+    def previous(self):
+        return get_previous(self)
+
+    def no_previous(self):
+        return None
 
     @classmethod
-    def get_changes(cls, current_obj):
+    def get_changes(cls, current_obj, history_list=None):
         change_log = []
-        history_list = getattr(current_obj, cls.history_backref)
+        if history_list is None:
+            history_list = getattr(current_obj, cls.history_backref)
 
         for new_obj, old_obj in zip(history_list, history_list[1:]):
             change_log.append({'date': old_obj.date,
@@ -76,9 +239,10 @@ class HistoryModel(Model):
     def get_changes_for_user(cls, user):
         change_log = []
         q = session.query(cls).filter_by(user=user).all()
+        previous_entries = get_previous_entries(cls, q)
         for i in xrange(0, len(q)):
             entry = q[i]
-            previous_entry_list = entry.previous
+            previous_entry_list = previous_entries[entry.id]
             if previous_entry_list is None:
                 change_log.append({'date': entry.date,
                                    'date_time': entry.date_time,
@@ -106,11 +270,20 @@ class HistoryModel(Model):
 
 class UserHistoryModel(Model):
     history_name = (None, None, None)  # override this for user history of this object
+    previous_partition = ()  # override with the columns that identify the object & role, e.g. ('case_id', 'role')
+
+    @property
+    def previous(self):
+        return get_previous(self)
+
+    def no_previous(self):
+        return None
 
     @classmethod
-    def get_changes(cls, current_obj, role):
+    def get_changes(cls, current_obj, role, history_list=None):
         change_log = []
-        history_list = cls.get_roles_for_obj(current_obj, role)
+        if history_list is None:
+            history_list = cls.get_roles_for_obj(current_obj, role)
 
         for new_obj, old_obj in zip(history_list, history_list[1:]):
             change_log.append({'date': old_obj.date,
@@ -136,9 +309,10 @@ class UserHistoryModel(Model):
     def get_changes_for_user(cls, user):
         change_log = []
         q = session.query(cls).filter_by(changes_user=user).all()
+        previous_entries = get_previous_entries(cls, q)
         for i in xrange(0, len(q)):
             entry = q[i]
-            previous_entry_list = entry.previous
+            previous_entry_list = previous_entries[entry.id]
             if previous_entry_list is None:
                 change_log.append({'date': entry.date,
                                    'date_time': entry.date_time,
@@ -1,18 +1,63 @@
-from userModel import UserRoles
-from caseModel import CaseStatus, TaskStatus, EvidenceStatus, ForemanOptions
+# library imports
+from sqlalchemy import and_, or_, not_, exists, true, false
+from sqlalchemy.orm import aliased
+# local imports
+from userModel import UserRoles, UserCaseRoles, UserTaskRoles
+from caseModel import Case, Task, CaseStatus, TaskStatus, EvidenceStatus, ForemanOptions
+
+
+def _case_id_column(model):
+    if model is Case:
+        return Case.id
+    return model.case_id
+
+
+def _case_where(model, criterion):
+    """ criterion is a function taking the Case class (or an alias of it) and returning a SQL expression """
+    if model is Case:
+        return criterion(Case)
+    case = aliased(Case)
+    return exists().where(and_(case.id == model.case_id, criterion(case)))
+
+
+def _case_role(model, roles, user=None):
+    role = aliased(UserCaseRoles)
+    clause = and_(role.case_id == _case_id_column(model), role.role.in_(roles))
+    if user is not None:
+        clause = and_(clause, role.user_id == user.id)
+    return exists().where(clause)
+
+
+def _task_role_on_case(model, roles, user):
+    task = aliased(Task)
+    role = aliased(UserTaskRoles)
+    return exists().where(and_(task.case_id == _case_id_column(model), role.task_id == task.id,
+                               role.user_id == user.id, role.role.in_(roles)))
 
 
 class BaseChecker(object):
     def check(self, user, obj):
         raise NotImplementedError("Must be overridden")
 
+    def filter(self, user, model):
+        """ Return a SQL expression that is true for the rows of model that check() would allow, so listings
+        can be filtered by the database rather than one object at a time. """
+        raise NotImplementedError("No SQL filter for {}".format(self.__class__.__name__))
+
+
+class RoleChecker(BaseChecker):
+    """ Checkers that only depend on the roles of the user, not on the object """
+
+    def filter(self, user, model):
+        return true() if self.check(user, None) else false()
+
 
 class UserIsCurrentUserChecker(BaseChecker):
     def check(self, user, obj):
         return user.id == obj.id
 
 
-class AdminChecker(BaseChecker):
+class AdminChecker(RoleChecker):
     def check(self, user, obj):
         return UserRoles.check_user_has_active_role(user, UserRoles.ADMIN)
 
@@ -30,6 +75,11 @@ class CaseManagerForCaseChecker(BaseChecker):
             return CaseManagerChecker().check(user, case)
         return False
 
+    def filter(self, user, model):
+        roles = [UserCaseRoles.PRINCIPLE_CASE_MANAGER, UserCaseRoles.SECONDARY_CASE_MANAGER]
+        return or_(_case_role(model, roles, user),
+                   and_(not_(_case_role(model, roles)), CaseManagerChecker().filter(user, model)))
+
 
 class PrimaryCaseManagerForCaseChecker(BaseChecker):
     def check(self, user, case):
@@ -37,6 +87,9 @@ class PrimaryCaseManagerForCaseChecker(BaseChecker):
             return user.id == case.principle_case_manager.id
         return False
 
+    def filter(self, user, model):
+        return _case_role(model, [UserCaseRoles.PRINCIPLE_CASE_MANAGER], user)
+
 
 class CaseManagerForTaskChecker(BaseChecker):
     def check(self, user, task):
@@ -46,6 +99,9 @@ class CaseManagerForTaskChecker(BaseChecker):
                 return True
         return False
 
+    def filter(self, user, model):
+        return _case_role(model, [UserCaseRoles.PRINCIPLE_CASE_MANAGER, UserCaseRoles.SECONDARY_CASE_MANAGER], user)
+
 
 class CaseManagerForEvidenceChecker(BaseChecker):
     def check(self, user, evidence):
@@ -58,8 +114,12 @@ class CaseManagerForEvidenceChecker(BaseChecker):
         else:
             return CaseManagerChecker().check(user, "None")
 
+    def filter(self, user, model):
+        return or_(CaseManagerForTaskChecker().filter(user, model),
+                   and_(model.case_id == None, CaseManagerChecker().filter(user, model)))
+
 
-class CaseManagerChecker(BaseChecker):
+class CaseManagerChecker(RoleChecker):
     def check(self, user, obj):
         return UserRoles.check_user_has_active_role(user, UserRoles.CASE_MAN)
 
@@ -102,6 +162,9 @@ class InvestigatorForCaseChecker(BaseChecker):
                 return True
         return False
 
+    def filter(self, user, model):
+        return _task_role_on_case(model, UserTaskRoles.inv_roles, user)
+
 
 class InvestigatorForEvidenceChecker(BaseChecker):
     def check(self, user, evidence):
@@ -114,8 +177,12 @@ class InvestigatorForEvidenceChecker(BaseChecker):
         else:
             return InvestigatorChecker().check(user, "None")
 
+    def filter(self, user, model):
+        return or_(InvestigatorForCaseChecker().filter(user, model),
+                   and_(model.case_id == None, InvestigatorChecker().filter(user, model)))
+
 
-class InvestigatorChecker(BaseChecker):
+class InvestigatorChecker(RoleChecker):
     def check(self, user, obj):
         return UserRoles.check_user_has_active_role(user, UserRoles.INV)
 
@@ -153,6 +220,10 @@ class QAForEvidenceChecker(BaseChecker):
         else:
             return QAChecker().check(user, "None")
 
+    def filter(self, user, model):
+        return or_(QAForCaseChecker().filter(user, model),
+                   and_(model.case_id == None, QAChecker().filter(user, model)))
+
 
 class QAForCaseChecker(BaseChecker):
     def check(self, user, obj):
@@ -168,6 +239,9 @@ class QAForCaseChecker(BaseChecker):
                 return True
         return False
 
+    def filter(self, user, model):
+        return _task_role_on_case(model, UserTaskRoles.qa_roles, user)
+
 
 class AuthoriserForCaseChecker(BaseChecker):
     def check(self, user, case):
@@ -176,27 +250,35 @@ class AuthoriserForCaseChecker(BaseChecker):
             return True
         return False
 
+    def filter(self, user, model):
+        return _case_role(model, [UserCaseRoles.AUTHORISER], user)
+
 
 class AuthoriserForTaskChecker(BaseChecker):
     def check(self, user, task):
         authoriser = task.case.authoriser
-        options = ForemanOptions.get_options()
+        options = ForemanOptions.get_cached_options()
         if options.auth_view_tasks and authoriser and user.id == authoriser.id:
             return True
         return False
 
+    def filter(self, user, model):
+        if not ForemanOptions.get_cached_options().auth_view_tasks:
+            return false()
+        return AuthoriserForCaseChecker().filter(user, model)
 
-class AuthoriserChecker(BaseChecker):
+
+class AuthoriserChecker(RoleChecker):
     def check(self, user, obj):
         return UserRoles.check_user_has_active_role(user, UserRoles.AUTH)
 
 
-class QAChecker(BaseChecker):
+class QAChecker(RoleChecker):
     def check(self, user, obj):
         return UserRoles.check_user_has_active_role(user, UserRoles.QA)
 
 
-class RequesterChecker(BaseChecker):
+class RequesterChecker(RoleChecker):
     def check(self, user, obj):
         return UserRoles.check_user_has_active_role(user, UserRoles.REQUESTER)
 
@@ -207,6 +289,9 @@ class RequesterExistsChecker(BaseChecker):
             return False
         return True
 
+    def filter(self, user, model):
+        return _case_role(model, [UserCaseRoles.REQUESTER])
+
 
 class RequesterForCaseChecker(BaseChecker):
     def check(self, user, case):
@@ -216,6 +301,9 @@ class RequesterForCaseChecker(BaseChecker):
             return False
         return requester_user.id == user.id and requester_role
 
+    def filter(self, user, model):
+        return and_(RequesterChecker().filter(user, model), _case_role(model, [UserCaseRoles.REQUESTER], user))
+
 
 class RequesterForTaskChecker(BaseChecker):
     def check(self, user, task):
@@ -226,6 +314,9 @@ class RequesterForTaskChecker(BaseChecker):
         else:
             return requester_user.id == user.id and requester_role
 
+    def filter(self, user, model):
+        return RequesterForCaseChecker().filter(user, model)
+
 
 class RequesterForEvidenceChecker(BaseChecker):
     def check(self, user, evidence):
@@ -239,17 +330,25 @@ class RequesterForEvidenceChecker(BaseChecker):
         else:
             return False
 
+    def filter(self, user, model):
+        return RequesterForCaseChecker().filter(user, model)
+
 
 class AuthoriserForEvidenceChecker(BaseChecker):
     def check(self, user, evidence):
         if evidence.case_id is not None:
             authoriser = evidence.case.authoriser
-            options = ForemanOptions.get_options()
+            options = ForemanOptions.get_cached_options()
             if options.auth_view_evidence and authoriser and user.id == authoriser.id:
                 return True
             return False
         return False
 
+    def filter(self, user, model):
+        if not ForemanOptions.get_cached_options().auth_view_evidence:
+            return false()
+        return AuthoriserForCaseChecker().filter(user, model)
+
 
 class PrivateEvidenceChecker(BaseChecker):
     def check(self, user, evidence):
@@ -258,16 +357,25 @@ class PrivateEvidenceChecker(BaseChecker):
         else:
             return False
 
+    def filter(self, user, model):
+        return _case_where(model, lambda case: case.private == True)
+
 
 class PrivateCaseChecker(BaseChecker):
     def check(self, user, case):
         return case.private
 
+    def filter(self, user, model):
+        return _case_where(model, lambda case: case.private == True)
+
 
 class PrivateTaskChecker(BaseChecker):
     def check(self, user, task):
         return task.case.private
 
+    def filter(self, user, model):
+        return _case_where(model, lambda case: case.private == True)
+
 
 class ArchivedTaskChecker(BaseChecker):
     def check(self, user, task):
@@ -342,6 +450,9 @@ class CaseApprovedChecker(BaseChecker):
             return True
         return False
 
+    def filter(self, user, model):
+        return _case_where(model, lambda case: case.currentStatus.in_(CaseStatus.approved_statuses))
+
 
 class UserIsManager(BaseChecker):
     def check(self, manager, obj):
@@ -367,6 +478,9 @@ class Not(BaseChecker):
     def check(self, user, obj):
         return not self.checker.check(user, obj)
 
+    def filter(self, user, model):
+        return not_(self.checker.filter(user, model))
+
 
 class Or(BaseChecker):
     checkers = None
@@ -380,6 +494,9 @@ class Or(BaseChecker):
                 return True
         return False
 
+    def filter(self, user, model):
+        return or_(*[checker.filter(user, model) for checker in self.checkers])
+
 
 class And(BaseChecker):
     checkers = None
@@ -393,6 +510,9 @@ class And(BaseChecker):
                 return False
         return True
 
+    def filter(self, user, model):
+        return and_(*[checker.filter(user, model) for checker in self.checkers])
+
 
 permissions = {
     ('Case', 'admin'): AdminChecker(),
@@ -556,3 +676,10 @@ def has_permissions(user, obj, action):
 
     checker = permissions[(obj_class_name, action)]
     return checker.check(user, obj)
+
+
+def permissions_filter(user, model, action):
+    """ SQL version of has_permissions: returns an expression to filter a query of model down to the rows user is
+    allowed to perform action on """
+    checker = permissions[(model.__name__, action)]
+    return checker.filter(user, model)
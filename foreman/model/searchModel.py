@@ -0,0 +1,244 @@
+# python imports
+import re
+# library imports
+from sqlalchemy import event, text
+from sqlalchemy.orm import joinedload, object_session
+# local imports
+from caseModel import Case, Task, TaskNotes, Evidence, TaskUpload, CaseUpload, EvidencePhotoUpload
+from permissions import permissions_filter
+from ..utils.utils import session
+
+
+class Searchable(object):
+    """ How the rows of one model are written to the search index. Every row belongs to a case, task or evidence
+    (its owner), and is only found by users who can view its owner. """
+
+    def __init__(self, model, code, label, owner, owner_id, title, content, indexed=None):
+        self.model = model
+        self.code = code
+        self.label = label
+        self.owner = owner
+        self.owner_id = owner_id
+        self.title = title
+        self.content = content
+        self.indexed = indexed
+
+    def doc_id(self, obj):
+        # unique across all the models, so the index needs no second key
+        return obj.id * 8 + self.code
+
+    def document(self, obj):
+        return {'doc_id': self.doc_id(obj), 'object_type': self.model.__name__, 'object_id': obj.id,
+                'owner_type': self.owner.__name__, 'owner_id': self.owner_id(obj), 'title': self.title(obj) or u"",
+                'content': u"\n".join(field for field in self.content(obj) if field)}
+
+    def is_indexed(self, obj):
+        return self.indexed is None or self.indexed(obj)
+
+
+def _not_deleted(upload):
+    return not upload.deleted
+
+
+searchables = [
+    Searchable(Case, 1, "Case", Case, lambda c: c.id, lambda c: c.case_name,
+               lambda c: [c.reference, c.background, c.justification]),
+    Searchable(Task, 2, "Task", Task, lambda t: t.id, lambda t: t.task_name, lambda t: [t.background]),
+    Searchable(TaskNotes, 3, "Task notes", Task, lambda n: n.task_id, lambda n: None, lambda n: [n.note]),
+    Searchable(Evidence, 4, "Evidence", Evidence, lambda e: e.id, lambda e: e.reference, lambda e: [e.comment]),
+    Searchable(CaseUpload, 5, "Case file", Case, lambda u: u.case_id, lambda u: u.file_title,
+               lambda u: [u.file_note], _not_deleted),
+    Searchable(TaskUpload, 6, "Task file", Task, lambda u: u.task_id, lambda u: u.file_title,
+               lambda u: [u.file_note], _not_deleted),
+    Searchable(EvidencePhotoUpload, 7, "Evidence photo", Evidence, lambda u: u.evidence_id, lambda u: u.file_title,
+               lambda u: [u.file_note], _not_deleted),
+]
+searchable_by_model = dict((searchable.model.__name__, searchable) for searchable in searchables)
+
+
+class SQLiteIndex(object):
+    """ An FTS5 virtual table. The doc_id is the rowid, and the porter tokenizer matches the forms of a word """
+    create = ["CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(title, content, object_type UNINDEXED, "
+              "object_id UNINDEXED, owner_type UNINDEXED, owner_id UNINDEXED, tokenize='porter unicode61')"]
+    drop = "DROP TABLE IF EXISTS search_index"
+    insert = text("INSERT INTO search_index (rowid, title, content, object_type, object_id, owner_type, owner_id) "
+                  "VALUES (:doc_id, :title, :content, :object_type, :object_id, :owner_type, :owner_id)")
+    delete = text("DELETE FROM search_index WHERE rowid = :doc_id")
+    # matches in the title count for more than matches in the rest of the text
+    search = text("SELECT object_type, object_id, owner_type, owner_id, title, content FROM search_index "
+                  "WHERE search_index MATCH :query ORDER BY bm25(search_index, 4.0, 1.0) LIMIT :limit OFFSET :offset")
+
+    @staticmethod
+    def query(terms):
+        # each word is quoted so that nothing typed in is read as FTS5 query syntax
+        return u" ".join(u'"{}"'.format(term) for term in terms)
+
+
+class PostgresIndex(object):
+    """ A table with a tsvector of each row's text, and a GIN index over it """
+    create = ["CREATE TABLE IF NOT EXISTS search_index (doc_id BIGINT PRIMARY KEY, object_type VARCHAR(30), "
+              "object_id INTEGER, owner_type VARCHAR(30), owner_id INTEGER, title TEXT, content TEXT, "
+              "document TSVECTOR)",
+              "CREATE INDEX IF NOT EXISTS ix_search_index_document ON search_index USING GIN (document)"]
+    drop = "DROP TABLE IF EXISTS search_index"
+    insert = text("INSERT INTO search_index (doc_id, title, content, object_type, object_id, owner_type, owner_id, "
+                  "document) VALUES (:doc_id, :title, :content, :object_type, :object_id, :owner_type, :owner_id, "
+                  "setweight(to_tsvector('english', :title), 'A') || to_tsvector('english', :content))")
+    delete = text("DELETE FROM search_index WHERE doc_id = :doc_id")
+    search = text("SELECT object_type, object_id, owner_type, owner_id, title, content "
+                  "FROM search_index, plainto_tsquery('english', :query) AS query WHERE document @@ query "
+                  "ORDER BY ts_rank(document, query) DESC, doc_id LIMIT :limit OFFSET :offset")
+
+    @staticmethod
+    def query(terms):
+        return u" ".join(terms)
+
+
+def _backend(bind):
+    return PostgresIndex if bind.dialect.name == "postgresql" else SQLiteIndex
+
+
+class SearchResult(object):
+    def __init__(self, searchable, object_id, owner, title, content, terms):
+        self.object_type = searchable.model.__name__
+        self.label = searchable.label
+        self.object_id = object_id
+        self.owner = owner
+        self.title = title
+        self.snippet = _snippet(content, terms)
+
+
+class SearchResults(object):
+    def __init__(self, query, results, offset, next_offset):
+        self.query = query
+        self.results = results
+        self.offset = offset
+        self.next_offset = next_offset
+
+    def __iter__(self):
+        return iter(self.results)
+
+    def __len__(self):
+        return len(self.results)
+
+
+def _snippet(content, terms, length=200):
+    """ The part of content around the first of the search terms in it """
+    if len(content) <= length:
+        return content
+    lowered = content.lower()
+    found = [position for position in (lowered.find(term.lower()) for term in terms) if position != -1]
+    start = max(min(found) - length // 4, 0) if found else 0
+    snippet = content[start:start + length]
+    return (u"..." if start > 0 else u"") + snippet + (u"..." if start + length < len(content) else u"")
+
+
+class SearchIndex(object):
+    """ A full text index over the text of the cases, tasks, task notes, evidence and uploads. It is kept up to date
+    as rows are saved, so only needs building in full for an existing database, using the rebuild_search_index
+    command. Search results are filtered to those the user has permission to view. """
+
+    owner_options = {'Case': [], 'Task': [joinedload('case')], 'Evidence': [joinedload('case')]}
+
+    @staticmethod
+    def create(bind):
+        for statement in _backend(bind).create:
+            bind.execute(statement)
+
+    @staticmethod
+    def drop(bind):
+        bind.execute(_backend(bind).drop)
+
+    @staticmethod
+    def terms(query):
+        return re.findall(r"\w+", query or u"", re.UNICODE)
+
+    @staticmethod
+    def rebuild(batch_size=1000):
+        """ Empty the index and add every searchable row again. Returns the number of rows indexed """
+        connection = session.connection()
+        backend = _backend(connection)
+        connection.execute(backend.drop)
+        SearchIndex.create(connection)
+        num_indexed = 0
+        for searchable in searchables:
+            documents = []
+            for obj in session.query(searchable.model).order_by(searchable.model.id).yield_per(batch_size):
+                if searchable.is_indexed(obj):
+                    documents.append(searchable.document(obj))
+                if len(documents) >= batch_size:
+                    connection.execute(backend.insert, documents)
+                    num_indexed += len(documents)
+                    documents = []
+            if documents:
+                connection.execute(backend.insert, documents)
+                num_indexed += len(documents)
+        session.commit()
+        return num_indexed
+
+    @staticmethod
+    def search(user, query, offset=0, limit=20, max_batches=10):
+        """ The best matches for query that user can view, starting offset matches into the ranked list of all of
+        them. Matches are checked a batch at a time, and at most max_batches are read, so a search that only finds
+        rows the user cannot see still returns quickly """
+        terms = SearchIndex.terms(query)
+        if not terms:
+            return SearchResults(query, [], offset, None)
+        backend = _backend(session.get_bind())
+        batch_size = limit * 2
+        results = []
+        position = offset
+        for _ in xrange(max_batches):
+            rows = session.execute(backend.search, {'query': backend.query(terms), 'limit': batch_size,
+                                                    'offset': position}).fetchall()
+            owners = SearchIndex._viewable_owners(user, rows)
+            for row in rows:
+                if len(results) == limit:
+                    return SearchResults(query, results, offset, position)
+                position += 1
+                owner = owners.get((row.owner_type, row.owner_id))
+                if owner is not None:
+                    results.append(SearchResult(searchable_by_model[row.object_type], row.object_id, owner,
+                                                row.title, row.content, terms))
+            if len(rows) < batch_size:
+                return SearchResults(query, results, offset, None)
+        return SearchResults(query, results, offset, position)
+
+    @staticmethod
+    def _viewable_owners(user, rows):
+        """ The cases, tasks and evidence the rows belong to that user can view, by (type, id) """
+        owner_ids = {}
+        for row in rows:
+            owner_ids.setdefault(row.owner_type, set()).add(row.owner_id)
+        owners = {}
+        for model in (Case, Task, Evidence):
+            ids = owner_ids.get(model.__name__)
+            if ids:
+                query = session.query(model).options(*SearchIndex.owner_options[model.__name__])
+                for owner in query.filter(model.id.in_(ids), permissions_filter(user, model, "view")):
+                    owners[(model.__name__, owner.id)] = owner
+        return owners
+
+
+def _add_row(mapper, connection, target):
+    searchable = searchable_by_model[mapper.class_.__name__]
+    if searchable.is_indexed(target):
+        connection.execute(_backend(connection).insert, searchable.document(target))
+
+
+def _update_row(mapper, connection, target):
+    if not object_session(target).is_modified(target, include_collections=False):
+        return
+    _unindex_row(mapper, connection, target)
+    _add_row(mapper, connection, target)
+
+
+def _unindex_row(mapper, connection, target):
+    searchable = searchable_by_model[mapper.class_.__name__]
+    connection.execute(_backend(connection).delete, doc_id=searchable.doc_id(target))
+
+
+for _searchable in searchables:
+    event.listen(_searchable.model, 'after_insert', _add_row)
+    event.listen(_searchable.model, 'after_update', _update_row)
+    event.listen(_searchable.model, 'after_delete', _unindex_row)
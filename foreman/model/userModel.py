@@ -1,16 +1,17 @@
 # python imports
-from datetime import datetime
+from datetime import datetime, timedelta
 import random
 import string
 from os import path
 # library imports
 from sqlalchemy import Column, Integer, Boolean, Float, Unicode, ForeignKey, DateTime, \
-    asc, desc, func, and_, Date
+    Index, asc, desc, func, and_, Date, event, text, bindparam, select
 from sqlalchemy.orm import backref, relation
 import bcrypt
 # local imports
-from models import Base, Model, UserHistoryModel, HistoryModel
+from models import Base, Model, UserHistoryModel, HistoryModel, KeysetPage
 from ..utils.utils import session, ROOT_DIR
+from ..utils.cache import request_cache
 from generalModel import ForemanOptions
 
 
@@ -99,6 +100,7 @@ class UserHistory(Base, HistoryModel):
                          'Team': 'team', 'Department': 'department', "Manager": 'manager'}
 
     history_name = ("User", "username", "original_user_id")
+    previous_partition = ('original_user_id',)
     object_name = "User"
 
     def __init__(self, original_user, user_who_made_changes):
@@ -126,13 +128,6 @@ class UserHistory(Base, HistoryModel):
         else:
             self.manager = None
 
-    @property
-    def previous(self):
-        q = session.query(UserHistory)
-        q = q.filter_by(original_user_id=self.original_user_id).filter(UserHistory.id < self.id).order_by(
-            desc(UserHistory.id))
-        return q.first()
-
     @property
     def date(self):
         return ForemanOptions.get_date(self.date_time)
@@ -209,6 +204,22 @@ class User(Base, Model):
         else:
             return r1 + r2
 
+    @staticmethod
+    def get_hours_worked_by_users(users, start, end):
+        """ The grouped form of get_hours_worked for every user and every day from start up to end.
+        Returns {(user_id, date): hours}; days without any timesheet entries are missing. """
+        user_ids = [user.id for user in users]
+        if not user_ids:
+            return {}
+        results = {}
+        for timesheet in (CaseTimeSheets, TaskTimeSheets):
+            q = session.query(timesheet.user_id, timesheet.date, func.sum(timesheet.hours))
+            q = q.filter(timesheet.user_id.in_(user_ids), timesheet.date >= start, timesheet.date < end)
+            for user_id, day, hours in q.group_by(timesheet.user_id, timesheet.date):
+                if hours is not None:
+                    results[(user_id, day)] = results.get((user_id, day), 0) + hours
+        return results
+
     def is_manager_of(self, user):
         man = user.manager
         if man is None:
@@ -217,23 +228,21 @@ class User(Base, Model):
         if man.id == self.id:
             return True
 
-        if not ForemanOptions.get_options().manager_inherit:
+        if not ForemanOptions.get_cached_options().manager_inherit:
             return False
         else:
-            return self.is_manager_of(man)
+            return UserHierarchy.is_ancestor(self.id, man.id)
 
     def is_a_manager(self):
         return len(self.direct_reports) > 0
 
     def all_reports(self, override=False):
-        if not ForemanOptions.get_options().manager_inherit and not override:
+        """ The users who report to this user. Only the direct reports unless managers inherit reports or override
+        is set, in which case everyone below this user, nearest first """
+        if not ForemanOptions.get_cached_options().manager_inherit and not override:
             return self.direct_reports
         else:
-            reports = []
-            for direct_report in self.direct_reports:
-                reports.append(direct_report)
-                reports.extend(direct_report.all_reports())
-            return reports
+            return UserHierarchy.get_descendants(self.id)
 
     def _manager_loop_checker(self):
         return self.all_reports(True)
@@ -284,6 +293,11 @@ class User(Base, Model):
             return True
         return False
 
+    @staticmethod
+    def get_user_page(page):
+        """ A page of all the users, in the order they were added """
+        return KeysetPage(session.query(User), [User.id], descending=False, **page)
+
     @staticmethod
     def get_user_with_role(role, case_id=None, task_id=None):
         if task_id is not None:
@@ -320,6 +334,89 @@ class User(Base, Model):
         return session.query(User).filter_by(validated=False).count()
 
 
+class UserHierarchy(Base, Model):
+    """ Every pair of a user and someone above them in the management chain, with the number of levels between them,
+    so the whole chain or everyone below a manager is one indexed lookup. Kept up to date whenever a user's manager
+    changes, see _user_manager_changed """
+    __tablename__ = 'user_hierarchy'
+    __table_args__ = (Index('ix_user_hierarchy_descendant_id', 'descendant_id', 'depth'),)
+
+    ancestor_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    descendant_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    depth = Column(Integer)
+
+    @staticmethod
+    def is_ancestor(ancestor_id, descendant_id):
+        q = session.query(UserHierarchy.depth).filter(UserHierarchy.ancestor_id == ancestor_id,
+                                                      UserHierarchy.descendant_id == descendant_id)
+        return q.first() is not None
+
+    @staticmethod
+    def get_descendants(ancestor_id):
+        q = session.query(User).join(UserHierarchy, UserHierarchy.descendant_id == User.id)
+        return q.filter(UserHierarchy.ancestor_id == ancestor_id).order_by(UserHierarchy.depth, User.id).all()
+
+    @staticmethod
+    def _rows(connection, column, user_id):
+        """ {user id: depth} of the ancestors (column is descendant_id) or descendants (ancestor_id) of user_id """
+        table = UserHierarchy.__table__
+        other = table.c.ancestor_id if column == 'descendant_id' else table.c.descendant_id
+        rows = connection.execute(select([other, table.c.depth]).where(table.c[column] == user_id))
+        return dict((row_user_id, depth) for row_user_id, depth in rows)
+
+    @staticmethod
+    def move(connection, user_id, manager_id):
+        """ Move user_id, and everyone below them, to report to manager_id instead of their old manager """
+        table = UserHierarchy.__table__
+        old_ancestors = UserHierarchy._rows(connection, 'descendant_id', user_id)
+        subtree = UserHierarchy._rows(connection, 'ancestor_id', user_id)
+        subtree[user_id] = 0
+        if old_ancestors:
+            connection.execute(table.delete().where(and_(table.c.ancestor_id.in_(old_ancestors.keys()),
+                                                         table.c.descendant_id.in_(subtree.keys()))))
+        if manager_id is None or manager_id in subtree:
+            # a loop is turned away by the ManagerCheck validator, so never link a user below themselves
+            return
+        new_ancestors = UserHierarchy._rows(connection, 'descendant_id', manager_id)
+        new_ancestors[manager_id] = 0
+        connection.execute(table.insert(), [dict(ancestor_id=ancestor_id, descendant_id=descendant_id,
+                                                 depth=ancestor_depth + descendant_depth + 1)
+                                            for ancestor_id, ancestor_depth in new_ancestors.iteritems()
+                                            for descendant_id, descendant_depth in subtree.iteritems()])
+
+    @staticmethod
+    def manager_of(connection, user_id):
+        table = UserHierarchy.__table__
+        return connection.execute(select([table.c.ancestor_id]).where(and_(table.c.descendant_id == user_id,
+                                                                           table.c.depth == 1))).scalar()
+
+    @staticmethod
+    def rebuild(batch_size=1000):
+        """ Build the table again from each user's manager, e.g. once it has been added to an existing database.
+        Returns the number of rows added """
+        managers = dict(session.query(User.id, User.manager_id))
+        session.query(UserHierarchy).delete(synchronize_session=False)
+        rows = []
+        num_rows = 0
+        for user_id in managers:
+            ancestor_id = managers[user_id]
+            depth = 1
+            # stops at a loop, should one have been saved before the table existed
+            while ancestor_id is not None and ancestor_id != user_id and depth <= len(managers):
+                rows.append(dict(ancestor_id=ancestor_id, descendant_id=user_id, depth=depth))
+                ancestor_id = managers.get(ancestor_id)
+                depth += 1
+            if len(rows) >= batch_size:
+                session.execute(UserHierarchy.__table__.insert(), rows)
+                num_rows += len(rows)
+                rows = []
+        if rows:
+            session.execute(UserHierarchy.__table__.insert(), rows)
+            num_rows += len(rows)
+        session.commit()
+        return num_rows
+
+
 class UserTaskRolesHistory(Base, UserHistoryModel):
     __tablename__ = 'user_task_roles_history'
 
@@ -337,6 +434,7 @@ class UserTaskRolesHistory(Base, UserHistoryModel):
                             foreign_keys=user_change_id)
     task = relation('Task', backref=backref('task_roles_history', order_by=desc(id)))
     history_name = ("Task", "task", "task_id", "case_id")
+    previous_partition = ('task_id', 'role')
 
     def __init__(self, user_task_role, user_change, removed=False):
         self.user = user_task_role.user
@@ -356,16 +454,11 @@ class UserTaskRolesHistory(Base, UserHistoryModel):
     def date(self):
         return ForemanOptions.get_date(self.date_time)
 
-    @property
-    def previous(self):
-        q = session.query(UserTaskRolesHistory)
-        q = q.filter_by(task_id=self.task_id, role=self.role).filter(UserTaskRolesHistory.id < self.id).order_by(
-            desc(UserTaskRolesHistory.id))
-        return q.first()
-
 
 class UserTaskRoles(Base, Model):
     __tablename__ = 'user_task_roles'
+    __table_args__ = (Index('ix_user_task_roles_task_id', 'task_id', 'role', 'user_id'),
+                      Index('ix_user_task_roles_user_id', 'user_id', 'role'))
 
     PRINCIPLE_INVESTIGATOR = 'Principle Investigator'
     SECONDARY_INVESTIGATOR = 'Secondary Investigator'
@@ -422,6 +515,7 @@ class UserCaseRolesHistory(Base, UserHistoryModel):
                             foreign_keys=user_change_id)
     case = relation('Case', backref=backref('case_roles_history', order_by=desc(id)))
     history_name = ("Case", "case", "case_id")
+    previous_partition = ('case_id', 'role')
 
     def __init__(self, user_case_role, user_change, removed=False):
         self.user = user_case_role.user
@@ -440,19 +534,14 @@ class UserCaseRolesHistory(Base, UserHistoryModel):
     def date(self):
         return ForemanOptions.get_date(self.date_time)
 
-    @property
-    def previous(self):
-        q = session.query(UserCaseRolesHistory)
-        q = q.filter_by(case_id=self.case_id, role=self.role).filter(UserCaseRolesHistory.id < self.id).order_by(
-            desc(UserCaseRolesHistory.id))
-        return q.first()
-
     def __repr__(self):
         return "<CaseRoleHist Object[{}] '{}'>".format(self.role, self.user.fullname)
 
 
 class UserCaseRoles(Base, Model):
     __tablename__ = 'user_case_roles'
+    __table_args__ = (Index('ix_user_case_roles_case_id', 'case_id', 'role', 'user_id'),
+                      Index('ix_user_case_roles_user_id', 'user_id', 'role'))
 
     PRINCIPLE_CASE_MANAGER = 'Principle Case Manager'
     SECONDARY_CASE_MANAGER = 'Secondary Case Manager'
@@ -499,6 +588,7 @@ class UserRolesHistory(Base, UserHistoryModel):
     changes_user = relation('User', backref=backref('user_roles_history_changes'), foreign_keys=changes_user_id)
 
     history_name = ("Role", "role", "user_id")
+    previous_partition = ('user_id', 'role')
 
     def __init__(self, user_role, user_who_made_changes):
         self.user_id = user_role.user_id
@@ -507,15 +597,8 @@ class UserRolesHistory(Base, UserHistoryModel):
         self.date_time = datetime.now()
         self.changes_user = user_who_made_changes
 
-    @property
-    def previous(self):
-        q = session.query(UserRolesHistory)
-        q = q.filter_by(user_id=self.user_id, role=self.role).filter(UserRolesHistory.id < self.id).order_by(
-            desc(UserRolesHistory.id))
-        q1 = q.count()
-        if q1 == 0:
-            return False
-        return q.first()
+    def no_previous(self):
+        return False
 
     @property
     def date(self):
@@ -538,6 +621,7 @@ class UserRolesHistory(Base, UserHistoryModel):
 
 class UserRoles(Base, Model):
     __tablename__ = 'user_roles'
+    __table_args__ = (Index('ix_user_roles_user_id', 'user_id', 'role'),)
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'))
@@ -569,20 +653,38 @@ class UserRoles(Base, Model):
         session.flush()
 
     @staticmethod
-    def check_user_has_active_role(user, role):
-        q = session.query(UserRoles).filter_by(user=user, role=role).first()
-        if q is None:
-            return False
-        elif q.removed is False:
-            return True
+    def get_active_roles(user):
+        """ The set of roles the user currently has. Loaded with one query per user per request and shared by
+        all the role checks """
+        if user is None or user.id is None:
+            return set()
+        cache = request_cache('user_roles')
+        if user.id not in cache:
+            active = {}
+            q = session.query(UserRoles.role, UserRoles.removed).filter_by(user_id=user.id).order_by(UserRoles.id)
+            for role, removed in q:
+                active.setdefault(role, removed is False)
+            cache[user.id] = set(role for role, is_active in active.iteritems() if is_active)
+        return cache[user.id]
+
+    @staticmethod
+    def clear_active_roles(user_id=None):
+        cache = request_cache('user_roles')
+        if user_id is None:
+            cache.clear()
         else:
-            return False
+            cache.pop(user_id, None)
+
+    @staticmethod
+    def check_user_has_active_role(user, role):
+        return role in UserRoles.get_active_roles(user)
 
     @staticmethod
     def edit_user_role(user, role, change_user):
         q = session.query(UserRoles).filter_by(user=user, role=role).first()
         q.removed = not q.removed
         session.flush()
+        UserRoles.clear_active_roles(user.id)
         q.add_change(change_user)
 
     @staticmethod
@@ -637,8 +739,61 @@ class UserRoles(Base, Model):
         return "<Role Object[{}] '{}' ({})>".format(self.role, self.user.fullname, self.removed)
 
 
+@event.listens_for(UserRoles, 'after_insert')
+@event.listens_for(UserRoles, 'after_update')
+@event.listens_for(UserRoles, 'after_delete')
+def _user_roles_changed(mapper, connection, target):
+    UserRoles.clear_active_roles(target.user_id)
+
+
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_update')
+def _user_manager_changed(mapper, connection, target):
+    if target.manager_id != UserHierarchy.manager_of(connection, target.id):
+        UserHierarchy.move(connection, target.id, target.manager_id)
+
+
+@event.listens_for(User, 'before_delete')
+def _user_deleted(mapper, connection, target):
+    table = UserHierarchy.__table__
+    connection.execute(table.delete().where((table.c.ancestor_id == target.id) | (table.c.descendant_id == target.id)))
+
+
+def _timesheet_week(model, owner_id, user, start_day):
+    """ The hours user entered in the week starting on start_day, as {"ddmmyyyy": {case or task id: hours}} """
+    rows = session.query(owner_id, model.date, model.hours).filter(
+        model.user_id == user.id, model.date >= start_day, model.date < start_day + timedelta(days=7))
+    week = {}
+    for row_owner_id, day, hours in rows:
+        week.setdefault(day.strftime("%d%m%Y"), {})[row_owner_id] = hours
+    return week
+
+
+def _save_timesheet_week(model, owner_column, user, entries):
+    """ Save the (case or task id, date, hours) entries for user with one statement to add or replace the hours
+    given, relying on the unique index over user, case or task and date, and one to remove the cells left empty """
+    table = model.__tablename__
+    if session.get_bind().dialect.name == "postgresql":
+        upsert = ("INSERT INTO {0} (user_id, {1}, date, hours) VALUES (:user_id, :owner_id, :date, :hours) "
+                  "ON CONFLICT (user_id, {1}, date) DO UPDATE SET hours = EXCLUDED.hours")
+    else:
+        upsert = ("INSERT OR REPLACE INTO {0} (user_id, {1}, date, hours) "
+                  "VALUES (:user_id, :owner_id, :date, :hours)")
+    delete = "DELETE FROM {0} WHERE user_id = :user_id AND {1} = :owner_id AND date = :date"
+
+    filled = [dict(user_id=user.id, owner_id=owner_id, date=day, hours=hours)
+              for owner_id, day, hours in entries if hours is not None]
+    empty = [dict(user_id=user.id, owner_id=owner_id, date=day)
+             for owner_id, day, hours in entries if hours is None]
+    if filled:
+        session.execute(text(upsert.format(table, owner_column)).bindparams(bindparam('date', type_=Date)), filled)
+    if empty:
+        session.execute(text(delete.format(table, owner_column)).bindparams(bindparam('date', type_=Date)), empty)
+
+
 class TaskTimeSheets(Base, Model):
     __tablename__ = 'task_timesheets'
+    __table_args__ = (Index('ix_task_timesheets_user_task_date', 'user_id', 'task_id', 'date', unique=True),)
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'))
@@ -655,9 +810,18 @@ class TaskTimeSheets(Base, Model):
         self.date = date
         self.hours = hours
 
+    @staticmethod
+    def get_week(user, start_day):
+        return _timesheet_week(TaskTimeSheets, TaskTimeSheets.task_id, user, start_day)
+
+    @staticmethod
+    def save_week(user, entries):
+        _save_timesheet_week(TaskTimeSheets, 'task_id', user, entries)
+
 
 class CaseTimeSheets(Base, Model):
     __tablename__ = 'case_timesheets'
+    __table_args__ = (Index('ix_case_timesheets_user_case_date', 'user_id', 'case_id', 'date', unique=True),)
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'))
@@ -673,4 +837,12 @@ class CaseTimeSheets(Base, Model):
         self.user = user
         self.case = case
         self.date = date
-        self.hours = hours
\ No newline at end of file
+        self.hours = hours
+
+    @staticmethod
+    def get_week(user, start_day):
+        return _timesheet_week(CaseTimeSheets, CaseTimeSheets.case_id, user, start_day)
+
+    @staticmethod
+    def save_week(user, entries):
+        _save_timesheet_week(CaseTimeSheets, 'case_id', user, entries)
\ No newline at end of file
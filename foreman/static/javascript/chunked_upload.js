@@ -0,0 +1,105 @@
+/*
+ Sends files larger than the form's data-chunk-threshold in chunks, so that a very large file is not sent in one
+ request and an upload that is interrupted carries on from where it stopped, even after the page is reloaded.
+ Smaller files, and browsers without the File API, use the normal form post.
+ */
+(function ($) {
+    var MAX_RETRIES = 5;
+
+    function storageKey(form, file) {
+        return "foreman_upload_" + form.data("start-url") + "_" + file.name + "_" + file.size;
+    }
+
+    function showProgress(form, received, size) {
+        form.find(".upload_progress").text("Uploaded " + Math.floor(received * 100 / size) + "%");
+    }
+
+    function showError(form, message) {
+        form.find(".upload_progress").text(message);
+        form.find("input[type=submit]").prop("disabled", false);
+    }
+
+    function sendChunks(form, file, upload, received, retries) {
+        if (received >= file.size) {
+            complete(form, file, upload);
+            return;
+        }
+        var chunk = file.slice(received, received + upload.chunk_size);
+        $.ajax({url: upload.url + "?offset=" + received, type: "POST", data: chunk, processData: false,
+                contentType: "application/octet-stream", dataType: "json"})
+            .done(function (status) {
+                showProgress(form, status.received, file.size);
+                sendChunks(form, file, upload, status.received, 0);
+            })
+            .fail(function (xhr) {
+                if (retries >= MAX_RETRIES) {
+                    showError(form, "The upload was interrupted. Submit the form again to carry on.");
+                    return;
+                }
+                // find out how much arrived before trying again
+                setTimeout(function () {
+                    $.getJSON(upload.url).done(function (status) {
+                        sendChunks(form, file, upload, status.received, retries + 1);
+                    }).fail(function () {
+                        sendChunks(form, file, upload, received, retries + 1);
+                    });
+                }, 1000 * (retries + 1));
+            });
+    }
+
+    function complete(form, file, upload) {
+        $.ajax({url: upload.url + "complete/", type: "POST", dataType: "json",
+                data: {file_title: form.find("[name=file_title]").val(), comments: form.find("[name=comments]").val()}})
+            .done(function (result) {
+                localStorage.removeItem(storageKey(form, file));
+                window.location = result.url;
+            })
+            .fail(function (xhr) {
+                showError(form, "The file was uploaded, but could not be saved. Check the title and comments.");
+            });
+    }
+
+    function start(form, file) {
+        $.ajax({url: form.data("start-url"), type: "POST", dataType: "json",
+                data: {file_name: file.name, file_size: file.size}})
+            .done(function (upload) {
+                localStorage.setItem(storageKey(form, file), JSON.stringify(upload));
+                sendChunks(form, file, upload, 0, 0);
+            })
+            .fail(function () {
+                showError(form, "The upload could not be started.");
+            });
+    }
+
+    function resumeOrStart(form, file) {
+        var saved = localStorage.getItem(storageKey(form, file));
+        if (!saved) {
+            start(form, file);
+            return;
+        }
+        var upload = JSON.parse(saved);
+        $.getJSON(upload.url).done(function (status) {
+            showProgress(form, status.received, file.size);
+            sendChunks(form, file, upload, status.received, 0);
+        }).fail(function () {
+            localStorage.removeItem(storageKey(form, file));
+            start(form, file);
+        });
+    }
+
+    $(function () {
+        $("form.chunked_upload").submit(function (event) {
+            var form = $(this);
+            var input = form.find("input[type=file]")[0];
+            if (!window.FileReader || !window.localStorage || !input.files || !input.files.length ||
+                    input.files[0].size <= form.data("chunk-threshold") || !form.find("[name=file_title]").val() ||
+                    !form.find("[name=comments]").val()) {
+                return true;
+            }
+            event.preventDefault();
+            form.find("input[type=submit]").prop("disabled", true);
+            resumeOrStart(form, input.files[0]);
+            return false;
+        });
+    });
+})(jQuery);
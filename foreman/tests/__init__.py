@@ -19,6 +19,15 @@ test_units = [
     'unit_tests.test_evidence_helper_models',
     'unit_tests.test_user_helper_models',
     'unit_tests.test_role_helper_models',
+    'unit_tests.test_cache',
+    'unit_tests.test_mail',
+    'unit_tests.test_profiling',
+    'unit_tests.test_search',
+    'unit_tests.test_integrity',
+    'unit_tests.test_file_store',
+    'unit_tests.test_file_serving',
+    'unit_tests.test_sessions',
+    'unit_tests.test_templates',
 ]
 
 test_functions = [
@@ -1,6 +1,7 @@
 # python imports
 import unittest
 from mock import MagicMock
+from sqlalchemy import event
 
 
 class UnitTestCase(unittest.TestCase):
@@ -14,4 +15,23 @@ class UnitTestCase(unittest.TestCase):
 
     def mock_storage(self, filename, *args, **kwargs):
         spec = ['__iter__', 'filename'] + [arg for arg in args]
-        return MagicMock(spec=spec, filename=filename, **kwargs)
\ No newline at end of file
+        return MagicMock(spec=spec, filename=filename, **kwargs)
+
+
+class QueryCounter(object):
+    """ Counts the statements run on engine inside the with block, e.g. to check that a loading profile loaded
+    everything a page uses """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self.increment)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        event.remove(self.engine, 'before_cursor_execute', self.increment)
+
+    def increment(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
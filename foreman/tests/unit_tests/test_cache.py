@@ -0,0 +1,34 @@
+# local imports
+import base_tester
+from foreman.utils.cache import TimedCache, sidebar_cache
+
+
+class TimedCacheTestCase(base_tester.UnitTestCase):
+    def setUp(self):
+        self.calls = []
+        self.cache = TimedCache('not_a_section', 'not_an_option', default_ttl=30)
+
+    def create(self):
+        self.calls.append(1)
+        return len(self.calls)
+
+    def test_value_is_cached(self):
+        self.assertEqual(self.cache.get(1, self.create), 1)
+        self.assertEqual(self.cache.get(1, self.create), 1)
+        self.assertEqual(self.cache.get(2, self.create), 2)
+        self.assertEqual(len(self.calls), 2)
+
+    def test_invalidate(self):
+        self.cache.get(1, self.create)
+        self.cache.get(2, self.create)
+        self.cache.invalidate(1)
+        self.assertEqual(self.cache.get(1, self.create), 3)
+        self.assertEqual(self.cache.get(2, self.create), 2)
+        self.cache.invalidate()
+        self.assertEqual(self.cache.get(2, self.create), 4)
+
+    def test_zero_ttl_disables_cache(self):
+        # the test config turns the sidebar cache off
+        self.assertEqual(sidebar_cache.ttl, 0)
+        self.assertEqual(sidebar_cache.get(1, self.create), 1)
+        self.assertEqual(sidebar_cache.get(1, self.create), 2)
@@ -6,6 +6,7 @@ from werkzeug.exceptions import InternalServerError
 import base_tester
 from foreman.model import CaseAuthorisation, Case, User, ForemanOptions, LinkedCase, CaseStatus, CaseHistory, \
     CaseClassification, CaseType, CasePriority, CaseUpload
+from foreman.model.models import get_previous_entries
 from foreman.utils.utils import session, ROOT_DIR
 
 
@@ -288,6 +289,11 @@ class CaseStatusTestCase(ModelTestCaseBase):
         result = self.new_status.previous  # the 1st status is automatically added on a new case, go back one more
         self.assertFalse(result.previous)
 
+        statuses = CaseStatus.get_filter_by(case_id=self.case1.id).all()
+        previous = get_previous_entries(CaseStatus, statuses)
+        self.assertEqual(previous[self.new_status_1.id], self.new_status)
+        self.assertFalse(previous[statuses[0].id])
+
 
 class CaseHistoryTestCase(ModelTestCaseBase):
     def setUp(self):
@@ -317,6 +323,10 @@ class CaseHistoryTestCase(ModelTestCaseBase):
         result = case_hist[0].previous
         self.assertIsNone(result)
 
+        previous = get_previous_entries(CaseHistory, case_hist)
+        self.assertEqual(previous[case_hist[1].id], case_hist[0])
+        self.assertIsNone(previous[case_hist[0].id])
+
         # check changes stored
         self.assertEqual(case_hist[1].case_name, new_name)
         self.assertEqual(case_hist[0].case_name, "name 1")
@@ -189,6 +189,50 @@ class CaseReadTestCase(ModelTestCaseBase):
         for case in Case.get_all():
             self.assertIsNotNone(case.authoriser)
 
+    def test_view_profile_test_case(self):
+        properties = ['principle_case_manager', 'secondary_case_manager', 'case_managers', 'requester', 'authoriser',
+                      'status']
+        for case_id in [1, 3, 10]:
+            case = Case.get(case_id)
+            expected = [getattr(case, attribute) for attribute in properties]
+            expected_tasks = [(task.principle_investigator, task.QAs, task.status) for task in case.tasks]
+            session.expire_all()
+
+            case = Case.get_with_profile(case_id, 'view')
+            with base_tester.QueryCounter(session.get_bind()) as counter:
+                self.assertEqual([getattr(case, attribute) for attribute in properties], expected)
+                self.assertEqual([(task.principle_investigator, task.QAs, task.status) for task in case.tasks],
+                                 expected_tasks)
+                self.assertEqual(case.get_status(), case.statuses[-1])
+            self.assertEqual(counter.count, 0)
+
+    def test_case_pages_test_case(self):
+        perms = BaseController.check_permissions
+        all_cases = Case.get_cases("All", self.current_user, case_perm_checker=perms)
+        all_cases = sorted(all_cases, key=lambda case: (case.creation_date, case.id), reverse=True)
+
+        pages = [Case.get_cases("All", self.current_user, case_perm_checker=perms, page=dict(page_size=4))]
+        while pages[-1].has_next:
+            pages.append(Case.get_cases("All", self.current_user, case_perm_checker=perms,
+                                        page=dict(page_size=4, after=pages[-1].next_cursor)))
+        self.assertEqual([case for page in pages for case in page], all_cases)
+        self.assertFalse(pages[0].has_previous)
+        for page in pages:
+            self.assertEqual(page.total, len(all_cases))
+            self.assertLessEqual(len(page), 4)
+
+        # going back from the last page gives the same pages again
+        page = pages[-1]
+        for previous in reversed(pages[:-1]):
+            page = Case.get_cases("All", self.current_user, case_perm_checker=perms,
+                                  page=dict(page_size=4, before=page.previous_cursor))
+            self.assertEqual(page.items, previous.items)
+
+        # a cursor that is not valid gives the first page
+        page = Case.get_cases("All", self.current_user, case_perm_checker=perms,
+                              page=dict(page_size=4, after="not a cursor"))
+        self.assertEqual(page.items, pages[0].items)
+
     def test_statuses_test_case(self):
         case = Case.get(2)
         self.assertEqual(case.get_status().status, CaseStatus.OPEN)
@@ -279,6 +323,13 @@ class CaseReadTestCase(ModelTestCaseBase):
         status = CaseStatus.ARCHIVED
         self.assertEqual(Case.get_num_cases_opened_on_date(date, status, case_type), 1)
 
+        # test .get_num_cases_by_month()
+        counts = Case.get_num_cases_by_month(date, date)[(date.year, date.month)]
+        self.assertEqual(sum(number for (status, case_type), number in counts.iteritems()
+                             if status == CaseStatus.PENDING), 13)
+        self.assertEqual(counts[(CaseStatus.REJECTED, "Incident Response")], 1)
+        self.assertEqual(counts[(CaseStatus.ARCHIVED, "Incident Response")], 1)
+
         # test .cases_with_user_involved()
         user = User.get(3).id # investigator
         self.assertEqual(len(Case.cases_with_user_involved(user)), 8)
@@ -341,6 +392,17 @@ class CaseReadTestCase(ModelTestCaseBase):
         status = CaseStatus.CREATED
         self.assertEqual(Case.get_num_completed_case_by_user(user, "Other", start, end, status), 0)
 
+        # test .get_num_completed_cases_by_users()
+        users = User.get_all().all()
+        statuses = [CaseStatus.OPEN, CaseStatus.CREATED, CaseStatus.CLOSED]
+        amounts = Case.get_num_completed_cases_by_users(users, start, end, statuses)
+        for user in users:
+            for status in statuses:
+                for case_type in [None, "eDiscovery", "Other"]:
+                    self.assertEqual(amounts.get((user.id, status, case_type), 0),
+                                     Case.get_num_completed_case_by_user(user, case_type, start, end, status))
+        self.assertEqual(Case.get_num_completed_cases_by_users([], start, end, statuses), {})
+
         # test ._active_before_start()
         case = Case.get(1)
         self.assertTrue(case._active_before_start(case.creation_date))
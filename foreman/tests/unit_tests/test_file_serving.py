@@ -0,0 +1,95 @@
+# python imports
+from os import path, remove
+from tempfile import mkstemp
+# library imports
+from mock import patch
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Request
+# local imports
+import base_tester
+from foreman.utils.file_serving import send_file
+from foreman.utils.utils import ROOT_DIR
+
+
+class SendFileTestCase(base_tester.UnitTestCase):
+    contents = "".join(chr(i % 256) for i in xrange(100000))
+
+    def setUp(self):
+        fd, self.file_path = mkstemp(dir=path.join(ROOT_DIR, 'files'), suffix='.dd')
+        with open(self.file_path, 'wb') as f:
+            f.write(self.contents)
+
+    def tearDown(self):
+        remove(self.file_path)
+
+    def get(self, etag="abc123", method='GET', **headers):
+        request = Request(EnvironBuilder(method=method, headers=headers).get_environ())
+        response = send_file(request, self.file_path, etag=etag, download_name="Disk image.dd",
+                             as_attachment=True)
+        return response, "".join(response.iter_encoded()) if response.response else ""
+
+    def test_whole_file(self):
+        response, body = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.contents)
+        self.assertEqual(response.headers['ETag'], '"abc123"')
+        self.assertEqual(response.headers['Accept-Ranges'], 'bytes')
+        self.assertEqual(response.content_length, len(self.contents))
+        self.assertEqual(response.headers['Content-Disposition'], 'attachment; filename=Disk_image.dd')
+        self.assertIn('private', response.headers['Cache-Control'])
+
+        response, body = self.get(method='HEAD')
+        self.assertEqual(response.content_length, len(self.contents))
+        self.assertEqual(body, "")
+
+    def test_not_modified(self):
+        response, body = self.get(If_None_Match='"abc123"')
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(body, "")
+        response, body = self.get(If_None_Match='"something else"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_ranges(self):
+        response, body = self.get(Range='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, self.contents[10:20])
+        self.assertEqual(response.headers['Content-Range'], 'bytes 10-19/100000')
+        self.assertEqual(response.content_length, 10)
+
+        response, body = self.get(Range='bytes=99990-')
+        self.assertEqual(body, self.contents[99990:])
+        response, body = self.get(Range='bytes=-5')
+        self.assertEqual(body, self.contents[-5:])
+
+        response, body = self.get(Range='bytes=200000-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response.headers['Content-Range'], 'bytes */100000')
+
+        # more than one range, or a malformed header, is answered with the whole file
+        for header in ['bytes=0-1,5-6', 'bytes=a-b', 'pages=1-2']:
+            response, body = self.get(Range=header)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(body, self.contents)
+
+    def test_if_range(self):
+        response, body = self.get(Range='bytes=0-9', If_Range='"abc123"')
+        self.assertEqual(response.status_code, 206)
+        # the client's part of the file is out of date, so it is sent all of it
+        response, body = self.get(Range='bytes=0-9', If_Range='"old"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.contents)
+
+    @patch('foreman.utils.file_serving.send_method', return_value='x-sendfile')
+    def test_x_sendfile(self, method):
+        response, body = self.get()
+        self.assertEqual(response.headers['X-Sendfile'], path.abspath(self.file_path))
+        self.assertEqual(body, "")
+        response, body = self.get(If_None_Match='"abc123"')
+        self.assertEqual(response.status_code, 304)
+        self.assertNotIn('X-Sendfile', response.headers)
+
+    @patch('foreman.utils.file_serving.send_method', return_value='x-accel-redirect')
+    def test_x_accel_redirect(self, method):
+        response, body = self.get()
+        self.assertEqual(response.headers['X-Accel-Redirect'], '/protected_files/' + path.basename(self.file_path))
+        self.assertEqual(body, "")
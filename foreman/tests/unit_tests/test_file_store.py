@@ -0,0 +1,117 @@
+# python imports
+from os import path, stat
+from StringIO import StringIO
+# library imports
+from mock import patch
+from werkzeug.datastructures import FileStorage
+# local imports
+import base_tester
+from foreman.model import StoredFile, TaskUpload, CaseUpload, Task, User
+from foreman.utils.utils import session, ROOT_DIR, file_hasher, UploadStream, UMASK
+
+
+class StoredFileTestCase(base_tester.UnitTestCase):
+    contents = "a disk image attached to more than one task\n" * 1000
+
+    def setUp(self):
+        self.task = Task.get(1)
+        self.user = User.get(1)
+        self.uploads = []
+
+    def tearDown(self):
+        session.rollback()
+        for upload in self.uploads:
+            if not upload.deleted:
+                upload.delete(self.user)
+            session.delete(upload)
+        session.commit()
+
+    def save(self, model, file_name, stream=None):
+        f = FileStorage(stream if stream is not None else StringIO(self.contents), file_name)
+        if model is TaskUpload:
+            upload_location = path.join(TaskUpload.DEFAULT_FOLDER, "{}_{}".format(self.task.case.id, self.task.id))
+            upload_location, saved_name, file_hash = TaskUpload.save_file(f, upload_location)
+            upload = TaskUpload(self.user.id, self.task.id, self.task.case.id, saved_name, "notes", "title",
+                                upload_location, file_hash)
+        else:
+            upload_location = path.join(CaseUpload.DEFAULT_FOLDER, str(self.task.case.id))
+            upload_location, saved_name, file_hash = CaseUpload.save_file(f, upload_location)
+            upload = CaseUpload(self.user.id, self.task.case.id, saved_name, "notes", "title", upload_location,
+                                file_hash)
+        session.add(upload)
+        session.commit()
+        self.uploads.append(upload)
+        return upload
+
+    def full_path(self, upload):
+        return path.join(ROOT_DIR, upload.upload_location, upload.file_name)
+
+    def expected_hash(self):
+        hasher = file_hasher()
+        hasher.update(self.contents)
+        return hasher.hexdigest()
+
+    @patch('foreman.model.caseModel.deduplicate_uploads', return_value=True)
+    def test_same_contents_are_stored_once(self, deduplicate):
+        first = self.save(TaskUpload, "image.dd")
+        second = self.save(CaseUpload, "copy of image.DD")
+        self.assertEqual(first.file_hash, self.expected_hash())
+        self.assertEqual(first.file_name, self.expected_hash() + ".dd")
+        self.assertEqual((first.upload_location, first.file_name), (second.upload_location, second.file_name))
+        self.assertTrue(StoredFile.is_stored(first.upload_location))
+        self.assertTrue(path.exists(self.full_path(first)))
+        stored = session.query(StoredFile).filter_by(file_name=first.file_name).one()
+        self.assertEqual(stored.references, 2)
+        self.assertTrue(first.check_hash())
+
+        # the file is only removed once the last upload using it is deleted
+        first.delete(self.user)
+        session.commit()
+        self.assertTrue(path.exists(self.full_path(second)))
+        self.assertEqual(stored.references, 1)
+        second.delete(self.user)
+        session.commit()
+        self.assertFalse(path.exists(self.full_path(second)))
+        self.assertEqual(session.query(StoredFile).filter_by(file_name=first.file_name).count(), 0)
+
+    @patch('foreman.model.caseModel.deduplicate_uploads', return_value=True)
+    def test_rolled_back_delete_keeps_the_file(self, deduplicate):
+        first = self.save(TaskUpload, "image.dd")
+        first.delete(self.user)
+        session.flush()
+        session.rollback()
+        self.assertFalse(first.deleted)
+        self.assertTrue(path.exists(self.full_path(first)))
+        self.assertEqual(session.query(StoredFile).filter_by(file_name=first.file_name).one().references, 1)
+
+    @patch('foreman.model.caseModel.deduplicate_uploads', return_value=True)
+    def test_hash_comes_from_the_store(self, deduplicate):
+        first = self.save(TaskUpload, "image.dd")
+        upload = TaskUpload(self.user.id, self.task.id, self.task.case.id, first.file_name, "notes", "title",
+                            first.upload_location)
+        self.assertEqual(upload.file_hash, self.expected_hash())
+
+    @patch('foreman.model.caseModel.deduplicate_uploads', return_value=False)
+    def test_store_turned_off(self, deduplicate):
+        first = self.save(TaskUpload, "image.dd")
+        second = self.save(TaskUpload, "image.dd")
+        self.assertFalse(StoredFile.is_stored(first.upload_location))
+        self.assertNotEqual(first.file_name, second.file_name)
+        self.assertEqual(first.file_hash, second.file_hash)
+        self.assertTrue(path.exists(self.full_path(first)))
+        first.delete(self.user)
+        session.commit()
+        self.assertFalse(path.exists(self.full_path(first)))
+        self.assertTrue(path.exists(self.full_path(second)))
+
+    def test_file_permissions(self):
+        # readable by a front end server running as another user, as files saved by Werkzeug were
+        for deduplicate in [False, True]:
+            with patch('foreman.model.caseModel.deduplicate_uploads', return_value=deduplicate):
+                upload = self.save(TaskUpload, "image.dd")
+                self.assertEqual(stat(self.full_path(upload)).st_mode & 0777, 0666 & ~UMASK)
+
+                stream = UploadStream()
+                stream.write(self.contents)
+                upload = self.save(TaskUpload, "image.dd", stream)
+                self.assertEqual(stat(self.full_path(upload)).st_mode & 0777, 0666 & ~UMASK)
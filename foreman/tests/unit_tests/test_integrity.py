@@ -0,0 +1,73 @@
+# python imports
+from os import path, remove
+from shutil import copyfile
+# local imports
+import base_tester
+from foreman.model import IntegrityCheck, TaskUpload, TaskNotes, Task, User
+from foreman.utils.integrity import verify_integrity
+from foreman.utils.utils import session, ROOT_DIR
+
+
+class IntegrityCheckTestCase(base_tester.UnitTestCase):
+
+    def setUp(self):
+        self.upload_location = path.join('tests', 'test_images')
+        self.file_path = path.join(ROOT_DIR, self.upload_location, "test_integrity_upload.png")
+        copyfile(path.join(ROOT_DIR, self.upload_location, "original.png"), self.file_path)
+
+        self.task = Task.get(1)
+        self.upload = TaskUpload(1, self.task.id, self.task.case.id, "test_integrity_upload.png", "notes", "title",
+                                 self.upload_location)
+        self.note = TaskNotes(u"An integrity test note", 1, self.task.id)
+        session.add(self.upload)
+        session.add(self.note)
+        session.commit()
+
+    def tearDown(self):
+        session.rollback()
+        # verify_integrity checks every upload and note, not only the two added here
+        session.query(IntegrityCheck).delete()
+        for obj in [self.upload, self.note]:
+            session.delete(obj)
+        session.commit()
+        if path.exists(self.file_path):
+            remove(self.file_path)
+
+    def get_check(self, obj):
+        return session.query(IntegrityCheck).filter_by(object_type=type(obj).__name__, object_id=obj.id).one()
+
+    def test_unchanged_test_case(self):
+        num_checked, num_failed = verify_integrity(processes=1)
+        self.assertGreaterEqual(num_checked, 2)
+        self.assertTrue(self.get_check(self.upload).passed)
+        self.assertEqual(self.get_check(self.upload).current_hash, self.upload.file_hash)
+        self.assertTrue(self.get_check(self.note).passed)
+        self.assertEqual(self.upload.integrity_check, self.get_check(self.upload))
+
+    def test_changed_note_test_case(self):
+        verify_integrity(processes=1)
+        # changed behind Foreman's back, so the stored hash is not updated
+        session.query(TaskNotes).filter_by(id=self.note.id).update({'note': u"Something else"})
+        session.commit()
+        verify_integrity(processes=2)
+        check = self.get_check(self.note)
+        self.assertFalse(check.passed)
+        self.assertIn(check, IntegrityCheck.get_failed())
+        self.assertGreaterEqual(IntegrityCheck.get_number_failed(), 1)
+        self.assertEqual(check.checked_object, self.note)
+
+    def test_missing_file_test_case(self):
+        remove(self.file_path)
+        verify_integrity(processes=2, batch_size=5)
+        check = self.get_check(self.upload)
+        self.assertFalse(check.passed)
+        self.assertIsNone(check.current_hash)
+        self.assertIn(u"could not be read", check.error)
+
+    def test_deleted_upload_test_case(self):
+        verify_integrity(processes=1)
+        self.upload.delete(User.get(1))
+        session.commit()
+        verify_integrity(processes=1)
+        self.assertEqual(session.query(IntegrityCheck).filter_by(object_type="TaskUpload",
+                                                                 object_id=self.upload.id).count(), 0)
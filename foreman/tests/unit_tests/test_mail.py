@@ -0,0 +1,79 @@
+# python imports
+import smtplib
+from datetime import datetime, timedelta
+from mock import patch
+# local imports
+import base_tester
+from foreman.model import QueuedEmail
+from foreman.utils.mail import send_queued_emails, remove_sent_emails
+from foreman.utils.utils import session
+
+
+class QueuedEmailTestCase(base_tester.UnitTestCase):
+    def setUp(self):
+        self.emails = [QueuedEmail([u"a@example.org"], u"[Foreman] Subject", u"Body \u00e9", u"f@example.org",
+                                   cc=[u"b@example.org"]),
+                       QueuedEmail([u"c@example.org", u"d@example.org"], u"[Foreman] Other", u"Body",
+                                   u"f@example.org", bcc=[u"e@example.org"])]
+        for queued_email in self.emails:
+            session.add(queued_email)
+        session.commit()
+
+    def tearDown(self):
+        for queued_email in self.emails:
+            session.delete(queued_email)
+        session.commit()
+
+    def test_recipients(self):
+        self.assertEqual(self.emails[0].recipients, [u"a@example.org"])
+        self.assertEqual(self.emails[0].cc_recipients, [u"b@example.org"])
+        self.assertEqual(self.emails[0].bcc_recipients, [])
+        self.assertEqual(self.emails[1].recipients, [u"c@example.org", u"d@example.org"])
+
+    def test_send_queued_emails(self):
+        with patch('foreman.utils.mail.smtplib.SMTP') as mock_smtp:
+            self.assertEqual(send_queued_emails(), 2)
+            # one connection for the whole queue
+            self.assertEqual(mock_smtp.call_count, 1)
+            sendmail = mock_smtp.return_value.sendmail
+            self.assertEqual(sendmail.call_count, 2)
+            self.assertEqual(sendmail.call_args_list[0][0][1], [u"a@example.org", u"b@example.org"])
+            self.assertEqual(sendmail.call_args_list[1][0][1], [u"c@example.org", u"d@example.org", u"e@example.org"])
+        for queued_email in self.emails:
+            self.assertIsNotNone(queued_email.date_sent)
+        self.assertEqual(QueuedEmail.get_due(10, 5), [])
+
+    def test_failed_email_is_retried_later(self):
+        with patch('foreman.utils.mail.smtplib.SMTP') as mock_smtp:
+            mock_smtp.return_value.sendmail.side_effect = smtplib.SMTPRecipientsRefused({})
+            self.assertEqual(send_queued_emails(), 0)
+        for queued_email in self.emails:
+            self.assertIsNone(queued_email.date_sent)
+            self.assertEqual(queued_email.attempts, 1)
+            self.assertGreater(queued_email.next_attempt, datetime.now())
+            self.assertIsNotNone(queued_email.last_error)
+        self.assertEqual(QueuedEmail.get_due(10, 5), [])
+
+        # once due again, gives up after max_attempts
+        for queued_email in self.emails:
+            queued_email.next_attempt = datetime.now()
+        session.commit()
+        self.assertEqual(QueuedEmail.get_due(10, 2), self.emails)
+        self.assertEqual(QueuedEmail.get_due(10, 1), [])
+
+    def test_remove_sent_emails(self):
+        old_sent, recent_sent, old_unsent = [QueuedEmail([u"a@example.org"], u"[Foreman] Old", u"Body",
+                                                         u"f@example.org") for unused in range(3)]
+        old_sent.date_sent = datetime.now() - timedelta(days=31)
+        recent_sent.date_sent = datetime.now() - timedelta(days=29)
+        old_unsent.date_queued = datetime.now() - timedelta(days=31)
+        for queued_email in [old_sent, recent_sent, old_unsent]:
+            session.add(queued_email)
+        session.commit()
+        kept = [recent_sent.id, old_unsent.id]
+
+        self.assertEqual(remove_sent_emails(30), 1)
+        self.assertEqual(sorted(row.id for row in session.query(QueuedEmail.id).filter(
+            QueuedEmail.subject == u"[Foreman] Old")), sorted(kept))
+        session.query(QueuedEmail).filter(QueuedEmail.id.in_(kept)).delete(synchronize_session=False)
+        session.commit()
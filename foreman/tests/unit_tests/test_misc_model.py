@@ -2,7 +2,7 @@ from datetime import datetime
 from werkzeug.exceptions import InternalServerError
 # local imports
 import base_tester
-from foreman.model import SpecialText, ForemanOptions
+from foreman.model import SpecialText, ForemanOptions, OptionsVersion, NamePool
 from foreman.utils.utils import session
 
 
@@ -11,4 +11,62 @@ class SpecialTextTestCase(base_tester.UnitTestCase):
 
 
 class ForemanOptionsTestCase(base_tester.UnitTestCase):
-    pass
+
+    def test_cached_options_follow_changes(self):
+        options = ForemanOptions.get_options()
+        old_format = options.date_format
+        version = OptionsVersion.get_version()
+        self.assertEqual(ForemanOptions.get_cached_options().date_format, old_format)
+        self.assertIs(ForemanOptions.get_cached_options(), ForemanOptions.get_cached_options())
+
+        options.date_format = u"%Y"
+        session.flush()
+        # this thread sees its own uncommitted change
+        self.assertEqual(ForemanOptions.get_date(datetime(2001, 2, 3)), "2001")
+        session.commit()
+        self.assertEqual(OptionsVersion.get_version(), version + 1)
+        self.assertEqual(ForemanOptions.get_date(datetime(2001, 2, 3)), "2001")
+
+        options.date_format = u"%d"
+        session.flush()
+        session.rollback()
+        self.assertEqual(OptionsVersion.get_version(), version + 1)
+        self.assertEqual(ForemanOptions.get_date(datetime(2001, 2, 3)), "2001")
+
+        ForemanOptions.get_options().date_format = old_format
+        session.commit()
+        self.assertEqual(ForemanOptions.get_cached_options().date_format, old_format)
+
+    def test_case_names_from_list(self):
+        # the test database takes its case names from utils/test_case_names.txt
+        self.assertEqual(ForemanOptions.get_cached_options().case_names, "FromList")
+        version = OptionsVersion.get_version()
+        increment = session.query(ForemanOptions.c_increment).scalar()
+        next_name = NamePool.get_name(NamePool.CASE, increment + 1)
+        self.assertIsNotNone(next_name)
+
+        self.assertEqual(ForemanOptions.get_next_case_name(test=True), next_name)
+        self.assertEqual(session.query(ForemanOptions.c_increment).scalar(), increment)
+        self.assertEqual(ForemanOptions.get_next_case_name(), next_name)
+        self.assertEqual(ForemanOptions.get_next_case_name(), NamePool.get_name(NamePool.CASE, increment + 2))
+        self.assertEqual(session.query(ForemanOptions.c_increment).scalar(), increment + 2)
+        session.rollback()
+        # using a name does not change the cached options
+        self.assertEqual(OptionsVersion.get_version(), version)
+
+    def test_numeric_case_names(self):
+        options = ForemanOptions.get_options()
+        options.case_names = u"NumericIncrement"
+        session.flush()
+        increment = session.query(ForemanOptions.c_increment).scalar()
+        self.assertEqual(ForemanOptions.get_next_case_name(),
+                         '{num:0{width}}'.format(num=increment + 1, width=options.c_leading_zeros))
+        self.assertEqual(ForemanOptions.get_next_case_name(),
+                         '{num:0{width}}'.format(num=increment + 2, width=options.c_leading_zeros))
+        session.rollback()
+
+    def test_names_run_out(self):
+        self.assertIsNone(NamePool.get_name(NamePool.CASE, 100000))
+        self.assertEqual(ForemanOptions._name_from_list(NamePool.CASE, 100000, 3), "100000")
+        self.assertTrue(ForemanOptions.get_options().over_limit_case)
+        session.rollback()
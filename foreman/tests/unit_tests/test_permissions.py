@@ -1,8 +1,27 @@
 from datetime import datetime, timedelta
 # local imports
 import base_tester
+from foreman.model import Case, Task, Evidence, User, has_permissions
+from foreman.model.permissions import permissions_filter
 from foreman.utils.utils import session
 
 
 class PermissionTestCaseBase(base_tester.UnitTestCase):
     pass
+
+
+class PermissionsFilterTestCase(base_tester.UnitTestCase):
+    def _check_view_filter(self, model):
+        for user in User.get_all():
+            allowed = set(obj.id for obj in model.get_all() if has_permissions(user, obj, "view"))
+            filtered = set(obj.id for obj in session.query(model).filter(permissions_filter(user, model, "view")))
+            self.assertEqual(allowed, filtered)
+
+    def test_case_view_filter(self):
+        self._check_view_filter(Case)
+
+    def test_task_view_filter(self):
+        self._check_view_filter(Task)
+
+    def test_evidence_view_filter(self):
+        self._check_view_filter(Evidence)
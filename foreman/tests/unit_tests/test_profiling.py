@@ -0,0 +1,50 @@
+# library imports
+from werkzeug.test import Client
+from werkzeug.wrappers import BaseResponse
+# local imports
+import base_tester
+from foreman.model import User, Case
+from foreman.utils.profiling import ProfilingMiddleware, profile_stats, template_timer, current_profile
+from foreman.utils.utils import session, local_manager
+
+
+def profiled_app(environ, start_response):
+    environ['foreman.endpoint'] = 'test.profiled'
+    session.query(User).count()
+    with template_timer():
+        session.query(Case).count()
+        session.query(Case).count()
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return ['profiled']
+
+
+class ProfilingMiddlewareTestCase(base_tester.UnitTestCase):
+    def setUp(self):
+        profile_stats.reset()
+        self.client = Client(ProfilingMiddleware(profiled_app), BaseResponse)
+
+    def tearDown(self):
+        local_manager.cleanup()
+        profile_stats.reset()
+
+    def test_request_is_profiled(self):
+        response = self.client.get('/profiled/', buffered=True)
+        self.assertEqual(response.data, 'profiled')
+        self.client.get('/profiled/', buffered=True)
+
+        endpoints = profile_stats.get_endpoints()
+        self.assertEqual(len(endpoints), 1)
+        stats = endpoints[0]
+        self.assertEqual(stats.endpoint, 'test.profiled')
+        self.assertEqual(stats.requests, 2)
+        self.assertEqual(stats.average('num_queries'), 3)
+        self.assertGreater(stats.total_time, 0)
+        self.assertGreater(stats.template_time, 0)
+        self.assertLessEqual(stats.sql_time, stats.total_time)
+
+    def test_queries_outside_requests_are_not_counted(self):
+        self.client.get('/profiled/', buffered=True)
+        local_manager.cleanup()
+        self.assertIsNone(current_profile())
+        session.query(User).count()
+        self.assertEqual(profile_stats.get_endpoints()[0].num_queries, 3)
@@ -12,7 +12,21 @@ class ModelTestRoleBase(base_tester.UnitTestCase):
 
 
 class UserRolesTestCase(ModelTestRoleBase):
-    pass
+    def test_active_roles_cache(self):
+        user = User.get(1)
+        admin = User.get(1)
+        self.assertTrue(UserRoles.check_user_has_active_role(user, UserRoles.ADMIN))
+        self.assertIn(UserRoles.ADMIN, UserRoles.get_active_roles(user))
+
+        UserRoles.edit_user_role(user, UserRoles.ADMIN, admin)
+        self.assertFalse(UserRoles.check_user_has_active_role(user, UserRoles.ADMIN))
+        UserRoles.edit_user_role(user, UserRoles.ADMIN, admin)
+        self.assertTrue(UserRoles.check_user_has_active_role(user, UserRoles.ADMIN))
+        session.rollback()
+
+    def test_active_roles_for_no_user(self):
+        self.assertEqual(UserRoles.get_active_roles(None), set())
+        self.assertFalse(UserRoles.check_user_has_active_role(None, UserRoles.ADMIN))
 
 
 class UserRolesHistoryTestCase(ModelTestRoleBase):
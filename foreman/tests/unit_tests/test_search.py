@@ -0,0 +1,79 @@
+# local imports
+import base_tester
+from foreman.model import SearchIndex, Task, Case, User, TaskNotes, has_permissions
+from foreman.utils.utils import session
+
+
+class SearchIndexTestCase(base_tester.UnitTestCase):
+
+    def tearDown(self):
+        session.rollback()
+
+    def found(self, user, query, object_type=None):
+        return [(result.object_type, result.object_id) for result in SearchIndex.search(user, query, limit=100)
+                if object_type is None or result.object_type == object_type]
+
+    def test_notes_are_indexed_as_they_change(self):
+        admin = User.get(1)
+        task = Task.get(9)
+        task.add_note(u"The suspect's laptop held a file called zanzibarfile", admin)
+        session.flush()
+        note = session.query(TaskNotes).filter_by(task_id=task.id).order_by(TaskNotes.id.desc()).first()
+        self.assertEqual(self.found(admin, u"zanzibarfile"), [("TaskNotes", note.id)])
+        # the porter stemmer matches other forms of the words
+        self.assertEqual(self.found(admin, u"suspects laptops zanzibarfile"), [("TaskNotes", note.id)])
+
+        note.note = u"Nothing to see here"
+        session.flush()
+        self.assertEqual(self.found(admin, u"zanzibarfile"), [])
+        self.assertEqual(self.found(admin, u"nothing see"), [("TaskNotes", note.id)])
+
+        session.delete(note)
+        session.flush()
+        self.assertEqual(self.found(admin, u"nothing see"), [])
+
+    def test_results_are_filtered_by_permissions(self):
+        task = Task.get(9)
+        task.background = u"The quokkaword was found on the desktop"
+        session.flush()
+        self.assertEqual(self.found(User.get(1), u"quokkaword"), [("Task", 9)])
+        # a private task that user 8 is not working on
+        self.assertFalse(has_permissions(User.get(8), task, 'view'))
+        self.assertEqual(self.found(User.get(8), u"quokkaword"), [])
+
+        for user_id in [1, 7, 8, 11, 19, 33]:
+            user = User.get(user_id)
+            for result in SearchIndex.search(user, u"case", limit=100):
+                self.assertTrue(has_permissions(user, result.owner, 'view'))
+
+    def test_case_fields_test_case(self):
+        case = Case.get(1)
+        case.justification = u"Requested by the ombudsmanword"
+        case.reference = u"REF-wallabyword"
+        session.flush()
+        admin = User.get(1)
+        self.assertEqual(self.found(admin, u"ombudsmanword"), [("Case", 1)])
+        self.assertEqual(self.found(admin, u"wallabyword"), [("Case", 1)])
+        self.assertEqual(self.found(admin, case.case_name, "Case"), [("Case", 1)])
+
+    def test_query_syntax_is_ignored(self):
+        admin = User.get(1)
+        for query in [u'"', u'the OR', u'NEAR(the', u'the*', u'-the', u'title:the', u'  ']:
+            SearchIndex.search(admin, query)
+        self.assertEqual(len(SearchIndex.search(admin, u"")), 0)
+
+    def test_paging_test_case(self):
+        admin = User.get(1)
+        first = SearchIndex.search(admin, u"case", limit=5)
+        self.assertEqual(len(first), 5)
+        self.assertEqual(first.next_offset, 5)
+        second = SearchIndex.search(admin, u"case", offset=first.next_offset, limit=5)
+        everything = SearchIndex.search(admin, u"case", limit=10)
+        self.assertEqual([(r.object_type, r.object_id) for r in first] + [(r.object_type, r.object_id) for r in second],
+                         [(r.object_type, r.object_id) for r in everything])
+
+    def test_rebuild_test_case(self):
+        admin = User.get(1)
+        before = self.found(admin, u"case")
+        SearchIndex.rebuild()
+        self.assertEqual(self.found(admin, u"case"), before)
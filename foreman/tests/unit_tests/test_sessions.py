@@ -0,0 +1,112 @@
+# python imports
+from datetime import datetime, timedelta
+from shutil import rmtree
+from tempfile import mkdtemp
+# local imports
+import base_tester
+from foreman.model import WebSession
+from foreman.utils.sessions import DatabaseSessionStore, SignedCookieSessionStore, ExpiringFilesystemSessionStore
+from foreman.utils.utils import session
+
+
+class DatabaseSessionStoreTestCase(base_tester.UnitTestCase):
+    def setUp(self):
+        self.store = DatabaseSessionStore(3600)
+
+    def tearDown(self):
+        session.query(WebSession).delete(synchronize_session=False)
+        session.commit()
+
+    def test_save_and_get(self):
+        new = self.store.new()
+        self.assertFalse(new.should_save)
+        new['userid'] = 1
+        self.assertTrue(new.should_save)
+        self.store.save(new)
+
+        stored = self.store.get(new.sid)
+        self.assertEqual(stored['userid'], 1)
+        # nothing changed and it is not near its expiry, so it is not written again
+        self.assertFalse(stored.should_save)
+
+    def test_unknown_sid(self):
+        stored = self.store.get('0' * 40)
+        self.assertEqual(dict(stored), {})
+        self.assertNotEqual(stored.sid, '0' * 40)
+
+    def test_expiry(self):
+        new = self.store.new()
+        new['userid'] = 1
+        self.store.save(new)
+        row = WebSession.get(new.sid)
+
+        row.expires = datetime.now() + timedelta(seconds=60)
+        session.commit()
+        # used near the end of its lifetime, so it is saved again with a new expiry
+        self.assertTrue(self.store.get(new.sid).should_save)
+
+        row.expires = datetime.now() - timedelta(seconds=1)
+        session.commit()
+        self.assertEqual(dict(self.store.get(new.sid)), {})
+
+    def test_remove_expired(self):
+        for i in range(5):
+            session.add(WebSession(str(i) * 40, u"{}", datetime.now() - timedelta(hours=i + 1)))
+        session.add(WebSession('a' * 40, u"{}", datetime.now() + timedelta(hours=1)))
+        session.commit()
+        self.assertEqual(WebSession.remove_expired(2), 5)
+        self.assertEqual([sid for sid, in session.query(WebSession.sid)], ['a' * 40])
+
+
+class SignedCookieSessionStoreTestCase(base_tester.UnitTestCase):
+    def setUp(self):
+        self.store = SignedCookieSessionStore('not a secret', 3600)
+
+    def test_save_and_get(self):
+        new = self.store.new()
+        new['userid'] = 1
+        self.store.save(new)
+
+        stored = self.store.get(new.sid)
+        self.assertEqual(dict(stored), {'userid': 1})
+        self.assertFalse(stored.should_save)
+
+    def test_tampered_cookie(self):
+        new = self.store.new()
+        new['userid'] = 1
+        self.store.save(new)
+
+        signature, data = new.sid.split('?', 1)
+        flipped = ('A' if signature[0] != 'A' else 'B') + signature[1:]
+        self.assertEqual(dict(self.store.get(flipped + '?' + data)), {})
+        self.assertEqual(dict(self.store.get(signature + '?' + data + '&admin=dHJ1ZQ==')), {})
+        other_store = SignedCookieSessionStore('another secret', 3600)
+        self.assertEqual(dict(other_store.get(new.sid)), {})
+
+    def test_expired_cookie(self):
+        expired_store = SignedCookieSessionStore('not a secret', -1)
+        new = expired_store.new()
+        new['userid'] = 1
+        expired_store.save(new)
+        self.assertEqual(dict(self.store.get(new.sid)), {})
+
+
+class ExpiringFilesystemSessionStoreTestCase(base_tester.UnitTestCase):
+    def setUp(self):
+        self.session_dir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.session_dir)
+
+    def test_remove_expired(self):
+        store = ExpiringFilesystemSessionStore(3600, self.session_dir)
+        new = store.new()
+        new['userid'] = 1
+        store.save(new)
+        self.assertEqual(store.get(new.sid)['userid'], 1)
+        self.assertEqual(store.remove_expired(), 0)
+
+        expired_store = ExpiringFilesystemSessionStore(-1, self.session_dir)
+        self.assertEqual(dict(expired_store.get(new.sid)), {})
+        self.assertEqual(expired_store.remove_expired(), 1)
+        self.assertEqual(store.list(), [])
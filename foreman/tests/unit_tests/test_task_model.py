@@ -1,3 +1,4 @@
+import calendar
 from datetime import datetime, timedelta
 # local imports
 import base_tester
@@ -264,6 +265,30 @@ class TaskWriteTestCase(ModelTestCaseBase):
 
         session.delete(task)
 
+    def test_loaded_roles_are_kept_up_to_date_test_case(self):
+        task = Task(self.case, self.task_type, "loaded_roles", self.current_user)
+        session.add(task)
+        session.commit()
+        session.expire_all()
+
+        task = Task.get_with_profile(task.id, 'view')
+        self.assertIsNone(task.principle_investigator)
+
+        task.assign_task(User.get(5))
+        self.assertEqual(task.principle_investigator, User.get(5))
+        self.assertEqual(task.status, TaskStatus.ALLOCATED)
+
+        task.assign_qa(User.get(5))
+        task.assign_qa(User.get(6))
+        self.assertEqual(task.principle_QA, User.get(6))
+        self.assertEqual(task.QAs, [User.get(5), User.get(6)])
+
+        UserTaskRoles.delete_if_already_exists(task.id, 6, UserTaskRoles.PRINCIPLE_QA)
+        session.flush()
+        self.assertEqual(task.principle_QA, User.get(5))
+
+        session.delete(task)
+
 
 class TaskReadTestCase(ModelTestCaseBase):
 
@@ -315,6 +340,20 @@ class TaskReadTestCase(ModelTestCaseBase):
         self.assertEqual(start, task.creation_date)
         self.assertEqual(end, task.case.get_status().date_time)
 
+    def test_view_profile_test_case(self):
+        properties = ['principle_investigator', 'secondary_investigator', 'principle_QA', 'secondary_QA',
+                      'investigators', 'QAs', 'workers', 'status']
+        for task_id in [1, 6, 9, 17, 25]:
+            task = Task.get(task_id)
+            expected = [getattr(task, attribute) for attribute in properties]
+            session.expire_all()
+
+            task = Task.get_with_profile(task_id, 'view')
+            with base_tester.QueryCounter(session.get_bind()) as counter:
+                self.assertEqual([getattr(task, attribute) for attribute in properties], expected)
+                self.assertEqual(task.case.principle_case_manager, Case.get(task.case_id).principle_case_manager)
+            self.assertEqual(counter.count, 0)
+
     def test_task_roles_and_perms_test_case(self):
         perms = BaseController.check_permissions
 
@@ -438,6 +477,20 @@ class TaskReadTestCase(ModelTestCaseBase):
         num_tasks = Task.get_num_tasks_by_user_for_date_range(inv, cat, start, end, status)
         self.assertEqual(num_tasks, 0)
 
+        # the grouped counts match the single counts
+        start = self.now - timedelta(days=2)
+        end = self.now + timedelta(days=2)
+        users = User.get_all().all()
+        statuses = [TaskStatus.ALLOCATED, TaskStatus.PROGRESS, "Waiting for QA", "Performing QA", TaskStatus.CLOSED,
+                    "Nonsense"]
+        categories = [None] + TaskCategory.get_categories()
+        amounts = Task.get_num_tasks_by_users_for_date_range(users, start, end, statuses)
+        for user in users:
+            for status in statuses:
+                for cat in categories:
+                    self.assertEqual(amounts.get((user.id, status, cat), 0),
+                                     Task.get_num_tasks_by_user_for_date_range(user, cat, start, end, status))
+
         date_req = self.now
         inv = User.get(4)
         num_tasks = Task.get_num_completed_qas_for_given_month(inv, date_req)
@@ -452,6 +505,49 @@ class TaskReadTestCase(ModelTestCaseBase):
         num_tasks = Task.get_num_completed_qas_for_given_month(inv, date_req)
         self.assertEqual(num_tasks, 0)
 
+        # the grouped counts match the monthly counts
+        users = User.get_all().all()
+        for date_req in [self.now, self.now - timedelta(days=60)]:
+            start = datetime(date_req.year, date_req.month, 1)
+            end = datetime(date_req.year, date_req.month, calendar.monthrange(date_req.year, date_req.month)[1])
+            created = Task.get_num_created_tasks_by_investigators(users, start, end)
+            qaed = Task.get_num_completed_qas_by_users(users, start, end)
+            for user in users:
+                self.assertEqual(qaed.get(user.id, 0), Task.get_num_completed_qas_for_given_month(user, date_req))
+                for cat in TaskCategory.get_categories():
+                    self.assertEqual(created.get((user.id, cat), 0),
+                                     Task.get_num_created_tasks_for_given_month_user_is_investigator_for(user, cat,
+                                                                                                        date_req))
+        self.assertEqual(Task.get_num_completed_qas_by_users([], start, end), {})
+
+    def test_task_pages_test_case(self):
+        perms = BaseController.check_permissions
+        user = User.get(1)
+        all_tasks = Task.get_active_tasks(user, perms)
+
+        pages = [Task.get_active_tasks(user, perms, page=dict(page_size=5))]
+        while pages[-1].has_next:
+            pages.append(Task.get_active_tasks(user, perms, page=dict(page_size=5, after=pages[-1].next_cursor)))
+        tasks = [task for page in pages for task in page]
+        self.assertEqual(sorted(task.id for task in tasks), sorted(task.id for task in all_tasks))
+        self.assertEqual(tasks, sorted(tasks, key=lambda task: (task.creation_date, task.id), reverse=True))
+        self.assertEqual(pages[0].total, len(all_tasks))
+
+    def test_task_pages_with_repeated_rows_test_case(self):
+        perms = BaseController.check_permissions
+        user = User.get(5)
+        for get_tasks in (Task.get_completed_qas, Task.get_completed_investigations):
+            all_tasks = get_tasks(user, perms, current_user=self.current_user)
+
+            pages = [get_tasks(user, perms, current_user=self.current_user, page=dict(page_size=3))]
+            while pages[-1].has_next:
+                pages.append(get_tasks(user, perms, current_user=self.current_user,
+                                       page=dict(page_size=3, after=pages[-1].next_cursor)))
+            tasks = [task.id for page in pages for task in page]
+            self.assertEqual(sorted(tasks), sorted(task.id for task in all_tasks))
+            self.assertEqual(len(tasks), len(set(tasks)))
+            self.assertEqual(pages[0].total, len(all_tasks))
+
     def test_task_lists_test_case(self):
         tasks = [Task.get(5), Task.get(18)]
         result_tasks = Task.get_queued_tasks()
@@ -0,0 +1,36 @@
+# python imports
+from os import path, listdir
+from shutil import rmtree
+from tempfile import mkdtemp
+# library imports
+from mako.lookup import TemplateLookup
+# local imports
+import base_tester
+from foreman.utils.templates import TEMPLATE_DIR, template_names, compile_templates
+
+
+class CompileTemplatesTestCase(base_tester.UnitTestCase):
+    def setUp(self):
+        self.module_dir = mkdtemp()
+        self.lookup = TemplateLookup(directories=[TEMPLATE_DIR], module_directory=self.module_dir,
+                                     output_encoding='utf-8', input_encoding='utf-8')
+
+    def tearDown(self):
+        rmtree(self.module_dir)
+
+    def test_template_names(self):
+        names = template_names()
+        self.assertIn(path.join('pages', 'admin.html'), names)
+        self.assertIn(path.join('base', '404.html'), names)
+        self.assertEqual(names, sorted(names))
+
+    def test_compile_templates(self):
+        num_compiled = compile_templates(self.lookup)
+        self.assertEqual(num_compiled, len(template_names()))
+        self.assertTrue(self.lookup.has_template(path.join('pages', 'admin.html')))
+        self.assertTrue(listdir(self.module_dir))
+        # a second process loads the compiled modules
+        lookup = TemplateLookup(directories=[TEMPLATE_DIR], module_directory=self.module_dir,
+                                output_encoding='utf-8', input_encoding='utf-8')
+        template = lookup.get_template(path.join('pages', 'admin.html'))
+        self.assertTrue(template.module.__file__.startswith(self.module_dir))
@@ -1,8 +1,9 @@
-from datetime import datetime
+from datetime import datetime, date
 from werkzeug.exceptions import InternalServerError
 # local imports
 import base_tester
 from foreman.model import User, ForemanOptions, Department, Team, UserMessage, UserHistory, TaskTimeSheets, CaseTimeSheets
+from foreman.model import Task, Case
 from foreman.utils.utils import session
 
 
@@ -27,8 +28,45 @@ class UserHistoryTestCase(ModelTestUserBase):
 
 
 class TaskTimeSheetsTestCase(ModelTestUserBase):
-    pass
+    monday = date(2016, 8, 15)
+
+    def tearDown(self):
+        session.rollback()
+
+    def test_save_week(self):
+        user = User.get(5)
+        task, other_task = Task.get(1), Task.get(2)
+        TaskTimeSheets.save_week(user, [(task.id, self.monday, 2), (task.id, date(2016, 8, 16), 7.5),
+                                        (other_task.id, self.monday, None)])
+        self.assertEqual(TaskTimeSheets.get_week(user, self.monday),
+                         {"15082016": {task.id: 2}, "16082016": {task.id: 7.5}})
+
+        # saving again replaces the hours rather than adding rows, and empty cells remove them
+        TaskTimeSheets.save_week(user, [(task.id, self.monday, 4), (task.id, date(2016, 8, 16), None),
+                                        (other_task.id, self.monday, 1)])
+        self.assertEqual(TaskTimeSheets.get_week(user, self.monday),
+                         {"15082016": {task.id: 4, other_task.id: 1}})
+        self.assertEqual(TaskTimeSheets.get_filter_by(user_id=user.id, task_id=task.id, date=self.monday).count(), 1)
+
+    def test_get_week_is_bounded(self):
+        user = User.get(5)
+        task = Task.get(1)
+        TaskTimeSheets.save_week(user, [(task.id, date(2016, 8, 14), 1), (task.id, date(2016, 8, 21), 3),
+                                        (task.id, date(2016, 8, 22), 5)])
+        self.assertEqual(TaskTimeSheets.get_week(user, self.monday), {"21082016": {task.id: 3}})
+        self.assertEqual(TaskTimeSheets.get_week(User.get(1), self.monday), {})
 
 
 class CaseTimeSheetsTestCase(ModelTestUserBase):
-    pass
+    monday = date(2016, 8, 15)
+
+    def tearDown(self):
+        session.rollback()
+
+    def test_save_week(self):
+        user = User.get(18)
+        case = Case.get(2)
+        CaseTimeSheets.save_week(user, [(case.id, self.monday, 1), (case.id, date(2016, 8, 19), 0.5)])
+        CaseTimeSheets.save_week(user, [(case.id, self.monday, 3)])
+        self.assertEqual(CaseTimeSheets.get_week(user, self.monday),
+                         {"15082016": {case.id: 3}, "19082016": {case.id: 0.5}})
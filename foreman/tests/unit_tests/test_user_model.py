@@ -1,7 +1,7 @@
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, date
 # local imports
 import base_tester
-from foreman.model import User, ForemanOptions
+from foreman.model import User, ForemanOptions, Case, Task, CaseTimeSheets, TaskTimeSheets, UserHierarchy
 from foreman.utils.utils import session
 
 
@@ -11,7 +11,83 @@ class ModelTestUserBase(base_tester.UnitTestCase):
 
 
 class UserWriteTestCase(ModelTestUserBase):
-    pass
+
+    def test_get_hours_worked_by_users(self):
+        user = User.get(5)
+        other = User.get(6)
+        monday = date(2001, 1, 1)
+        tuesday = monday + timedelta(days=1)
+        entries = [CaseTimeSheets(user, Case.get(1), monday, 2.5),
+                   TaskTimeSheets(user, Task.get(1), monday, 3),
+                   TaskTimeSheets(user, Task.get(2), tuesday, 1),
+                   CaseTimeSheets(other, Case.get(1), tuesday, 4),
+                   CaseTimeSheets(user, Case.get(1), monday + timedelta(days=7), 8)]
+        for entry in entries:
+            session.add(entry)
+        session.commit()
+
+        hours = User.get_hours_worked_by_users([user, other], monday, monday + timedelta(days=7))
+        self.assertEqual(hours, {(user.id, monday): 5.5, (user.id, tuesday): 1, (other.id, tuesday): 4})
+        for day in [monday, tuesday, monday + timedelta(days=2)]:
+            self.assertEqual(hours.get((user.id, day), 0), user.get_hours_worked(day))
+            self.assertEqual(hours.get((other.id, day), 0), other.get_hours_worked(day))
+        self.assertEqual(User.get_hours_worked_by_users([], monday, tuesday), {})
+
+        for entry in entries:
+            session.delete(entry)
+        session.commit()
+
+
+class UserHierarchyTestCase(ModelTestUserBase):
+
+    def setUp(self):
+        self.users = [User(u"hierarchy{}".format(i), u"password", u"Hierarchy", u"User {}".format(i),
+                           u"hierarchy{}@example.org".format(i)) for i in range(4)]
+        head, manager, worker, other = self.users
+        manager.manager = head
+        worker.manager = manager
+        for user in self.users:
+            session.add(user)
+        session.commit()
+
+    def tearDown(self):
+        for user in reversed(self.users):
+            user.manager = None
+        session.commit()
+        for user in self.users:
+            session.delete(user)
+        session.commit()
+
+    def _rows(self):
+        ids = [user.id for user in self.users]
+        return sorted(session.query(UserHierarchy.ancestor_id, UserHierarchy.descendant_id, UserHierarchy.depth)
+                      .filter(UserHierarchy.descendant_id.in_(ids)).all())
+
+    def test_hierarchy(self):
+        head, manager, worker, other = self.users
+        self.assertTrue(UserHierarchy.is_ancestor(head.id, worker.id))
+        self.assertFalse(UserHierarchy.is_ancestor(worker.id, head.id))
+        self.assertEqual(UserHierarchy.get_descendants(head.id), [manager, worker])
+        self.assertEqual(head.all_reports(True), [manager, worker])
+        self.assertEqual(other.all_reports(True), [])
+
+    def test_move(self):
+        head, manager, worker, other = self.users
+        manager.manager = other
+        session.commit()
+        self.assertEqual(UserHierarchy.get_descendants(head.id), [])
+        self.assertEqual(UserHierarchy.get_descendants(other.id), [manager, worker])
+        self.assertEqual(self._rows(), sorted([(other.id, manager.id, 1), (other.id, worker.id, 2),
+                                               (manager.id, worker.id, 1)]))
+
+        worker.manager = None
+        session.commit()
+        self.assertEqual(UserHierarchy.get_descendants(other.id), [manager])
+
+    def test_rebuild(self):
+        rows = self._rows()
+        UserHierarchy.rebuild()
+        self.assertEqual(self._rows(), rows)
 
 
 class UserReadTestCase(ModelTestUserBase):
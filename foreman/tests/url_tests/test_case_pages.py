@@ -2,8 +2,12 @@
 Tests to check that all pages work as expected with a 200 status code and not 404 or 500 for example.
 """
 
+# python imports
+from os import path, makedirs, remove
+from shutil import copyfile
 # local imports
 from base_tester import URLTestCase
+from foreman.utils.utils import ROOT_DIR
 
 
 class CasesTestCase(URLTestCase):
@@ -133,6 +137,27 @@ class CasesTestCase(URLTestCase):
         self._check_url('/cases/2/uploads/1/', 28)  # login as a requester for this case
         self._check_url('/cases/2/uploads/1/', 38)  # login as an authoriser for this case
 
+    def test_download_upload_file(self):
+        self._check_url('/cases/3/uploads/1/download/', 1, 404)  # login as admin, but wrong case
+        self._check_url('/cases/2/uploads/1/download/', None, 401)  # not logged in
+        self._check_url('/cases/2/uploads/1/download/', 1)  # login as admin
+        self.assertEqual(self.resp.headers['ETag'], '"{}"'.format(self._upload_hash()))
+        self._check_url('/cases/2/uploads/1/download/', 11)  # login as an investigator
+        self._check_url('/cases/2/uploads/1/download/', 33, 403)  # login as a requester
+        self._check_url('/cases/2/uploads/1/download/', 28)  # login as a requester for this case
+
+        self.login_user(1)
+        resp = self.client.get('/cases/2/uploads/1/download/', headers={'If-None-Match': self.resp.headers['ETag']})
+        self.assertEqual(resp.status_code, 304)
+        resp = self.client.get('/cases/2/uploads/1/download/', headers={'Range': 'bytes=0-3'})
+        self.assertEqual(resp.status_code, 206)
+        self.assertEqual(resp.data, '\x89PNG')
+        self.logout_user()
+
+    def _upload_hash(self):
+        from foreman.model import CaseUpload
+        return CaseUpload.get(1).file_hash
+
     def test_delete_upload_file(self):
         # only admins, the requester and case manager of the case can delete files
         self._check_url('/cases/3/uploads/1/delete/', 1, 404)  # login as admin, but wrong case
@@ -167,4 +192,50 @@ class CasesTestCase(URLTestCase):
         self._check_url('/cases/authorise/12/', 39)  # login as an authoriser for this case
 
         # case not pending, aka already auth/denied
-        self._check_url('/cases/authorise/6/', 39, 403)  # login as an authoriser for this case
\ No newline at end of file
+        self._check_url('/cases/authorise/6/', 39, 403)  # login as an authoriser for this case
+
+    def test_case_report(self):
+        # the report is streamed after the view returns, so read it before logging out
+        self.login_user(1)
+        self.resp = self.client.get('/cases/2/report/', buffered=True)
+        self.logout_user()
+        self.assertEqual(self.resp.status_code, 200)
+        self.assertIn('Task Audit Log', self.resp.data)
+
+        self._check_url('/cases/test_doesnt_exist/report/', 1, 404)  # login as admin, but wrong case
+        self._check_url('/cases/2/report/', None, 401)  # not logged in
+        self._check_url('/cases/2/report/', 33, 403)  # login as a requester
+
+
+class UploadFoldersTestCase(URLTestCase):
+
+    def setUp(self):
+        from foreman.model import CaseUpload, TaskUpload, Task
+        from foreman.utils.utils import session
+        URLTestCase.setUp(self)
+        task = Task.get(1)
+        self.uploads = [CaseUpload(1, task.case.id, "test_upload_folders.png", "notes", "title", file_hash=u"0" * 32),
+                        TaskUpload(1, task.id, task.case.id, "test_upload_folders.png", "notes", "title",
+                                   file_hash=u"0" * 32)]
+        for upload in self.uploads:
+            directory = path.join(ROOT_DIR, upload.upload_location)
+            if not path.exists(directory):
+                makedirs(directory)
+            copyfile(path.join(ROOT_DIR, 'tests', 'test_images', 'original.png'),
+                     path.join(ROOT_DIR, upload.file_path))
+            session.add(upload)
+        session.commit()
+
+    def tearDown(self):
+        from foreman.utils.utils import session
+        session.remove()
+        for upload in self.uploads:
+            session.delete(session.merge(upload))
+            remove(path.join(ROOT_DIR, upload.file_path))
+        session.commit()
+
+    def test_upload_folders_not_served(self):
+        for upload in self.uploads:
+            self._check_url('/' + upload.file_path.replace('\\', '/'), None, 404)  # not logged in
+            self._check_url('/' + upload.file_path.replace('\\', '/'), 1, 404)  # login as admin
+        self._check_url('/files/task_uploads/', 1, 404)  # login as admin
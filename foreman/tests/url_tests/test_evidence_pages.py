@@ -51,6 +51,15 @@ class EvidenceTestCase(URLTestCase):
         self._check_url('/evidence/1/uploads/add/', 18)  # login as a primary case manager for this case
         self._check_url('/evidence/1/uploads/add/', 28, 403)  # login as a requester for this case
 
+    def test_download_evidence_photo(self):
+        self._check_url('/evidence/1/uploads/1/download/', None, 401)  # not logged in
+        self._check_url('/evidence/1/uploads/1/download/', 1)  # login as admin
+        self.assertEqual(self.resp.headers['Content-Type'], 'image/jpeg')
+        self.assertTrue(self.resp.headers['Content-Disposition'].startswith('inline'))
+        self._check_url('/evidence/1/uploads/1/download/', 2)  # login as an investigator for this case
+        self._check_url('/evidence/1/uploads/1/download/', 33, 403)  # login as a requester
+        self._check_url('/evidence/1/uploads/99/download/', 1, 404)  # login as admin, but wrong upload
+
     def test_view_evidence_photo(self):
         self._check_url('/evidence/1/uploads/1/', None, 401)  # not logged in
         self._check_url('/evidence/1/uploads/1/', 1)  # login as admin
@@ -32,4 +32,81 @@ class ForensicsTestCase(URLTestCase):
         self._check_url('/cases/2/8/qa/', 5, 403)  # login as a primary investigator for this case
         self._check_url('/cases/2/8/qa/', 3, 403)  # login as a secondary investigator for this case
         self._check_url('/cases/2/8/qa/', 2)  # login as a primary QA for this case
-        self._check_url('/cases/2/8/qa/', 28, 403)  # login as a requester for this case
\ No newline at end of file
+        self._check_url('/cases/2/8/qa/', 28, 403)  # login as a requester for this case
+
+class TaskUploadTestCase(URLTestCase):
+
+    def tearDown(self):
+        self.logout_user()
+
+    def _latest_upload(self):
+        from foreman.model import TaskUpload
+        from foreman.utils.utils import session
+        session.remove()
+        return session.query(TaskUpload).order_by(TaskUpload.id.desc()).first()
+
+    def test_upload_is_hashed_as_it_is_saved(self):
+        from os import listdir, path
+        from StringIO import StringIO
+        from foreman.utils.utils import file_hasher, upload_temp_dir
+
+        contents = "forensic export\n" * 10000
+        self.login_user(1)
+        resp = self.client.post('/cases/6/22/notes/?upload_file=true', buffered=True,
+                                data={'file_title': u"Export", 'comments': u"The export",
+                                      'file': (StringIO(contents), 'export.txt')})
+        self.assertEqual(resp.status_code, 200)
+        upload = self._latest_upload()
+        self.assertEqual(upload.file_title, u"Export")
+        hasher = file_hasher()
+        hasher.update(contents)
+        self.assertEqual(upload.file_hash, hasher.hexdigest())
+        self.assertTrue(upload.check_hash())
+        self.assertTrue(path.exists(path.join(upload.ROOT, upload.file_path)))
+        self.assertEqual([name for name in listdir(upload_temp_dir()) if name.startswith("upload-")], [])
+        self.assertEqual(self.client.get('/cases/6/22/uploads/{}/'.format(upload.id)).status_code, 200)
+
+    def test_chunked_upload(self):
+        import simplejson as json
+        from foreman.utils.utils import file_hasher
+
+        self.login_user(19)
+        resp = self.client.post('/cases/6/22/chunked_uploads/', data={'file_name': u"image.dd", 'file_size': 11})
+        self.assertEqual(resp.status_code, 403)
+
+        self.login_user(1)
+        resp = self.client.post('/cases/6/22/chunked_uploads/', data={'file_name': u"image.dd", 'file_size': 0})
+        self.assertEqual(resp.status_code, 400)
+        resp = self.client.post('/cases/6/22/chunked_uploads/', data={'file_name': u"image.dd", 'file_size': 11})
+        self.assertEqual(resp.status_code, 200)
+        url = json.loads(resp.data)['url']
+
+        resp = self.client.post(url + '?offset=0', data="hello ", content_type="application/octet-stream")
+        self.assertEqual(json.loads(resp.data), {'received': 6, 'file_size': 11})
+        # a chunk sent again, or one that would make the file too big, is refused with where to carry on from
+        resp = self.client.post(url + '?offset=0', data="hello ", content_type="application/octet-stream")
+        self.assertEqual(resp.status_code, 409)
+        self.assertEqual(json.loads(resp.data)['received'], 6)
+        resp = self.client.post(url + '?offset=6', data="world and more", content_type="application/octet-stream")
+        self.assertEqual(resp.status_code, 409)
+        self.assertEqual(json.loads(self.client.get(url).data)['received'], 6)
+
+        resp = self.client.post(url + 'complete/', data={'file_title': u"Image", 'comments': u"Disk image"})
+        self.assertEqual(resp.status_code, 409)
+        resp = self.client.post(url + '?offset=6', data="world", content_type="application/octet-stream")
+        self.assertEqual(json.loads(resp.data), {'received': 11, 'file_size': 11})
+
+        # only the user who started the upload can add to it
+        self.login_user(6)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+        self.login_user(1)
+        resp = self.client.post(url + 'complete/', data={'file_title': u"Image", 'comments': u"Disk image"})
+        self.assertEqual(resp.status_code, 200)
+        upload = self._latest_upload()
+        self.assertEqual(upload.id, json.loads(resp.data)['upload_id'])
+        hasher = file_hasher()
+        hasher.update("hello world")
+        self.assertEqual(upload.file_hash, hasher.hexdigest())
+        self.assertTrue(upload.check_hash())
+        self.assertEqual(self.client.get(url).status_code, 404)
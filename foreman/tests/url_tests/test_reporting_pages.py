@@ -2,6 +2,7 @@
 Tests to check that all pages work as expected with a 200 status code and not 404 or 500 for example.
 """
 
+import json
 # local imports
 from base_tester import URLTestCase
 
@@ -31,3 +32,29 @@ class ReportingTestCase(URLTestCase):
         self._check_url('/json/jason_tasks_qaed/?start_date=October 2014', 11, 403)  # login as an investigator
         self._check_url('/json/jason_tasks_qaed/?start_date=October 2014', 7, 403)  # login as a QA
         self._check_url('/json/jason_tasks_qaed/?start_date=October 2014', 33, 403)  # login as a requester
+
+    def test_json_date_range_url(self):
+        self._check_url('/json/jason_tasks_assigned_to_inv/?start_date=January 2014&end_date=December 2014&'
+                        'format=columns', 1)
+        data = json.loads(self.resp.data)
+        self.assertEqual(sorted(data.keys()), ['categories', 'counts', 'users'])
+        self.assertEqual(len(data['counts']), len(data['users']))
+        for row in data['counts']:
+            self.assertEqual(len(row), len(data['categories']))
+
+        self._check_url('/json/jason_tasks_qaed/?start_date=20140101&end_date=20141231&format=columns', 1)
+        data = json.loads(self.resp.data)
+        self.assertEqual(sorted(data.keys()), ['categories', 'counts', 'users'])
+        self.assertEqual(data['categories'], ['Number of QAs'])
+        self.assertEqual(len(data['counts']), len(data['users']))
+        for row in data['counts']:
+            self.assertEqual(len(row), 1)
+        self._check_url('/json/jason_tasks_qaed/?start_date=20140101&end_date=20141231', 1)
+        for row in json.loads(self.resp.data):
+            self.assertEqual(sorted(row.keys()), ['Number of QAs', 'QA Partner'])
+
+        self._check_url('/json/jason_directs_tasks/?start_date=20140106&end_date=20141231&task_type=Allocated', 1)
+        self._check_url('/json/jason_directs_cases/?start_date=20140106&end_date=20141231&case_type=Open&'
+                        'format=columns', 1)
+        self._check_url('/json/jason_directs_cases/?start_date=nonsense', 1)
+        self.assertEqual(json.loads(self.resp.data), [])
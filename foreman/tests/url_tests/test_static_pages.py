@@ -49,3 +49,63 @@ class AdminTestCase(URLTestCase):
         self._check_url('/admin/', 11, 403)  # login as an investigator
         self._check_url('/admin/', 7, 403)  # login as a QA
         self._check_url('/admin/', 33, 403)  # login as a requester
+
+
+class SearchTestCase(URLTestCase):
+
+    def test_url(self):
+        self._check_url('/search/', None, 401)  # not logged in
+        self._check_url('/search/', 1)  # login as admin
+        self._check_url('/search/?q=case', 1)  # login as admin
+        self._check_url('/search/?q=case&offset=5', 19)  # login as a case manager
+        self._check_url('/search/?q=case', 11)  # login as an investigator
+        self._check_url('/search/?q=case', 7)  # login as a QA
+        self._check_url('/search/?q=case', 33)  # login as a requester
+        self._check_url('/search/?q=nothingwillmatchthis', 1)  # login as admin
+
+
+class ProfilingTestCase(URLTestCase):
+
+    def test_url(self):
+        self._check_url('/admin/profiling/', None, 401)  # not logged in
+        self._check_url('/admin/profiling/', 1)  # login as admin
+        self._check_url('/admin/profiling/?reset=true', 1)  # login as admin
+        self._check_url('/admin/profiling/', 19, 403)  # login as a case manager
+        self._check_url('/admin/profiling/', 11, 403)  # login as an investigator
+        self._check_url('/admin/profiling/', 33, 403)  # login as a requester
+
+
+class IntegrityTestCase(URLTestCase):
+
+    def setUp(self):
+        from foreman.model import IntegrityCheck, TaskNotes, TaskUpload, CaseUpload, EvidencePhotoUpload
+        from foreman.utils.utils import session
+        URLTestCase.setUp(self)
+        checks = []
+        for model in [TaskNotes, TaskUpload, CaseUpload, EvidencePhotoUpload]:
+            obj = session.query(model).order_by(model.id).first()
+            if obj is not None:
+                # replaces any check left by an earlier test, as there is one per object
+                session.query(IntegrityCheck).filter_by(object_type=model.__name__, object_id=obj.id).delete()
+                checks.append(IntegrityCheck(model.__name__, obj.id))
+        checks.append(IntegrityCheck("TaskNotes", 999999))
+        for check in checks:
+            check.record(u"0" * 32, False, u"The hashes do not match")
+            session.add(check)
+        session.commit()
+        self.check_ids = [check.id for check in checks]
+
+    def tearDown(self):
+        from foreman.model import IntegrityCheck
+        from foreman.utils.utils import session
+        session.remove()
+        session.query(IntegrityCheck).filter(IntegrityCheck.id.in_(self.check_ids)).delete(synchronize_session=False)
+        session.commit()
+
+    def test_url(self):
+        self._check_url('/admin/integrity/', None, 401)  # not logged in
+        self._check_url('/admin/integrity/', 1)  # login as admin
+        self._check_url('/', 1)  # the failed checks banner
+        self._check_url('/admin/integrity/', 19, 403)  # login as a case manager
+        self._check_url('/admin/integrity/', 11, 403)  # login as an investigator
+        self._check_url('/admin/integrity/', 33, 403)  # login as a requester
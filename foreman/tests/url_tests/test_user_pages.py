@@ -16,6 +16,24 @@ class TaskTestCase(URLTestCase):
         self._check_url('/users/', 7, 403)  # login as a QA
         self._check_url('/users/', 33, 403)  # login as a requester
 
+    def test_save_timesheet(self):
+        from datetime import date
+        from foreman.model import TaskTimeSheets, User
+        from foreman.utils.utils import session
+
+        self.login_user(5)
+        data = {'tasks-0.task': "8", 'tasks-0.timesheet-0.datetime': "15082016", 'tasks-0.timesheet-0.value': "3",
+                'tasks-0.timesheet-1.datetime': "16082016", 'tasks-0.timesheet-1.value': ""}
+        resp = self.client.post('/users/5/timesheet/20160815/?form=task', data=data)
+        self.assertEqual(resp.status_code, 200)
+        data['tasks-0.timesheet-0.value'] = "4.5"
+        resp = self.client.post('/users/5/timesheet/20160815/?form=task', data=data)
+        self.assertEqual(resp.status_code, 200)
+        self.logout_user()
+
+        session.remove()
+        self.assertEqual(TaskTimeSheets.get_week(User.get(5), date(2016, 8, 15)), {"15082016": {8: 4.5}})
+
     def test_view_user(self):
         self._check_url('/users/test/', 1, 404)  # login as admin, but non-existent user
         self._check_url('/users/6568/', 1, 404)  # login as admin, but non-existent user
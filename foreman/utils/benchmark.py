@@ -0,0 +1,121 @@
+# python imports
+from math import ceil
+from time import time
+# library imports
+from sqlalchemy import event, desc
+from werkzeug.test import Client
+from werkzeug.wrappers import BaseResponse
+from werkzeug.contrib.sessions import SessionStore
+# foreman imports
+import utils
+from utils import session
+
+# the pages timed by default. The ids are filled in from the database, using the most recently added records
+DEFAULT_ROUTES = ['/', '/cases/', '/tasks/', '/tasks/qa/', '/evidence/', '/users/', '/cases/{case_id}/',
+                  '/cases/{case_id}/{task_id}/', '/cases/{case_id}/{task_id}/notes/',
+                  '/cases/{evidence_case_id}/evidence/{evidence_id}/', '/cases/{case_id}/report/', '/users/{user_id}/',
+                  '/users/{user_id}/case_history/', '/users/{user_id}/timesheet/', '/users/timesheets/',
+                  '/reporting/', '/json/jason_tasks_assigned_to_inv/', '/json/jason_tasks_qaed/']
+
+
+class SingleUserSessionStore(SessionStore):
+    """ Every request is logged in as the same user, without going through the login page """
+
+    def __init__(self, user_id):
+        SessionStore.__init__(self)
+        self.session = self.session_class({'userid': user_id}, 'benchmark', False)
+
+    def new(self):
+        return self.session
+
+    def get(self, sid):
+        return self.session
+
+    def save(self, session):
+        pass
+
+
+class QueryCounter(object):
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self.increment)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        event.remove(self.engine, 'before_cursor_execute', self.increment)
+
+    def increment(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+
+def percentile(values, percent):
+    """ Nearest rank percentile of a list of numbers """
+    ordered = sorted(values)
+    rank = max(int(ceil(percent / 100.0 * len(ordered))) - 1, 0)
+    return ordered[rank]
+
+
+def default_route_ids(user_id):
+    from ..model import Task, Evidence, UserTaskRoles
+
+    task = session.query(Task).order_by(desc(Task.id)).first()
+    evidence = session.query(Evidence).filter(Evidence.case_id != None).order_by(desc(Evidence.id)).first()
+    investigator = session.query(UserTaskRoles.user_id).filter_by(
+        role=UserTaskRoles.PRINCIPLE_INVESTIGATOR).order_by(desc(UserTaskRoles.id)).first()
+    ids = {'case_id': task.case_id if task else None,
+           'task_id': task.id if task else None,
+           'evidence_id': evidence.id if evidence else None,
+           'evidence_case_id': evidence.case_id if evidence else None,
+           'user_id': investigator[0] if investigator else user_id}
+    session.close()
+    return ids
+
+
+def benchmark(app, user_id, routes=None, repeat=10):
+    """ Request each route repeat times through the WSGI app, logged in as user_id. Returns a list of
+    (route, status codes, p50 seconds, p95 seconds, average number of queries) """
+    ids = default_route_ids(user_id)
+    if routes is None:
+        routes = DEFAULT_ROUTES
+    client = Client(app, BaseResponse)
+    results = []
+    for route in routes:
+        url = route.format(**ids)
+        timings = []
+        queries = []
+        status_codes = set()
+        for _ in xrange(repeat):
+            with QueryCounter(utils.db) as counter:
+                start = time()
+                try:
+                    status_code = client.get(url, buffered=True).status_code
+                except Exception:
+                    # errors that are not turned into a response, e.g. from a template, still get timed
+                    status_code = "error"
+                    session.remove()
+                timings.append(time() - start)
+            queries.append(counter.count)
+            status_codes.add(status_code)
+        results.append((url, sorted(status_codes), percentile(timings, 50), percentile(timings, 95),
+                        sum(queries) / float(len(queries))))
+    return results
+
+
+def run_benchmark(user_id=None, routes=None, repeat=10):
+    from ..application import make_app
+    from ..model import UserRoles
+
+    if user_id is None:
+        user_id = UserRoles.get_admins()[0].id
+        session.close()
+    app = make_app(SingleUserSessionStore(user_id))
+    results = benchmark(app, user_id, routes, repeat)
+
+    print "{:<50} {:>8} {:>10} {:>10} {:>9}".format("Route", "Status", "p50 (ms)", "p95 (ms)", "Queries")
+    for url, status_codes, p50, p95, queries in results:
+        print "{:<50} {:>8} {:>10.1f} {:>10.1f} {:>9.1f}".format(url, ",".join(str(s) for s in status_codes),
+                                                                p50 * 1000, p95 * 1000, queries)
+    return results
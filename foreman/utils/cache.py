@@ -0,0 +1,92 @@
+# python imports
+from time import time
+from threading import RLock
+# local imports
+from utils import config, local
+
+
+class TimedCache(object):
+    """ A small in-process cache shared between requests. Entries expire after ttl seconds; a ttl of 0 turns
+    the cache off so values are always recomputed. """
+
+    def __init__(self, section, option, default_ttl=30):
+        self.section = section
+        self.option = option
+        self.default_ttl = default_ttl
+        self._store = {}
+        self._lock = RLock()
+
+    @property
+    def ttl(self):
+        if config.has_option(self.section, self.option):
+            return config.getint(self.section, self.option)
+        return self.default_ttl
+
+    def get(self, key, create):
+        ttl = self.ttl
+        if ttl <= 0:
+            return create()
+        now = time()
+        with self._lock:
+            entry = self._store.get(key)
+        if entry is not None and entry[0] > now:
+            return entry[1]
+        value = create()
+        with self._lock:
+            self._store[key] = (now + ttl, value)
+        return value
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._store.clear()
+            else:
+                self._store.pop(key, None)
+
+
+def request_cache(name):
+    """ A dictionary that lasts for the current request only; local is cleaned up by the local manager once the
+    response has been sent. Outside of a request it lasts for the thread, so anything stored must also be
+    invalidated when the underlying data changes. """
+    try:
+        caches = local.caches
+    except AttributeError:
+        caches = local.caches = {}
+    return caches.setdefault(name, {})
+
+
+# sidebar counts, keyed by user id. Cleared whenever a case or task changes status.
+sidebar_cache = TimedCache('cache', 'sidebar_ttl')
+
+
+class VersionedCache(object):
+    """ Holds one value shared between requests, tagged with the version of the data it was created from. The current
+    version is looked up once per request with get_version, so every process picks up a change from its next request.
+    While this thread has uncommitted changes to the data the value is created afresh and not shared. """
+
+    def __init__(self, name, get_version):
+        self.name = name
+        self.get_version = get_version
+        self._entry = (None, None)
+
+    def get(self, create):
+        cache = request_cache(self.name)
+        if cache.get('changed'):
+            return create()
+        if 'version' not in cache:
+            cache['version'] = self.get_version()
+        version, value = self._entry
+        if version is None or version != cache['version']:
+            value = create()
+            self._entry = (cache['version'], value)
+        return value
+
+    def changed(self):
+        """ Call when this thread changes the data, before the change is committed """
+        request_cache(self.name)['changed'] = True
+
+    def finished(self):
+        """ Call when the transaction ends, so the version is checked again if there were changes """
+        cache = request_cache(self.name)
+        if cache.get('changed'):
+            cache.clear()
@@ -0,0 +1,132 @@
+# python imports
+import mimetypes
+from datetime import datetime
+from os import path, stat
+# library imports
+from werkzeug import Response
+from werkzeug.datastructures import ContentRange
+from werkzeug.exceptions import NotFound
+from werkzeug.http import is_resource_modified
+from werkzeug.utils import secure_filename
+from werkzeug.wsgi import wrap_file
+# local imports
+from utils import config, ROOT_DIR, upload_buffer_size
+
+SEND_METHODS = ['python', 'x-sendfile', 'x-accel-redirect']
+
+
+def send_method():
+    """ How files are sent: read by Foreman, or handed to the web server in front of it with an X-Sendfile or
+    X-Accel-Redirect header once the permissions have been checked """
+    if not config.has_option('files', 'send_method'):
+        return 'python'
+    method = config.get('files', 'send_method').lower()
+    if method not in SEND_METHODS:
+        raise Exception('\n\nUnknown send_method: {} in your config file.\n\n Please choose from: \n{}'.format(
+            method, SEND_METHODS))
+    return method
+
+
+def accel_redirect_prefix():
+    """ The internal nginx location that maps to Foreman's files folder """
+    if config.has_option('files', 'accel_redirect_prefix'):
+        return config.get('files', 'accel_redirect_prefix')
+    return '/protected_files/'
+
+
+def _read_range(f, length, buffer_size):
+    try:
+        while length > 0:
+            block = f.read(min(buffer_size, length))
+            if not block:
+                break
+            length -= len(block)
+            yield block
+    finally:
+        f.close()
+
+
+def _range_is_current(request, etag, last_modified):
+    """ A range is only sent if the client's copy, named by If-Range, is the current version of the file """
+    if_range = request.if_range
+    if if_range.etag is not None:
+        return if_range.etag == etag
+    if if_range.date is not None:
+        return last_modified <= if_range.date
+    return True
+
+
+def _requested_range(request):
+    """ The single byte range asked for, if any. Other ranges are answered with the whole file """
+    try:
+        requested = request.range
+    except ValueError:
+        # malformed numbers in the header, which is ignored the same way as a malformed header
+        return None
+    if requested is None or requested.units != 'bytes' or len(requested.ranges) != 1:
+        return None
+    return requested
+
+
+def send_file(request, file_path, etag=None, download_name=None, as_attachment=False):
+    """ A response for the file at file_path. etag should identify the contents, such as their hash, otherwise one is
+    made from the size and modification time. Conditional requests get a 304 response, and a single byte range a
+    206 response with just that part of the file. """
+    if not path.isfile(file_path):
+        raise NotFound()
+    file_stat = stat(file_path)
+    size = file_stat.st_size
+    last_modified = datetime.utcfromtimestamp(int(file_stat.st_mtime))
+    if etag is None:
+        etag = "{}-{}".format(int(file_stat.st_mtime), size)
+
+    mimetype = mimetypes.guess_type(download_name or file_path)[0] or 'application/octet-stream'
+    response = Response(mimetype=mimetype, direct_passthrough=True)
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    # files are only sent after the permissions are checked, so shared caches must not keep them, and browsers ask
+    # again each time, which is answered with a 304 if their copy is current
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.headers['Accept-Ranges'] = 'bytes'
+    if download_name is not None:
+        response.headers.add('Content-Disposition', 'attachment' if as_attachment else 'inline',
+                             filename=secure_filename(download_name) or path.basename(file_path))
+
+    if not is_resource_modified(request.environ, etag, last_modified=last_modified):
+        response.status_code = 304
+        return response
+
+    method = send_method()
+    if method == 'x-sendfile':
+        # the web server sends the file, and handles range requests itself
+        response.headers['X-Sendfile'] = path.abspath(file_path)
+        return response
+    elif method == 'x-accel-redirect':
+        relative_path = path.relpath(path.abspath(file_path), path.join(ROOT_DIR, 'files'))
+        response.headers['X-Accel-Redirect'] = accel_redirect_prefix() + relative_path.replace(path.sep, '/')
+        return response
+
+    start, end = 0, size
+    requested = _requested_range(request)
+    if requested is not None and _range_is_current(request, etag, last_modified):
+        byte_range = requested.range_for_length(size)
+        if byte_range is None:
+            response.status_code = 416
+            response.headers['Content-Range'] = 'bytes */{}'.format(size)
+            return response
+        start, end = byte_range
+        response.status_code = 206
+        response.content_range = ContentRange('bytes', start, end, size)
+    response.content_length = end - start
+
+    if request.method == 'HEAD':
+        return response
+    f = open(file_path, 'rb')
+    if start == 0 and end == size:
+        # the whole file can use the WSGI server's file wrapper, which may send it without reading it into Python
+        response.response = wrap_file(request.environ, f, upload_buffer_size())
+    else:
+        f.seek(start)
+        response.response = _read_range(f, end - start, upload_buffer_size())
+    return response
@@ -0,0 +1,120 @@
+# python imports
+import hashlib
+from datetime import datetime
+from multiprocessing import Pool, cpu_count
+from os import path
+# local imports
+from utils import config, session, upload_buffer_size, ROOT_DIR
+
+
+def _hash_file(job):
+    """ Runs in the worker processes, so it is only given plain values """
+    object_id, file_path, algorithm, buffer_size = job
+    hasher = hashlib.new(algorithm)
+    try:
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(buffer_size), ""):
+                hasher.update(block)
+    except IOError, e:
+        return object_id, None, u"The file could not be read: {}".format(e.strerror)
+    return object_id, hasher.hexdigest(), None
+
+
+def _hash_note(job):
+    object_id, note, algorithm = job
+    return object_id, hashlib.new(algorithm, note.encode("utf-8")).hexdigest(), None
+
+
+def _upload_jobs(model, algorithm, buffer_size):
+    def jobs(last_id, batch_size):
+        rows = session.query(model.id, model.upload_location, model.file_name, model.file_hash).filter(
+            model.id > last_id, model.deleted.isnot(True)).order_by(model.id).limit(batch_size).all()
+        return [(row.id, row.file_hash, (row.id, path.join(ROOT_DIR, row.upload_location, row.file_name), algorithm,
+                                         buffer_size)) for row in rows]
+    return jobs
+
+
+def _note_jobs(algorithm):
+    from ..model import TaskNotes
+
+    def jobs(last_id, batch_size):
+        rows = session.query(TaskNotes.id, TaskNotes.note, TaskNotes.hash).filter(
+            TaskNotes.id > last_id).order_by(TaskNotes.id).limit(batch_size).all()
+        return [(row.id, row.hash, (row.id, row.note or u"", algorithm)) for row in rows]
+    return jobs
+
+
+def _forget_deleted(model):
+    """ Deleted uploads are not checked, so their last result would otherwise be shown as current for ever """
+    from ..model import IntegrityCheck
+
+    deleted = session.query(model.id).filter(model.deleted == True).subquery()
+    session.query(IntegrityCheck).filter(IntegrityCheck.object_type == model.__name__,
+                                         IntegrityCheck.object_id.in_(deleted)).delete(synchronize_session=False)
+
+
+def _record(object_type, expected, results, checked):
+    from ..model import IntegrityCheck
+
+    checks = dict((check.object_id, check) for check in session.query(IntegrityCheck).filter(
+        IntegrityCheck.object_type == object_type, IntegrityCheck.object_id.in_(expected.keys())))
+    num_failed = 0
+    for object_id, current_hash, error in results:
+        check = checks.get(object_id)
+        if check is None:
+            check = IntegrityCheck(object_type, object_id)
+            session.add(check)
+        passed = error is None and current_hash == expected[object_id]
+        check.record(current_hash, passed, error, checked)
+        if not passed:
+            num_failed += 1
+    return num_failed
+
+
+def verify_integrity(processes=None, batch_size=200):
+    """ Hash every upload that has not been deleted, and every task note, again and record whether each still matches
+    the hash taken when it was added. The hashing is spread over a pool of processes, or done in this process if
+    processes is 1. Returns the number of uploads and notes checked and the number that failed """
+    from ..model import TaskUpload, CaseUpload, EvidencePhotoUpload, TaskNotes
+
+    algorithm = config.get('forensics', 'hash_type').lower()
+    buffer_size = upload_buffer_size()
+    processes = processes or cpu_count()
+    # the workers are started before the database is used, so they do not share its connections
+    pool = Pool(processes) if processes > 1 else None
+    checked = datetime.now()
+    num_checked = num_failed = 0
+    work = [(TaskUpload, _upload_jobs(TaskUpload, algorithm, buffer_size), _hash_file),
+            (CaseUpload, _upload_jobs(CaseUpload, algorithm, buffer_size), _hash_file),
+            (EvidencePhotoUpload, _upload_jobs(EvidencePhotoUpload, algorithm, buffer_size), _hash_file),
+            (TaskNotes, _note_jobs(algorithm), _hash_note)]
+    try:
+        for model in (TaskUpload, CaseUpload, EvidencePhotoUpload):
+            _forget_deleted(model)
+        for model, get_jobs, hash_function in work:
+            last_id = 0
+            while True:
+                jobs = get_jobs(last_id, batch_size)
+                if not jobs:
+                    break
+                last_id = jobs[-1][0]
+                expected = dict((object_id, expected_hash) for object_id, expected_hash, job in jobs)
+                hash_jobs = [job for object_id, expected_hash, job in jobs]
+                if pool is not None:
+                    results = pool.map(hash_function, hash_jobs, max(len(hash_jobs) // (processes * 4), 1))
+                else:
+                    results = map(hash_function, hash_jobs)
+                num_failed += _record(model.__name__, expected, results, checked)
+                num_checked += len(jobs)
+                session.commit()
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return num_checked, num_failed
+
+
+def integrity_report(processes=None):
+    num_checked, num_failed = verify_integrity(processes)
+    print "{} uploads and task notes checked, {} failed.".format(num_checked, num_failed)
+    return num_failed
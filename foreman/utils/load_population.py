@@ -0,0 +1,262 @@
+# python imports
+import random
+from datetime import datetime, timedelta
+# library imports
+import bcrypt
+from sqlalchemy import func
+# foreman imports
+from foreman.model import Base, User, UserRoles, UserHistory, UserCaseRoles, UserCaseRolesHistory, UserTaskRoles
+from foreman.model import UserTaskRolesHistory, Case, CaseStatus, CaseHistory, CaseAuthorisation, Task, TaskStatus
+from foreman.model import TaskHistory, TaskNotes, Evidence, EvidenceStatus, EvidenceHistory, ChainOfCustody
+from foreman.model import TaskTimeSheets, CaseTimeSheets, TaskType, CaseType, CaseClassification, CasePriority
+from foreman.model import EvidenceType, ForemanOptions
+from foreman.model.caseModel import hash_library
+from utils import session, db
+
+# the statuses a case goes through, and how often a generated case stops at each
+CASE_FLOWS = [([CaseStatus.PENDING], 1),
+              ([CaseStatus.PENDING, CaseStatus.REJECTED], 1),
+              ([CaseStatus.PENDING, CaseStatus.CREATED], 2),
+              ([CaseStatus.PENDING, CaseStatus.CREATED, CaseStatus.OPEN], 6),
+              ([CaseStatus.PENDING, CaseStatus.CREATED, CaseStatus.OPEN, CaseStatus.CLOSED], 4),
+              ([CaseStatus.PENDING, CaseStatus.CREATED, CaseStatus.OPEN, CaseStatus.CLOSED, CaseStatus.ARCHIVED], 2)]
+
+# the user groups generated users are split between, with the roles each group has
+USER_GROUPS = [('investigator', [UserRoles.INV, UserRoles.QA], 6),
+               ('case_manager', [UserRoles.CASE_MAN], 2),
+               ('requester', [UserRoles.REQUESTER], 3),
+               ('authoriser', [UserRoles.AUTH], 1)]
+
+WORDS = ("evidence laptop email server account user network phone drive image analysis suspect fraud data "
+         "recovered deleted files logs access report investigation review copy hash verified witness").split()
+
+
+def _weighted(choices):
+    return [value for value, weight in choices for _ in range(weight)]
+
+
+class BulkInserter(object):
+    """ Buffers new rows per table and writes them with multi-row inserts, in foreign key order. Ids are handed out
+    up front so that child rows can refer to rows that have not been written yet. """
+
+    def __init__(self, chunk_size=5000):
+        self.chunk_size = chunk_size
+        self.rows = {}
+        self.next_ids = {}
+        self.num_buffered = 0
+        self.num_written = 0
+
+    def add(self, model, **values):
+        table = model.__table__
+        if table not in self.next_ids:
+            self.next_ids[table] = (session.query(func.max(table.c.id)).scalar() or 0) + 1
+            self.rows[table] = []
+        row = dict((column.name, None) for column in table.columns)
+        row.update(values)
+        row['id'] = self.next_ids[table]
+        self.next_ids[table] += 1
+        self.rows[table].append(row)
+        self.num_buffered += 1
+        if self.num_buffered >= self.chunk_size:
+            self.flush()
+        return row['id']
+
+    def flush(self):
+        for table in Base.metadata.sorted_tables:
+            rows = self.rows.get(table)
+            if rows:
+                session.execute(table.insert(), rows)
+                self.num_written += len(rows)
+                self.rows[table] = []
+        self.num_buffered = 0
+
+    def finish(self):
+        self.flush()
+        if db.dialect.name == "postgresql":
+            # the ids were set explicitly, so move the id sequences on past them
+            for table in self.next_ids:
+                session.execute("SELECT setval(pg_get_serial_sequence('{0}', 'id'), (SELECT MAX(id) FROM {0}))".format(
+                    table.name))
+        session.commit()
+
+
+class LoadGenerator(object):
+    def __init__(self, num_cases, tasks_per_case, notes_per_task, num_users=None, evidence_per_case=1, seed=None):
+        self.num_cases = num_cases
+        self.tasks_per_case = tasks_per_case
+        self.notes_per_task = notes_per_task
+        self.num_users = max(num_users if num_users is not None else num_cases // 10, len(USER_GROUPS))
+        self.evidence_per_case = evidence_per_case
+        self.random = random.Random(seed)
+        self.inserter = BulkInserter()
+        self.users = {}
+        self.now = datetime.now()
+
+        self.admin = UserRoles.get_admins()[0]
+        self.task_types = [(t.id, t.task_type) for t in TaskType.get_all()]
+        self.case_types = [c.case_type for c in CaseType.get_all()]
+        self.classifications = [c.classification for c in CaseClassification.get_all()]
+        self.priorities = [(p.case_priority, p.colour) for p in CasePriority.get_all()]
+        self.evidence_types = [e.evidence_type for e in EvidenceType.get_all()]
+        self.location = ForemanOptions.get_default_location()
+        self.case_flows = _weighted(CASE_FLOWS)
+
+    def generate(self):
+        self.create_users()
+        first_case = (session.query(func.max(Case.id)).scalar() or 0) + 1
+        for num in xrange(self.num_cases):
+            self.create_case("LOAD{:07d}".format(first_case + num))
+        self.inserter.finish()
+        return self.inserter.num_written
+
+    def text(self, num_words):
+        return u" ".join(self.random.choice(WORDS) for _ in xrange(num_words)).capitalize() + u"."
+
+    def pick(self, group):
+        return self.random.choice(self.users[group])
+
+    def create_users(self):
+        password = bcrypt.hashpw("password", bcrypt.gensalt())
+        group_roles = dict((group, roles) for group, roles, weight in USER_GROUPS)
+        # one user in each group first, then split the rest by weight
+        groups = [group for group, roles, weight in USER_GROUPS]
+        weighted_groups = _weighted([(group, weight) for group, roles, weight in USER_GROUPS])
+        first_user = (session.query(func.max(User.id)).scalar() or 0) + 1
+        for num in xrange(self.num_users):
+            if num < len(groups):
+                group = groups[num]
+            else:
+                group = weighted_groups[num % len(weighted_groups)]
+            roles = group_roles[group]
+            username = u"load{}".format(first_user + num)
+            forename = u"Load{}".format(first_user + num)
+            user_id = self.inserter.add(User, username=username, password=password, forename=forename,
+                                        surname=u"User", email=u"{}@example.org".format(username), validated=True,
+                                        photo=u"default.png", active=True, team_id=1)
+            self.inserter.add(UserHistory, original_user_id=user_id, forename=forename, surname=u"User",
+                              username=username, email=u"{}@example.org".format(username), date_time=self.now,
+                              user_id=self.admin.id, photo=u"default.png")
+            for role in UserRoles.roles:
+                self.inserter.add(UserRoles, user_id=user_id, role=role, removed=role not in roles)
+            self.users.setdefault(group, []).append(user_id)
+
+    def add_case_role(self, case_id, user_id, role, date_time):
+        self.inserter.add(UserCaseRoles, user_id=user_id, case_id=case_id, role=role)
+        self.inserter.add(UserCaseRolesHistory, user_id=user_id, case_id=case_id, role=role, date_time=date_time,
+                          user_change_id=self.admin.id, removed=False)
+
+    def add_task_role(self, task_id, case_id, user_id, role, date_time):
+        self.inserter.add(UserTaskRoles, user_id=user_id, task_id=task_id, role=role)
+        self.inserter.add(UserTaskRolesHistory, user_id=user_id, task_id=task_id, case_id=case_id, role=role,
+                          date_time=date_time, user_change_id=self.admin.id, removed=False)
+
+    def create_case(self, case_name):
+        created = self.now - timedelta(days=self.random.randint(1, 730), minutes=self.random.randint(0, 1440))
+        flow = self.random.choice(self.case_flows)
+        priority, colour = self.random.choice(self.priorities)
+        requester = self.pick('requester')
+        manager = self.pick('case_manager')
+        authoriser = self.pick('authoriser')
+        deadline = created + timedelta(days=self.random.randint(14, 120)) if self.random.random() < 0.5 else None
+        values = dict(case_name=case_name, reference=u"REF-{}".format(case_name), currentStatus=flow[-1],
+                      private=self.random.random() < 0.1, background=self.text(40), location=self.location,
+                      creation_date=created, classification=self.random.choice(self.classifications),
+                      justification=self.text(15), case_type=self.random.choice(self.case_types),
+                      case_priority=priority, case_priority_colour=colour, deadline=deadline)
+        case_id = self.inserter.add(Case, **values)
+        values.pop('currentStatus')
+        values.pop('creation_date')
+        self.inserter.add(CaseHistory, case_id=case_id, date_time=created, user_id=requester, **values)
+
+        date_time = created
+        for status in flow:
+            user_id = requester if status == CaseStatus.PENDING else manager
+            if status in (CaseStatus.CREATED, CaseStatus.REJECTED):
+                user_id = authoriser
+                self.inserter.add(CaseAuthorisation, case_id=case_id, reason=self.text(8), date_time=date_time,
+                                  auth_id=authoriser,
+                                  case_authorised=u"AUTH" if status == CaseStatus.CREATED else u"NOAUTH")
+            self.inserter.add(CaseStatus, case_id=case_id, date_time=date_time, status=status, user_id=user_id)
+            date_time += timedelta(hours=self.random.randint(1, 72))
+
+        self.add_case_role(case_id, requester, UserCaseRoles.REQUESTER, created)
+        self.add_case_role(case_id, authoriser, UserCaseRoles.AUTHORISER, created)
+        if flow[-1] != CaseStatus.PENDING:
+            self.add_case_role(case_id, manager, UserCaseRoles.PRINCIPLE_CASE_MANAGER, created)
+            for day in xrange(self.random.randint(0, 3)):
+                self.inserter.add(CaseTimeSheets, user_id=manager, case_id=case_id,
+                                  date=(created + timedelta(days=day)).date(), hours=self.random.choice([0.5, 1, 2]))
+
+        for num in xrange(self.tasks_per_case):
+            self.create_task(case_id, case_name, num + 1, flow[-1], created, deadline, manager)
+        for num in xrange(self.evidence_per_case):
+            self.create_evidence(case_id, case_name, num + 1, created, manager)
+
+    def task_flow(self, case_status):
+        statuses = TaskStatus.all_statuses
+        if case_status in (CaseStatus.PENDING, CaseStatus.REJECTED):
+            return statuses[:1]
+        elif case_status == CaseStatus.CREATED:
+            return statuses[:self.random.randint(1, 2)]
+        elif case_status == CaseStatus.OPEN:
+            return statuses[:self.random.randint(2, statuses.index(TaskStatus.COMPLETE) + 1)]
+        return statuses
+
+    def create_task(self, case_id, case_name, num, case_status, created, deadline, manager):
+        task_type_id, task_type = self.random.choice(self.task_types)
+        task_name = u"{}_{:02d}".format(case_name, num)
+        flow = self.task_flow(case_status)
+        values = dict(task_name=task_name, case_id=case_id, task_type_id=task_type_id, background=self.text(30),
+                      location=self.location, deadline=deadline)
+        task_id = self.inserter.add(Task, princQA=TaskStatus.DELIVERY in flow, seconQA=False, currentStatus=flow[-1],
+                                    creation_date=created, **values)
+        self.inserter.add(TaskHistory, task_id=task_id, date_time=created, user_id=manager, **values)
+
+        investigator = self.pick('investigator')
+        qa = self.pick('investigator')
+        date_time = created
+        for status in flow:
+            user_id = investigator if status in TaskStatus.invRoles else qa if status == TaskStatus.QA else manager
+            self.inserter.add(TaskStatus, task_id=task_id, case_id=case_id, date_time=date_time, status=status,
+                              user_id=user_id)
+            if status == TaskStatus.ALLOCATED:
+                self.add_task_role(task_id, case_id, investigator, UserTaskRoles.PRINCIPLE_INVESTIGATOR, date_time)
+                self.add_task_role(task_id, case_id, qa, UserTaskRoles.PRINCIPLE_QA, date_time)
+            elif status == TaskStatus.PROGRESS:
+                for note_num in xrange(self.notes_per_task):
+                    note = self.text(self.random.randint(10, 60))
+                    self.inserter.add(TaskNotes, task_id=task_id, author_id=investigator, note=note,
+                                      date_time=date_time + timedelta(minutes=note_num * 20),
+                                      hash=hash_library(note.encode("utf-8")).hexdigest())
+                for day in xrange(self.random.randint(1, 5)):
+                    self.inserter.add(TaskTimeSheets, user_id=investigator, task_id=task_id,
+                                      date=(date_time + timedelta(days=day)).date(),
+                                      hours=self.random.choice([0.5, 1, 2, 4, 7.5]))
+            date_time += timedelta(hours=self.random.randint(1, 48))
+
+    def create_evidence(self, case_id, case_name, num, created, manager):
+        reference = u"{}-EV{:02d}".format(case_name, num)
+        values = dict(reference=reference, type=self.random.choice(self.evidence_types), case_id=case_id,
+                      qr_code=False, qr_code_text=u"", comment=self.text(12), originator=u"Load Generator",
+                      evidence_bag_number=u"BAG{}".format(self.random.randint(10000, 99999)), location=self.location)
+        evidence_id = self.inserter.add(Evidence, user_id=manager, current_status=EvidenceStatus.ACTIVE,
+                                        date_added=created, retention_reminder_sent=False, **values)
+        self.inserter.add(EvidenceHistory, evidence_id=evidence_id, date_time=created, user_id=manager, **values)
+        self.inserter.add(EvidenceStatus, evidence_id=evidence_id, date_time=created, status=EvidenceStatus.INACTIVE,
+                          user_id=manager)
+        self.inserter.add(EvidenceStatus, evidence_id=evidence_id, date_time=created + timedelta(hours=1),
+                          status=EvidenceStatus.ACTIVE, user_id=manager)
+
+        date_time = created + timedelta(hours=2)
+        for custody_num in xrange(self.random.randint(1, 3) * 2):
+            # alternate checking the evidence out to an investigator and back in to the store
+            check_in = custody_num % 2 == 1
+            self.inserter.add(ChainOfCustody, evidence_id=evidence_id, date_recorded=date_time,
+                              date_of_custody=date_time, user_id=manager, check_in=check_in, comment=self.text(6),
+                              custodian=u"Evidence store" if check_in else u"Investigator")
+            date_time += timedelta(days=self.random.randint(1, 10))
+
+
+def generate_load(num_cases, tasks_per_case, notes_per_task, num_users=None, evidence_per_case=1, seed=None):
+    generator = LoadGenerator(num_cases, tasks_per_case, notes_per_task, num_users, evidence_per_case, seed)
+    return generator.generate()
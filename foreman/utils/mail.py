@@ -1,13 +1,31 @@
 # python imports
 import smtplib
+from time import sleep
+from datetime import datetime, timedelta
 from email.MIMEText import MIMEText
 from email.Header import Header
 # foreman imports
-from utils import config
+from utils import config, session
 
 
-def send_email(to_addrs, subject, msg, from_addr, cc=None, bcc=None):
-    """ Send an email """
+def _email_option(option, default):
+    if config.has_option('email', option):
+        return config.getint('email', option)
+    return default
+
+
+def _queue_email():
+    return config.has_option('email', 'queue_email') and config.getboolean('email', 'queue_email')
+
+
+def smtp_connect():
+    smtp = smtplib.SMTP()
+    smtp.connect(config.get('email', 'email_host'))
+    return smtp
+
+
+def send_email(to_addrs, subject, msg, from_addr, cc=None, bcc=None, smtp=None):
+    """ Send an email. If smtp is given the email is sent over that connection and it is left open. """
     msg['Subject'] = Header(subject, 'utf-8')
     msg['From'] = from_addr
 
@@ -20,10 +38,12 @@ def send_email(to_addrs, subject, msg, from_addr, cc=None, bcc=None):
     if bcc:
         to_addrs.extend(bcc)
 
-    smtp = smtplib.SMTP()
-    smtp.connect(config.get('email', 'email_host'))
-    smtp.sendmail(from_addr, to_addrs, msg.as_string())
-    smtp.quit()
+    if smtp is None:
+        smtp = smtp_connect()
+        smtp.sendmail(from_addr, to_addrs, msg.as_string())
+        smtp.quit()
+    else:
+        smtp.sendmail(from_addr, to_addrs, msg.as_string())
 
 
 def print_email(to_addrs, subject, msg, from_addr, cc=None, bcc=None):
@@ -48,7 +68,72 @@ def email(to_addrs, subject, msg, from_addr, cc=None, bcc=None):
     modified_subject = "[Foreman] " + subject
     # ensures all emails from Foreman start the same, so users can filter them in their email client
 
-    if send_live_email:
+    if send_live_email and _queue_email():
+        # sent later by the mail worker; added to the request's transaction so is dropped if the request fails
+        from ..model import QueuedEmail
+        session.add(QueuedEmail(to_addrs, modified_subject, msg, from_addr, cc, bcc))
+    elif send_live_email:
         send_email(to_addrs, modified_subject, MIMEText(msg.encode('utf-8'), _charset='utf-8'), from_addr, cc, bcc)
     else:
-        print_email(to_addrs, modified_subject, msg, from_addr, cc, bcc)
\ No newline at end of file
+        print_email(to_addrs, modified_subject, msg, from_addr, cc, bcc)
+
+
+def send_queued_emails():
+    """ Send the queued emails that are due over a single SMTP connection, a batch at a time. Emails that fail are
+    tried again later, up to mail_max_attempts times. Returns the number of emails sent. """
+    from ..model import QueuedEmail
+    batch_size = _email_option('mail_batch_size', 50)
+    max_attempts = _email_option('mail_max_attempts', 5)
+    retry_delay = _email_option('mail_retry_delay', 60)
+
+    smtp = None
+    num_sent = 0
+    try:
+        while True:
+            queued = QueuedEmail.get_due(batch_size, max_attempts)
+            if not queued:
+                break
+            for queued_email in queued:
+                msg = MIMEText(queued_email.body.encode('utf-8'), _charset='utf-8')
+                try:
+                    if smtp is None:
+                        smtp = smtp_connect()
+                    send_email(queued_email.recipients, queued_email.subject, msg, queued_email.from_addr,
+                               queued_email.cc_recipients, queued_email.bcc_recipients, smtp)
+                except (smtplib.SMTPException, IOError), e:
+                    if isinstance(e, (smtplib.SMTPServerDisconnected, IOError)):
+                        # the connection has gone, so open a new one for the next email
+                        smtp = None
+                    queued_email.failed(e, retry_delay)
+                else:
+                    queued_email.sent()
+                    num_sent += 1
+            session.commit()
+    finally:
+        if smtp is not None:
+            try:
+                smtp.quit()
+            except (smtplib.SMTPException, IOError):
+                pass
+    return num_sent
+
+
+def remove_sent_emails(days=None):
+    """ Delete the queued emails that were sent more than mail_keep_sent_days days ago. Returns the number deleted """
+    from ..model import QueuedEmail
+    if days is None:
+        days = _email_option('mail_keep_sent_days', 30)
+    return QueuedEmail.remove_sent(datetime.now() - timedelta(days=days), 1000)
+
+
+def mail_worker(once=False):
+    """ Drain the email queue, then keep checking it every mail_poll_interval seconds unless once is True """
+    poll_interval = _email_option('mail_poll_interval', 10)
+    while True:
+        num_sent = send_queued_emails()
+        if num_sent:
+            print "{} queued emails sent.".format(num_sent)
+        if once:
+            return
+        session.remove()
+        sleep(poll_interval)
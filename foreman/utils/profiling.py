@@ -0,0 +1,208 @@
+# python imports
+import cProfile
+import logging
+from logging.handlers import RotatingFileHandler
+from os import path, makedirs
+from threading import RLock
+from time import time
+from datetime import datetime
+# library imports
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+# local imports
+from utils import local, config, ROOT_DIR
+
+
+def _option(option, default, get=None):
+    if config.has_option('profiling', option):
+        return (get or config.get)('profiling', option)
+    return default
+
+
+def profiling_enabled():
+    return config.has_section('profiling') and _option('enabled', False, config.getboolean)
+
+
+class RequestProfile(object):
+    """ What one request spent its time on. Template time includes any queries run while rendering """
+
+    def __init__(self):
+        self.start = time()
+        self.total_time = 0
+        self.num_queries = 0
+        self.sql_time = 0
+        self.template_time = 0
+        self.template_sql_time = 0
+        self.in_template = False
+
+    def add_query(self, seconds):
+        self.num_queries += 1
+        self.sql_time += seconds
+        if self.in_template:
+            self.template_sql_time += seconds
+
+    def finish(self):
+        self.total_time = time() - self.start
+
+    @property
+    def python_time(self):
+        return max(self.total_time - self.sql_time - (self.template_time - self.template_sql_time), 0)
+
+
+class EndpointStats(object):
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.requests = 0
+        self.total_time = 0
+        self.max_time = 0
+        self.num_queries = 0
+        self.sql_time = 0
+        self.template_time = 0
+        self.python_time = 0
+
+    def add(self, profile):
+        self.requests += 1
+        self.total_time += profile.total_time
+        self.max_time = max(self.max_time, profile.total_time)
+        self.num_queries += profile.num_queries
+        self.sql_time += profile.sql_time
+        self.template_time += profile.template_time
+        self.python_time += profile.python_time
+
+    def average(self, attribute):
+        return getattr(self, attribute) / float(self.requests) if self.requests else 0
+
+
+class ProfileStats(object):
+    """ Totals per endpoint since this process started, or since they were last reset """
+
+    def __init__(self):
+        self._lock = RLock()
+        self._endpoints = {}
+        self.since = datetime.now()
+
+    def add(self, endpoint, profile):
+        with self._lock:
+            if endpoint not in self._endpoints:
+                self._endpoints[endpoint] = EndpointStats(endpoint)
+            self._endpoints[endpoint].add(profile)
+
+    def get_endpoints(self):
+        with self._lock:
+            return sorted(self._endpoints.values(), key=lambda stats: stats.total_time, reverse=True)
+
+    def reset(self):
+        with self._lock:
+            self._endpoints = {}
+            self.since = datetime.now()
+
+
+profile_stats = ProfileStats()
+
+
+def current_profile():
+    return getattr(local, 'profile', None)
+
+
+class template_timer(object):
+    """ Adds the time taken inside the with block to the template time of the current request, if it is profiled """
+
+    def __enter__(self):
+        self.profile = current_profile()
+        if self.profile is not None:
+            self.start = time()
+            self.profile.in_template = True
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.profile is not None:
+            self.profile.template_time += time() - self.start
+            self.profile.in_template = False
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_profile() is not None:
+        conn.info.setdefault('profiling_start', []).append(time())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = current_profile()
+    if profile is not None and conn.info.get('profiling_start'):
+        profile.add_query(time() - conn.info['profiling_start'].pop())
+
+
+class ProfilingMiddleware(object):
+    """ Records the number of queries, SQL time, template time and Python time of each request. Each request is
+    written to a rotating log and added to the per endpoint totals on the /admin/profiling/ page. When cprofile is on,
+    requests slower than cprofile_threshold milliseconds also have a cProfile dump saved to cprofile_dir. """
+
+    def __init__(self, app):
+        self.app = app
+        self.cprofile = _option('cprofile', False, config.getboolean)
+        self.cprofile_threshold = _option('cprofile_threshold', 1000, config.getint) / 1000.0
+        # relative paths are from the Foreman folder rather than wherever the server was started
+        self.cprofile_dir = path.join(ROOT_DIR, _option('cprofile_dir', path.join('files', 'profiles')))
+        if self.cprofile and not path.exists(self.cprofile_dir):
+            makedirs(self.cprofile_dir)
+
+        self.log = logging.getLogger('foreman.profiling')
+        self.log.setLevel(logging.INFO)
+        self.log.propagate = False
+        log_file = _option('log_file', None)
+        if not self.log.handlers:
+            if log_file:
+                handler = RotatingFileHandler(path.join(ROOT_DIR, log_file),
+                                              maxBytes=_option('log_max_bytes', 1048576, config.getint),
+                                              backupCount=_option('log_backups', 5, config.getint))
+                handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+            else:
+                handler = logging.NullHandler()
+            self.log.addHandler(handler)
+
+        if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+    def __call__(self, environ, start_response):
+        profile = RequestProfile()
+        local.profile = profile
+        profiler = cProfile.Profile() if self.cprofile else None
+        if profiler is not None:
+            profiler.enable()
+        status = []
+
+        def _start_response(response_status, headers, exc_info=None):
+            status.append(response_status.split(' ', 1)[0])
+            return start_response(response_status, headers, exc_info)
+
+        try:
+            app_iter = self.app(environ, _start_response)
+        except Exception:
+            self.finish(environ, profile, profiler, "500")
+            raise
+        return self.iterate(app_iter, environ, profile, profiler, status)
+
+    def iterate(self, app_iter, environ, profile, profiler, status):
+        """ Streamed responses do their work while the body is read, so the request is timed until it is closed """
+        try:
+            for chunk in app_iter:
+                yield chunk
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+            self.finish(environ, profile, profiler, status[0] if status else "-")
+
+    def finish(self, environ, profile, profiler, status):
+        profile.finish()
+        endpoint = environ.get('foreman.endpoint', 'unknown')
+        profile_stats.add(endpoint, profile)
+        self.log.info("%s %s %s %s total=%.1fms queries=%d sql=%.1fms template=%.1fms python=%.1fms", endpoint,
+                      environ.get('REQUEST_METHOD'), environ.get('PATH_INFO'), status, profile.total_time * 1000,
+                      profile.num_queries, profile.sql_time * 1000, profile.template_time * 1000,
+                      profile.python_time * 1000)
+        if profiler is not None:
+            profiler.disable()
+            if profile.total_time >= self.cprofile_threshold:
+                dump = path.join(self.cprofile_dir, "{}-{}.prof".format(endpoint,
+                                                                       datetime.now().strftime("%Y%m%d-%H%M%S-%f")))
+                profiler.dump_stats(dump)
+                self.log.info("%s cProfile saved to %s", endpoint, dump)
@@ -482,12 +482,10 @@ def create_rtf(case, histories):
     p.append('Task Audit Log')
     section.append(p)
 
-    if len(task_histories) == 0:
-        p = Paragraph(ss.ParagraphStyles.Normal)
-        p.append('No audit logs.')
-        section.append(p)
-
+    # the histories may be a generator, so whether there were any is only known afterwards
+    empty = True
     for task_history in task_histories:
+        empty = False
         p = Paragraph(ss.ParagraphStyles.Heading3)
         p.append(u'Task Audit Log: {}'.format(getattr(task_history[0]['current'], "task_name")))
         section.append(p)
@@ -521,6 +519,11 @@ def create_rtf(case, histories):
             row = []
         section.append(t)
 
+    if empty:
+        p = Paragraph(ss.ParagraphStyles.Normal)
+        p.append('No audit logs.')
+        section.append(p)
+
     section = Section(break_type=3, landscape=True,  paper=paper)
     doc.Sections.append(section)
 
@@ -528,12 +531,9 @@ def create_rtf(case, histories):
     p.append('Evidence Audit Log')
     section.append(p)
 
-    if len(evidence_histories) == 0:
-        p = Paragraph(ss.ParagraphStyles.Normal)
-        p.append('No audit logs.')
-        section.append(p)
-
+    empty = True
     for evidence_history in evidence_histories:
+        empty = False
         p = Paragraph(ss.ParagraphStyles.Heading3)
         p.append(u'Evidence Audit Log: {}'.format(getattr(evidence_history[0]['current'], "reference")))
         section.append(p)
@@ -567,6 +567,11 @@ def create_rtf(case, histories):
             row = []
         section.append(t)
 
+    if empty:
+        p = Paragraph(ss.ParagraphStyles.Normal)
+        p.append('No audit logs.')
+        section.append(p)
+
     return doc
 
 
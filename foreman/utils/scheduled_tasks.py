@@ -1,8 +1,11 @@
 #!/usr/bin/env python
-
+# python imports
+from datetime import datetime, timedelta
 # local imports
-from ..model import Evidence, EvidenceStatus, UserRoles
-from mail import email
+from ..model import Evidence, EvidenceStatus, UserRoles, PartialTaskUpload
+from mail import email, remove_sent_emails
+from integrity import integrity_report
+from sessions import make_session_store
 from utils import config, session
 
 
@@ -37,4 +40,32 @@ def retention_notifier(evidence_list=None):
             session.flush()
             session.commit()
 
-scheduled = ['retention_notifier']
\ No newline at end of file
+
+def remove_abandoned_uploads(days=None):
+    """ Delete the chunked uploads that have not been completed after [uploads] abandon_after_days days """
+    if days is None:
+        days = config.getint('uploads', 'abandon_after_days') if config.has_option('uploads', 'abandon_after_days') \
+            else 7
+    cutoff = datetime.now() - timedelta(days=days)
+    for upload in PartialTaskUpload.get_all().filter(PartialTaskUpload.date_started < cutoff):
+        upload.abandon()
+    session.commit()
+
+
+def remove_expired_sessions():
+    """ Delete the sessions that have not been used for [sessions] lifetime seconds """
+    num_removed = make_session_store().remove_expired()
+    print "{} expired sessions removed.".format(num_removed)
+
+
+def remove_old_emails():
+    """ Delete the queued emails that were sent more than [email] mail_keep_sent_days days ago """
+    num_removed = remove_sent_emails()
+    print "{} sent emails removed.".format(num_removed)
+
+
+def integrity_checker():
+    integrity_report()
+
+scheduled = ['retention_notifier', 'remove_abandoned_uploads', 'remove_expired_sessions', 'remove_old_emails',
+             'integrity_checker']
\ No newline at end of file
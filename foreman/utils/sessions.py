@@ -0,0 +1,165 @@
+# python imports
+from datetime import datetime, timedelta
+from os import path, remove
+from time import time
+import json
+# library imports
+from werkzeug.contrib.sessions import SessionStore, FilesystemSessionStore
+from werkzeug.contrib.securecookie import SecureCookie
+# local imports
+from utils import config, session
+
+STORES = ('filesystem', 'database', 'cookie')
+
+
+def _session_option(option, default):
+    if config.has_option('sessions', option):
+        return config.getint('sessions', option)
+    return default
+
+
+def session_lifetime():
+    """ Seconds a session lasts without being used. Default: one day """
+    return _session_option('lifetime', 86400)
+
+
+def make_session_store():
+    """ The session store named by [sessions] store. Defaults to filesystem, as before the option was added """
+    store = config.get('sessions', 'store').lower() if config.has_option('sessions', 'store') else 'filesystem'
+    if store == 'database':
+        return DatabaseSessionStore(session_lifetime())
+    elif store == 'cookie':
+        if not config.has_option('sessions', 'secret_key') or not config.get('sessions', 'secret_key'):
+            raise Exception('A secret_key must be set in the [sessions] section of the config file to use the '
+                            'cookie session store')
+        return SignedCookieSessionStore(config.get('sessions', 'secret_key'), session_lifetime())
+    elif store == 'filesystem':
+        session_dir = config.get('sessions', 'session_dir') if config.has_option('sessions', 'session_dir') else None
+        return ExpiringFilesystemSessionStore(session_lifetime(), session_dir)
+    raise Exception('The session store in the config file must be one of {}'.format(", ".join(STORES)))
+
+
+def _needs_refresh(expires, lifetime):
+    """ A session that is used is saved again, to push back its expiry, once half its lifetime has passed. Until then
+    requests that do not change it are not written """
+    return expires - datetime.now() < timedelta(seconds=lifetime / 2)
+
+
+class DatabaseSessionStore(SessionStore):
+    """ Keeps sessions in the web_sessions table, so they are shared between every Foreman host. Expired sessions are
+    ignored, and deleted in batches by the remove_expired_sessions scheduled task """
+
+    def __init__(self, lifetime):
+        SessionStore.__init__(self)
+        self.lifetime = lifetime
+
+    def get(self, sid):
+        from ..model import WebSession
+
+        if not self.is_valid_key(sid):
+            return self.new()
+        row = WebSession.get_live(sid)
+        if row is None:
+            return self.new()
+        stored = self.session_class(json.loads(row.data), sid, False)
+        stored.modified = _needs_refresh(row.expires, self.lifetime)
+        return stored
+
+    def save(self, stored):
+        from ..model import WebSession
+
+        expires = datetime.now() + timedelta(seconds=self.lifetime)
+        session.merge(WebSession(stored.sid, unicode(json.dumps(dict(stored))), expires))
+        session.commit()
+
+    def delete(self, stored):
+        from ..model import WebSession
+
+        WebSession.get_filter_by(sid=stored.sid).delete(synchronize_session=False)
+        session.commit()
+
+    def remove_expired(self):
+        from ..model import WebSession
+
+        return WebSession.remove_expired(_session_option('gc_batch_size', 1000))
+
+
+class JSONSecureCookie(SecureCookie):
+    serialization_method = json
+
+
+class SignedCookieSessionStore(SessionStore):
+    """ Keeps the session in the cookie itself, signed with [sessions] secret_key so it cannot be changed by the
+    browser, so any number of workers can serve a user without sharing anything. The session's sid is the signed
+    cookie, and is only worked out when the session is saved. Sessions should stay small, as the browser sends them
+    with every request """
+
+    def __init__(self, secret_key, lifetime):
+        SessionStore.__init__(self)
+        self.secret_key = secret_key
+        self.lifetime = lifetime
+
+    def new(self):
+        stored = JSONSecureCookie(secret_key=self.secret_key)
+        stored.sid = None
+        return stored
+
+    def get(self, sid):
+        stored = JSONSecureCookie.unserialize(sid, self.secret_key)
+        stored.sid = sid
+        issued = stored.pop('_issued', None)
+        if not stored:
+            # tampered with, expired or empty
+            return self.new()
+        stored.modified = issued is None or \
+            _needs_refresh(datetime.fromtimestamp(issued + self.lifetime), self.lifetime)
+        return stored
+
+    def save(self, stored):
+        data = dict(stored, _issued=int(time()))
+        stored.sid = JSONSecureCookie(data, self.secret_key).serialize(time() + self.lifetime)
+
+    def delete(self, stored):
+        pass
+
+    def remove_expired(self):
+        # nothing is kept on the server
+        return 0
+
+
+class ExpiringFilesystemSessionStore(FilesystemSessionStore):
+    """ Werkzeug's store of one file per session, with the same expiry as the other stores. Sessions cannot be shared
+    between hosts unless session_dir is on a shared disk """
+
+    def __init__(self, lifetime, session_dir=None):
+        FilesystemSessionStore.__init__(self, session_dir)
+        self.lifetime = lifetime
+
+    def _expires(self, sid):
+        file_name = self.get_session_filename(sid)
+        if not path.exists(file_name):
+            return None
+        return datetime.fromtimestamp(path.getmtime(file_name) + self.lifetime)
+
+    def get(self, sid):
+        if not self.is_valid_key(sid):
+            return self.new()
+        expires = self._expires(sid)
+        if expires is None or expires <= datetime.now():
+            return self.new()
+        stored = FilesystemSessionStore.get(self, sid)
+        stored.modified = _needs_refresh(expires, self.lifetime)
+        return stored
+
+    def remove_expired(self):
+        num_removed = 0
+        now = datetime.now()
+        for sid in self.list():
+            expires = self._expires(sid)
+            if expires is not None and expires <= now:
+                try:
+                    remove(self.get_session_filename(sid))
+                except OSError:
+                    continue
+                num_removed += 1
+        return num_removed
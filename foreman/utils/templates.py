@@ -0,0 +1,56 @@
+# python imports
+from os import path, walk, makedirs
+# library imports
+from mako.lookup import TemplateLookup
+# local imports
+from utils import config, ROOT_DIR
+
+TEMPLATE_DIR = path.join(ROOT_DIR, 'templates')
+
+
+def _template_option(option, default):
+    if config.has_option('templates', option):
+        return config.get('templates', option)
+    return default
+
+
+def template_module_dir():
+    """ Where the templates are kept once compiled to python modules, so each process that starts loads them instead
+    of compiling them again. Default: template_modules in the Foreman folder """
+    module_dir = _template_option('module_dir', path.join(ROOT_DIR, 'template_modules'))
+    if not path.exists(module_dir):
+        makedirs(module_dir)
+    return module_dir
+
+
+def preload_templates():
+    """ Whether every template is loaded when the application starts, rather than on the first request that uses it """
+    return config.has_option('templates', 'preload') and config.getboolean('templates', 'preload')
+
+
+def make_template_lookup():
+    filesystem_checks = not config.has_option('templates', 'filesystem_checks') or \
+        config.getboolean('templates', 'filesystem_checks')
+    return TemplateLookup(directories=[TEMPLATE_DIR], module_directory=template_module_dir(),
+                          filesystem_checks=filesystem_checks,
+                          collection_size=int(_template_option('collection_size', -1)),
+                          output_encoding='utf-8', input_encoding='utf-8')
+
+
+def template_names():
+    """ The names of all the templates, as they are passed to lookup.get_template """
+    names = []
+    for directory, unused_dirs, file_names in walk(TEMPLATE_DIR):
+        for file_name in file_names:
+            if file_name.endswith('.html'):
+                names.append(path.relpath(path.join(directory, file_name), TEMPLATE_DIR))
+    return sorted(names)
+
+
+def compile_templates(lookup):
+    """ Load every template into lookup, compiling those whose module is missing or older than the template. Returns
+    the number of templates loaded """
+    names = template_names()
+    for name in names:
+        lookup.get_template(name)
+    return len(names)
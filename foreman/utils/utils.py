@@ -1,11 +1,14 @@
 # python imports
-from os import path, mkdir
+from os import path, mkdir, makedirs, fdopen, rename, remove, fsync, chmod, umask
 from ConfigParser import ConfigParser
+from tempfile import mkstemp
+import hashlib
 import random
+import shutil
 import string
 # library imports
 from werkzeug import Local, LocalManager
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, select, func, and_
 from sqlalchemy.orm import scoped_session, sessionmaker
 
 # Useful variables
@@ -54,15 +57,77 @@ def setup(config_file):
 
 
 def init_database():
-    from ..model import Base
+    from ..model import Base, SearchIndex
 
     Base.metadata.create_all(db)
+    SearchIndex.create(db)
     print "Database initialised."
 
 
+def add_indexes(merge_duplicates=False):
+    """ Create the tables and indexes declared on the models that are missing from an existing database, e.g. after
+    upgrading Foreman. A unique index is not created over rows that would break it: they are listed and nothing more
+    is done, unless merge_duplicates is set. """
+    from ..model import Base, SearchIndex, UserHierarchy, NamePool
+
+    inspector = inspect(db)
+    existing_tables = inspector.get_table_names()
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            table.create(db)
+            print "Table {} created.".format(table.name)
+            if table is UserHierarchy.__table__:
+                UserHierarchy.rebuild()
+                print "Manager hierarchy filled in from the existing users."
+            elif table is NamePool.__table__:
+                print "{} names imported from the existing case and task name lists.".format(
+                    NamePool.import_existing())
+            continue
+        existing_indexes = [index['name'] for index in inspector.get_indexes(table.name)]
+        for index in sorted(table.indexes, key=lambda i: i.name):
+            if index.name in existing_indexes:
+                print "Index {} already exists.".format(index.name)
+            else:
+                if index.unique:
+                    _check_duplicates(table, index, merge_duplicates)
+                index.create(db)
+                print "Index {} created.".format(index.name)
+    if "search_index" not in existing_tables:
+        SearchIndex.create(db)
+        print "Search index created. Run rebuild_search_index to add the existing data to it."
+
+
+def _check_duplicates(table, index, merge):
+    """ Stop if there are rows that would break a new unique index, after listing them. With merge, each group of
+    duplicates is instead made into its newest row, adding up their hours if the table has them """
+    columns = list(index.columns)
+    groups = db.execute(select(columns + [func.count()]).group_by(*columns).having(func.count() > 1)).fetchall()
+    if not groups:
+        return
+    names = [column.name for column in columns]
+    for group in groups:
+        print "{} rows in {} have {}.".format(group[-1], table.name,
+                                              ", ".join("{} {}".format(n, v) for n, v in zip(names, group)))
+    if not merge:
+        raise Exception('Index {} was not created, as {} groups of rows in {} would break it. Correct them, or run '
+                        'add_indexes again with --merge-duplicates to merge each group into its newest row'.format(
+                            index.name, len(groups), table.name))
+
+    for group in groups:
+        in_group = and_(*[column == value for column, value in zip(columns, group)])
+        newest = db.execute(select([func.max(table.c.id)]).where(in_group)).scalar()
+        if 'hours' in table.c:
+            hours = db.execute(select([func.sum(table.c.hours)]).where(in_group)).scalar()
+            db.execute(table.update().where(table.c.id == newest).values(hours=hours))
+        db.execute(table.delete().where(and_(in_group, table.c.id != newest)))
+    print "{} groups of duplicate rows merged in {}.".format(len(groups), table.name)
+
+
 def drop_database():
-    from ..model import Base
+    from ..model import Base, SearchIndex
 
+    # dropped first, as the search index can be made up of several tables that must be dropped together
+    SearchIndex.drop(db)
     Base.metadata.reflect(db)
     Base.metadata.drop_all(db)
 
@@ -91,6 +156,20 @@ def populate_test_database():
     print "Example data populated!"
 
 
+def generate_load(num_cases, tasks_per_case, notes_per_task, num_users=None, evidence_per_case=1, seed=None):
+    from load_population import generate_load
+    num_rows = generate_load(num_cases, tasks_per_case, notes_per_task, num_users, evidence_per_case, seed)
+    print "{} rows of load data added!".format(num_rows)
+    # the rows were inserted directly, without the ORM events that keep the search index up to date
+    rebuild_search_index()
+
+
+def rebuild_search_index():
+    from ..model import SearchIndex
+    num_indexed = SearchIndex.rebuild()
+    print "{} rows added to the search index.".format(num_indexed)
+
+
 def multidict_to_dict(md):
     d = {}
     for k, a in md.iterlists():
@@ -101,18 +180,155 @@ def multidict_to_dict(md):
     return d
 
 
-def upload_file(f, new_directory, rand=15):
-    unused_file_name, file_ext = path.splitext(f.filename.split(path.sep)[-1])
+def upload_buffer_size():
+    if config.has_option('uploads', 'buffer_size'):
+        return config.getint('uploads', 'buffer_size')
+    return 65536
+
+
+def chunked_upload_threshold():
+    """ Task uploads bigger than this many bytes are sent in chunks by the browser """
+    if config.has_option('uploads', 'chunked_upload_threshold'):
+        return config.getint('uploads', 'chunked_upload_threshold')
+    return 104857600
+
+
+def deduplicate_uploads():
+    """ Whether case, task and evidence uploads are kept in the content addressed store, see caseModel.StoredFile """
+    return config.has_option('uploads', 'deduplicate') and config.getboolean('uploads', 'deduplicate')
+
+
+def upload_temp_dir():
+    """ Where uploads are written while they arrive. It should be on the same file system as the files folder, so
+    that finished uploads can be renamed into place rather than copied """
+    if config.has_option('uploads', 'temp_dir'):
+        temp_dir = config.get('uploads', 'temp_dir')
+    else:
+        temp_dir = path.join(ROOT_DIR, 'tmp_uploads')
+    if not path.exists(temp_dir):
+        makedirs(temp_dir)
+    return temp_dir
+
+
+def file_hasher():
+    return hashlib.new(config.get('forensics', 'hash_type').lower())
+
+
+def hash_file(file_path):
+    hasher = file_hasher()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(upload_buffer_size()), ""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+# the umask can only be read by setting it, so it is read once while the module is imported rather than while other
+# threads may be creating files
+UMASK = umask(0)
+umask(UMASK)
+
+
+def set_file_permissions(file_path):
+    """ Give file_path the permissions a file made with open() would have. mkstemp makes files only their owner can
+    read, which would stop a front end server running as another user from sending uploads """
+    chmod(file_path, 0666 & ~UMASK)
+
+
+def move_file(source, destination):
+    """ Rename source to destination, which is atomic on the same file system. Otherwise the file is copied under a
+    temporary name next to destination first, so a half copied file is never seen at destination. """
+    try:
+        set_file_permissions(source)
+        rename(source, destination)
+    except OSError:
+        fd, temp_path = mkstemp(dir=path.dirname(destination), prefix='.upload-')
+        with fdopen(fd, 'wb') as temp_file, open(source, 'rb') as source_file:
+            shutil.copyfileobj(source_file, temp_file, upload_buffer_size())
+        set_file_permissions(temp_path)
+        rename(temp_path, destination)
+        remove(source)
+
+
+class UploadStream(object):
+    """ The file Werkzeug writes an uploaded file to as the request is read, used in place of its default temporary
+    file. The upload is hashed as it is written, and kept in the temp folder for uploads so it can be moved into place
+    without being read or copied again. It is deleted when the request is closed if it has not been moved. """
+
+    def __init__(self):
+        fd, self.name = mkstemp(dir=upload_temp_dir(), prefix='upload-')
+        self.file = fdopen(fd, 'w+b')
+        self.hasher = file_hasher()
+        self.moved = False
+
+    def write(self, data):
+        self.hasher.update(data)
+        self.file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+    def __iter__(self):
+        return iter(self.file)
+
+    def move(self, destination):
+        """ Move the upload to destination and return its hash """
+        self.file.flush()
+        fsync(self.file.fileno())
+        self.file.close()
+        move_file(self.name, destination)
+        self.moved = True
+        return self.hasher.hexdigest()
+
+    def close(self):
+        self.file.close()
+        if not self.moved and path.exists(self.name):
+            remove(self.name)
+
+
+def save_stream(stream, destination):
+    """ Write stream to destination, hashing it on the way. The file only appears at destination once it has all been
+    written. Returns its hash """
+    hasher = file_hasher()
+    fd, temp_path = mkstemp(dir=path.dirname(destination), prefix='.upload-')
+    try:
+        with fdopen(fd, 'wb') as temp_file:
+            for block in iter(lambda: stream.read(upload_buffer_size()), ""):
+                hasher.update(block)
+                temp_file.write(block)
+        set_file_permissions(temp_path)
+        rename(temp_path, destination)
+    except Exception:
+        if path.exists(temp_path):
+            remove(temp_path)
+        raise
+    return hasher.hexdigest()
+
+
+def random_file_name(file_name, rand=15):
+    unused_file_name, file_ext = path.splitext(file_name.split(path.sep)[-1])
     # make random file name that is 15 characters/numbers long to prevent 2 users uploading same
     # file at same time
-    file_name = ''.join(random.SystemRandom().choice(
-        string.ascii_uppercase + string.digits) for _ in range(rand)) + file_ext
+    return ''.join(random.SystemRandom().choice(string.ascii_uppercase + string.digits) for _ in range(rand)) + \
+        file_ext
+
 
+def upload_file_with_hash(f, new_directory, rand=15):
+    """ Store the uploaded file f in new_directory under a random name. Returns the new name and the hash of the
+    file, which is worked out while the file is saved rather than by reading it back afterwards """
+    file_name = random_file_name(f.filename, rand)
     new_location = path.join(new_directory, file_name)
 
     if not path.exists(new_directory):
         mkdir(new_directory)
-    f.save(new_location)
+    if isinstance(f.stream, UploadStream):
+        file_hash = f.stream.move(new_location)
+    else:
+        f.stream.seek(0)
+        file_hash = save_stream(f.stream, new_location)
     f.close()
 
-    return file_name
\ No newline at end of file
+    return file_name, file_hash
+
+
+def upload_file(f, new_directory, rand=15):
+    return upload_file_with_hash(f, new_directory, rand)[0]
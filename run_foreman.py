@@ -36,6 +36,76 @@ def setup(args):
         create_admin_user()
 
 
+def indexes(args):
+    """ Add any missing indexes to an existing database without dropping it """
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=sa_exc.SAWarning)
+        from foreman.utils.utils import add_indexes, setup
+        setup(args.config_file)
+        add_indexes(args.merge_duplicates)
+
+
+def search_index(args):
+    """ Build the search index from the data already in the database """
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=sa_exc.SAWarning)
+        from foreman.utils.utils import rebuild_search_index, setup
+        setup(args.config_file)
+        rebuild_search_index()
+
+
+def verify_integrity(args):
+    """ Hash the uploads and task notes again and record whether they still match """
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=sa_exc.SAWarning)
+
+        import foreman.utils.utils
+        foreman.utils.utils.setup(args.config_file)
+
+        from foreman.utils.integrity import integrity_report
+        integrity_report(args.processes)
+
+
+def deduplicate_uploads(args):
+    """ Move the existing uploads into the content addressed store """
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=sa_exc.SAWarning)
+
+        import foreman.utils.utils
+        foreman.utils.utils.setup(args.config_file)
+
+        from foreman.model import StoredFile
+        num_moved, num_left = StoredFile.add_existing_uploads()
+        print "{} uploads moved into the store. {} did not match their hash and were left.".format(num_moved,
+                                                                                                 num_left)
+
+
+def compile_templates(args):
+    """ Compile every template ahead of time, so the first requests after an upgrade are not slowed down """
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=sa_exc.SAWarning)
+
+        import foreman.utils.utils
+        foreman.utils.utils.setup(args.config_file)
+
+        from foreman.controllers.baseController import lookup
+        from foreman.utils.templates import compile_templates, template_module_dir
+        num_compiled = compile_templates(lookup)
+        print "{} templates compiled into {}.".format(num_compiled, template_module_dir())
+
+
+def mail_worker(args):
+    """ Send the emails queued by Foreman when queue_email is turned on """
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=sa_exc.SAWarning)
+
+        import foreman.utils.utils
+        foreman.utils.utils.setup(args.config_file)
+
+        from foreman.utils.mail import mail_worker
+        mail_worker(args.once)
+
+
 def example(args):
     """ Initialise database and set up an example system """
     with warnings.catch_warnings():
@@ -47,6 +117,27 @@ def example(args):
         populate_database()
 
 
+def load(args):
+    """ Add a large amount of generated data to an existing database """
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=sa_exc.SAWarning)
+        from foreman.utils.utils import generate_load, setup
+        setup(args.config_file)
+        generate_load(args.cases, args.tasks_per_case, args.notes_per_task, args.users, args.evidence_per_case,
+                      args.seed)
+
+
+def benchmark(args):
+    """ Time the main pages of Foreman against the database in the config file """
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=sa_exc.SAWarning)
+        import foreman.utils.utils
+        foreman.utils.utils.setup(args.config_file)
+
+        from foreman.utils.benchmark import run_benchmark
+        run_benchmark(args.user, args.route, args.repeat)
+
+
 def run_tests(args):
     """ Initialise database, set up example test system and run tests """
     with warnings.catch_warnings():
@@ -104,10 +195,66 @@ if __name__ == '__main__':
     setup_ex_parser.add_argument('config_file')
     setup_ex_parser.set_defaults(func=example)
 
+    indexes_parser = subparsers.add_parser('add_indexes', help='Add missing tables and indexes to an existing database')
+    indexes_parser.add_argument('--merge-duplicates', action='store_true',
+                                help='Merge the rows that would break a new unique index into the newest of them, '
+                                     'adding up their hours. Otherwise they are listed and no index is added')
+    indexes_parser.add_argument('config_file')
+    indexes_parser.set_defaults(func=indexes)
+
+    search_parser = subparsers.add_parser('rebuild_search_index', help='Build the search index from the existing '
+                                                                      'data, e.g. after upgrading Foreman')
+    search_parser.add_argument('config_file')
+    search_parser.set_defaults(func=search_index)
+
     scheduled_tasks = subparsers.add_parser('scheduled_tasks', help='Run this in a CRON job / task scheduler')
     scheduled_tasks.add_argument('config_file')
     scheduled_tasks.set_defaults(func=scheduler)
 
+    integrity_parser = subparsers.add_parser('verify_integrity', help='Check the uploaded files and task notes have '
+                                                                      'not changed since they were added')
+    integrity_parser.add_argument('--processes', type=int, default=None,
+                                  help='Number of processes hashing files. Default: one per CPU')
+    integrity_parser.add_argument('config_file')
+    integrity_parser.set_defaults(func=verify_integrity)
+
+    dedup_parser = subparsers.add_parser('deduplicate_uploads', help='Move existing uploads into the store, so files '
+                                                                     'uploaded more than once are only kept once')
+    dedup_parser.add_argument('config_file')
+    dedup_parser.set_defaults(func=deduplicate_uploads)
+
+    templates_parser = subparsers.add_parser('compile_templates', help='Compile the templates ahead of time. Run this '
+                                                                      'after upgrading Foreman')
+    templates_parser.add_argument('config_file')
+    templates_parser.set_defaults(func=compile_templates)
+
+    mail_parser = subparsers.add_parser('mail_worker', help='Send queued emails. Keep this running when queue_email is on')
+    mail_parser.add_argument('--once', action='store_true', help='Send the emails that are due and then stop, '
+                                                                 'e.g. when run from a CRON job')
+    mail_parser.add_argument('config_file')
+    mail_parser.set_defaults(func=mail_worker)
+
+    load_parser = subparsers.add_parser('generate_load', help='Add generated cases, tasks, notes and evidence to an '
+                                                              'existing database, for performance testing')
+    load_parser.add_argument('--cases', type=int, default=1000)
+    load_parser.add_argument('--tasks-per-case', type=int, default=3)
+    load_parser.add_argument('--notes-per-task', type=int, default=5)
+    load_parser.add_argument('--evidence-per-case', type=int, default=1)
+    load_parser.add_argument('--users', type=int, default=None, help='Default: one user for every 10 cases')
+    load_parser.add_argument('--seed', type=int, default=None, help='Random seed, to generate the same data again')
+    load_parser.add_argument('config_file')
+    load_parser.set_defaults(func=load)
+
+    benchmark_parser = subparsers.add_parser('benchmark', help='Report the response times and query counts of the '
+                                                               'main pages')
+    benchmark_parser.add_argument('--repeat', type=int, default=10, help='Requests per page. Default: 10')
+    benchmark_parser.add_argument('--user', type=int, default=None, help='Id of the user to view the pages as. '
+                                                                         'Default: the first administrator')
+    benchmark_parser.add_argument('--route', action='append', default=None,
+                                  help='Page to time instead of the defaults. Can be given more than once')
+    benchmark_parser.add_argument('config_file')
+    benchmark_parser.set_defaults(func=benchmark)
+
     test_parser = subparsers.add_parser('run_tests', help='Run functional & unit tests',
                                         description='If all the optional test arguments are False, they will all be run.')
     test_parser.add_argument('--test_urls', default='False', help='Test the foreman URLs. Default: False. Set TEST_URLS to True')